@@ -7,7 +7,7 @@ import platform
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-from jackdaw import windows, track, block, doc, sampler
+from jackdaw import windows, track, block, doc, sampler, debug
 
 class App(QApplication):
   def __init__(self):
@@ -23,6 +23,8 @@ class App(QApplication):
       self._window.document = doc.Document()
     # start the sampler engine
     sampler.LinuxSampler.start()
+    # write profiles periodically if requested
+    self._profile_dumper = debug.dump_from_environment()
 
 app = App()
 sys.exit(app.exec_())
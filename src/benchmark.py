@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# time the model, playback, and view hot paths on synthetic documents and
+#  write the results as JSON so they can be compared across commits
+#
+# usage: ./benchmark.py [options] [-o results.json]
+
+import io
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# run on the simulated JACK server unless told otherwise, so the results
+#  don't depend on a server being available or on its load
+os.environ.setdefault('JACKDAW_BACKEND', 'fake')
+
+from PySide.QtCore import *
+
+from jackdaw import block, track, doc, undo, bounce, smf
+
+# SYNTHETIC DOCUMENTS #########################################################
+
+# make a block with the given number of notes, with pitch bends on some
+#  of them and a control change for every few notes
+def make_block(rng, notes, time=0.0, spacing=0.125):
+  events = list()
+  for i in range(notes):
+    t = i * spacing
+    bend = None
+    if (rng.random() < 0.1):
+      bend = [ (0.0, 0.0), (spacing, rng.uniform(-2.0, 2.0)) ]
+    events.append(block.Note(time=t, pitch=rng.randint(36, 96),
+      velocity=rng.random(), duration=spacing * rng.uniform(0.5, 2.0),
+      bend=bend))
+    if (i % 4 == 0):
+      events.append(block.CCSet(time=t, number=rng.choice((1, 7, 11, 64)),
+        value=rng.random()))
+  duration = notes * spacing
+  return(block.Block(block.EventList(events, duration=duration),
+                     time=time, duration=duration))
+
+# make a track with blocks placed end to end
+def make_track(rng, blocks, notes, transport=None):
+  track_blocks = list()
+  t = 0.0
+  for i in range(blocks):
+    b = make_block(rng, notes, time=t)
+    track_blocks.append(b)
+    t += b.duration
+  return(track.Track(blocks=track_blocks, transport=transport))
+
+# make a document with a sequencer of the given size
+def make_document(tracks, blocks, notes, seed=0):
+  rng = random.Random(seed)
+  document = doc.Document()
+  track_list = track.TrackList(
+    tracks=[ make_track(rng, blocks, notes, document.transport)
+             for i in range(tracks) ],
+    transport=document.transport)
+  document.units.append(track.SequencerUnit(tracks=track_list,
+    view_scale=document.view_scale, transport=document.transport,
+    name='Sequencer'))
+  return(document)
+
+# get all tracks in a document
+def tracks_of(document):
+  tracks = list()
+  for unit in document.units:
+    if (isinstance(unit, track.SequencerUnit)):
+      tracks.extend(unit.tracks)
+  return(tracks)
+
+# BENCHMARKS ##################################################################
+
+# construct event lists from unsorted events
+def bench_event_list(document):
+  events = list()
+  for t in tracks_of(document):
+    for b in t:
+      events.append(list(b.events))
+  for e in events:
+    random.Random(0).shuffle(e)
+  def run():
+    for e in events:
+      block.EventList(e)
+  return(run)
+
+# recompute cached times of all tracks
+def bench_track_times(document):
+  tracks = tracks_of(document)
+  def run():
+    for t in tracks:
+      t.invalidate()
+      t.times
+      t.snap_times
+  return(run)
+
+# schedule one tick of playback on every track, reporting the time per tick
+def bench_output_send(document, ticks=100):
+  tracks = tracks_of(document)
+  def run():
+    transport = bounce.VirtualTransport()
+    handlers = [ track.TrackOutputHandler(port=t.source_port, track=t,
+                                          transport=transport)
+                 for t in tracks ]
+    transport.playing = True
+    start = time.time()
+    for i in range(ticks):
+      transport.time += bounce.DEFAULT_INTERVAL
+    elapsed = time.time() - start
+    transport.playing = False
+    for handler in handlers:
+      handler.transport = None
+    return(elapsed / ticks)
+  return(run)
+
+# store the undoable state of all tracks
+def bench_undo_save_state(document):
+  tracks = tracks_of(document)
+  def run():
+    undo.UndoStack().save_state(tuple(tracks))
+  return(run)
+
+# save and load the document in both formats
+def bench_save(document, extension):
+  def run():
+    directory = tempfile.mkdtemp(prefix='jackdaw-benchmark')
+    try:
+      document.path = os.path.join(directory, 'document'+extension)
+      document.save()
+    finally:
+      shutil.rmtree(directory)
+  return(run)
+def bench_load(document, extension):
+  directory = tempfile.mkdtemp(prefix='jackdaw-benchmark')
+  path = os.path.join(directory, 'document'+extension)
+  document.path = path
+  document.save()
+  def run():
+    doc.Document.get_from_path(path)
+  def cleanup():
+    shutil.rmtree(directory)
+  return(run, cleanup)
+
+# import a standard MIDI file with the given number of notes, each with a
+#  note on and note off, into an event list or a list of tracks
+def bench_smf_import(notes, read, seed=0):
+  rng = random.Random(seed)
+  events = [ block.Note(time=i * 0.01, pitch=rng.randint(36, 96),
+               velocity=rng.random(), duration=0.005)
+             for i in range(notes) ]
+  data = b''.join(smf.write_events(
+    block.EventList(events, duration=notes * 0.01)))
+  def run():
+    read(io.BytesIO(data))
+  return(run)
+
+# lay out the notes of every block on an offscreen scene
+def bench_note_layout(document):
+  from PySide.QtGui import QGraphicsScene, QGraphicsRectItem
+  from jackdaw import block_view
+  scene = QGraphicsScene()
+  layouts = list()
+  for t in tracks_of(document):
+    for b in t:
+      parent = QGraphicsRectItem()
+      scene.addItem(parent)
+      layout = block_view.NoteLayout(parent, b.events.notes, t)
+      layout.setRect(QRectF(0.0, 0.0, b.events.duration, len(t.pitches)))
+      layouts.append(layout)
+  def run():
+    for layout in layouts:
+      layout.layout()
+  return(run)
+
+# run a benchmark, returning a dict of statistics
+def measure(setup, repeat):
+  cleanup = None
+  run = setup()
+  if (type(run) is tuple):
+    (run, cleanup) = run
+  times = list()
+  try:
+    for i in range(repeat):
+      start = time.time()
+      result = run()
+      elapsed = time.time() - start
+      # benchmarks can report their own timing for part of a run
+      times.append(result if result is not None else elapsed)
+  finally:
+    if (cleanup is not None):
+      cleanup()
+  times.sort()
+  return({
+    'min': times[0],
+    'median': times[len(times) // 2],
+    'mean': sum(times) / len(times),
+    'repeat': repeat
+  })
+
+# get the current commit of the source tree, if it's in a git repository
+def get_commit():
+  try:
+    return(subprocess.check_output(('git', 'rev-parse', 'HEAD'),
+      cwd=os.path.dirname(os.path.abspath(__file__))).strip())
+  except (OSError, subprocess.CalledProcessError):
+    return(None)
+
+parser = argparse.ArgumentParser(
+  description='Benchmark JACKDAW on synthetic documents.')
+parser.add_argument('--tracks', type=int, default=16,
+  help='the number of tracks in the document')
+parser.add_argument('--blocks', type=int, default=8,
+  help='the number of blocks on each track')
+parser.add_argument('--notes', type=int, default=64,
+  help='the number of notes in each block')
+parser.add_argument('--smf-notes', type=int, default=50000,
+  help='the number of notes in the imported MIDI file')
+parser.add_argument('--repeat', type=int, default=5,
+  help='the number of times to run each benchmark')
+parser.add_argument('--seed', type=int, default=0,
+  help='the seed for generating documents')
+parser.add_argument('--views', action='store_true',
+  help='also benchmark views, which requires a display')
+parser.add_argument('--only', action='append', metavar='NAME',
+  help='run only the named benchmark (can be given more than once)')
+parser.add_argument('-o', '--output', metavar='PATH',
+  help='write results to a file instead of standard output')
+args = parser.parse_args()
+
+if (args.views):
+  from PySide.QtGui import QApplication
+  app = QApplication(sys.argv)
+else:
+  app = QCoreApplication(sys.argv)
+
+document = make_document(args.tracks, args.blocks, args.notes, args.seed)
+benchmarks = [
+  ('event_list', lambda: bench_event_list(document)),
+  ('track_times', lambda: bench_track_times(document)),
+  ('output_send_per_tick', lambda: bench_output_send(document)),
+  ('undo_save_state', lambda: bench_undo_save_state(document)),
+  ('save_yaml', lambda: bench_save(document, '.yml')),
+  ('save_pickle', lambda: bench_save(document, '.jdp')),
+  ('load_yaml', lambda: bench_load(document, '.yml')),
+  ('load_pickle', lambda: bench_load(document, '.jdp')),
+  ('smf_read_events', 
+    lambda: bench_smf_import(args.smf_notes, smf.read_events, args.seed)),
+  ('smf_read_tracks', 
+    lambda: bench_smf_import(args.smf_notes, smf.read_tracks, args.seed))
+]
+if (args.views):
+  benchmarks.append(('note_layout', lambda: bench_note_layout(document)))
+
+results = dict()
+for (name, setup) in benchmarks:
+  if ((args.only) and (name not in args.only)): continue
+  sys.stderr.write('%s...\n' % name)
+  results[name] = measure(setup, args.repeat)
+
+report = {
+  'commit': get_commit(),
+  'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+  'python': platform.python_version(),
+  'platform': platform.platform(),
+  'backend': os.environ['JACKDAW_BACKEND'],
+  'parameters': {
+    'tracks': args.tracks,
+    'blocks': args.blocks,
+    'notes': args.notes,
+    'smf_notes': args.smf_notes,
+    'seed': args.seed
+  },
+  'units': 'seconds',
+  'results': results
+}
+if (args.output):
+  with open(args.output, 'w') as f:
+    json.dump(report, f, indent=2, sort_keys=True)
+else:
+  json.dump(report, sys.stdout, indent=2, sort_keys=True)
+  sys.stdout.write('\n')
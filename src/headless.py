@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# run a document's transport, tracks, sampler, and routing without a GUI,
+#  for machines with no display
+#
+# usage: ./headless.py [options] document.jdp
+
+import sys
+import signal
+import argparse
+
+from PySide.QtCore import *
+
+from jackdaw import doc, sampler, debug
+
+class HeadlessApp(QCoreApplication):
+  def __init__(self, args):
+    QCoreApplication.__init__(self, sys.argv)
+    self.args = args
+    self.document = doc.Document.get_from_path(args.document)
+    if (self.document is None):
+      sys.stderr.write('ERROR: failed to load %s\n' % args.document)
+      sys.exit(1)
+    self.transport = self.document.transport
+    # start the sampler engine
+    sampler.LinuxSampler.start()
+    # write profiles periodically if requested
+    self._profile_dumper = debug.dump_from_environment()
+    # stop cleanly on Ctrl+C or a termination request, which requires
+    #  returning to the interpreter regularly so it can handle signals
+    signal.signal(signal.SIGINT, self.on_signal)
+    signal.signal(signal.SIGTERM, self.on_signal)
+    self._signal_timer = QTimer(self)
+    self._signal_timer.timeout.connect(lambda: None)
+    self._signal_timer.start(250)
+    # start the transport once the event loop is running
+    QTimer.singleShot(0, self.start)
+  def start(self):
+    if (self.args.start is not None):
+      self.transport.time = self.args.start
+    if (self.args.record):
+      self.transport.record()
+    elif (self.args.play):
+      self.transport.play()
+    if (self.args.duration is not None):
+      QTimer.singleShot(int(self.args.duration * 1000), self.finish)
+  def on_signal(self, signum, frame):
+    self.finish()
+  # stop the transport, save anything that was recorded, and exit
+  def finish(self):
+    recorded = self.transport.recording
+    self.transport.stop()
+    if ((recorded) and (not self.args.no_save)):
+      self.document.save()
+    sampler.LinuxSampler.stop()
+    self.quit()
+
+parser = argparse.ArgumentParser(
+  description='Run a JACKDAW document without a GUI.')
+parser.add_argument('document', help='the document to load')
+parser.add_argument('--play', action='store_true',
+  help='start playback after loading')
+parser.add_argument('--record', action='store_true',
+  help='start recording on armed tracks after loading')
+parser.add_argument('--start', type=float, metavar='SECONDS',
+  help='the time to start the transport at')
+parser.add_argument('--duration', type=float, metavar='SECONDS',
+  help='stop and exit after this many seconds')
+parser.add_argument('--no-save', action='store_true',
+  help="don't save the document after recording")
+
+app = HeadlessApp(parser.parse_args())
+sys.exit(app.exec_())
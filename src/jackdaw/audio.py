@@ -1,4 +1,4 @@
-import jackpatch
+from backend import jackpatch
 
 import observable
 import serializable
@@ -9,7 +9,7 @@ class SystemPlaybackUnit(unit.Sink, unit.Unit):
     unit.Unit.__init__(self, *args, **kwargs)
     unit.Sink.__init__(self)
     self._sink_type = 'stereo'
-    self._client = jackpatch.Client('jackdaw-playback')
+    self._client = unit.JackClient.client
     ports = self._client.get_ports(name_pattern='system:.*', 
                                    flags=jackpatch.JackPortIsInput)
     self._sink_port = tuple(ports)
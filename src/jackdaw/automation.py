@@ -0,0 +1,206 @@
+import math
+import bisect
+import unittest
+
+# ways a controller can get from the value at one breakpoint to the next
+# hold the value until the next breakpoint
+STEP = 'step'
+# move in a straight line to the next breakpoint's value
+LINEAR = 'linear'
+# ease in and out along a half cosine to the next breakpoint's value
+SMOOTH = 'smooth'
+MODES = (STEP, LINEAR, SMOOTH)
+
+# the largest difference between a thinned curve and the original, which
+#  is one step of a 7-bit controller
+THIN_TOLERANCE = 1.0 / 127.0
+# the longest time a step can last and still be taken as a sample of a
+#  value that was moving between breakpoints, as when a knob is turned,
+#  rather than a value that was being held
+THIN_GAP = 0.05
+
+# describe how a controller's value changes over time with breakpoints,
+#  each a tuple of (time, value, mode) where the mode says how the value
+#  gets to the next breakpoint's value; where several breakpoints share a
+#  time, the last one takes effect
+class Curve(object):
+  def __init__(self, points=()):
+    self.points = sorted(points, key=lambda p: p[0])
+    self._times = [ p[0] for p in self.points ]
+  def __len__(self):
+    return(len(self.points))
+  # get the index of the breakpoint in effect at the given time,
+  #  or -1 if the time is before the first breakpoint
+  def index_at(self, time):
+    return(bisect.bisect_right(self._times, time) - 1)
+  # get the value at the given time, or None if there is no value yet
+  def value_at(self, time):
+    index = self.index_at(time)
+    if (index < 0): return(None)
+    return(self.interpolate(index, time))
+  # get the value at a time that falls after the breakpoint at the index
+  def interpolate(self, index, time):
+    (t1, v1, mode) = self.points[index]
+    if ((mode == STEP) or (index + 1 >= len(self.points))): return(v1)
+    (t2, v2, next_mode) = self.points[index + 1]
+    if (t2 <= t1): return(v2)
+    x = min(max(0.0, (time - t1) / (t2 - t1)), 1.0)
+    if (mode == SMOOTH):
+      x = 0.5 - (0.5 * math.cos(x * math.pi))
+    return(v1 + ((v2 - v1) * x))
+  # get a tuple of (start time, start value, mode, end time, end value) for
+  #  the ramp that starts at the breakpoint with the given index, or None
+  #  if the value doesn't change until the next breakpoint
+  def ramp(self, index):
+    if ((index < 0) or (index + 1 >= len(self.points))): return(None)
+    (t1, v1, mode) = self.points[index]
+    if (mode == STEP): return(None)
+    (t2, v2, next_mode) = self.points[index + 1]
+    if ((t2 <= t1) or (v2 == v1)): return(None)
+    return((t1, v1, mode, t2, v2))
+  # get a list of tuples of (time, value) for times in the given range,
+  #  including every breakpoint and points along ramps at multiples of
+  #  the given resolution from the start of the ramp
+  def render(self, begin, end, resolution):
+    values = list()
+    points = self.points
+    index = max(0, self.index_at(begin))
+    while (index < len(points)):
+      (t, v, mode) = points[index]
+      if (t >= end): break
+      if (t >= begin):
+        values.append((t, v))
+      ramp = self.ramp(index)
+      if (ramp is not None):
+        stop = min(ramp[3], end)
+        k = max(1, int(math.ceil((begin - t) / resolution)))
+        rt = t + (k * resolution)
+        while (rt < stop):
+          values.append((rt, self.interpolate(index, rt)))
+          k += 1
+          rt = t + (k * resolution)
+      index += 1
+    return(values)
+
+# find a smaller set of breakpoints that stays within the given tolerance
+#  of the curve described by the given breakpoints in time order, 
+#  returning a list of tuples of (index, mode) for the breakpoints to 
+#  keep and the mode each should have, which can replace steps with ramps 
+#  where that's closer
+def thin(points, tolerance=THIN_TOLERANCE, gap=THIN_GAP):
+  curve = Curve(points)
+  points = curve.points
+  count = len(points)
+  # where breakpoints share a time, only the last one has any effect
+  indices = [ i for i in range(count)
+                if ((i + 1 >= count) or (points[i + 1][0] > points[i][0])) ]
+  # get the values that a simpler curve has to come close to, which are
+  #  the values on either side of each breakpoint (except after short
+  #  steps) and samples along any smooth ramps, since other ramps are 
+  #  straight between breakpoints
+  def limits(j):
+    i = indices[j]
+    before = indices[j - 1]
+    (t, v, mode) = points[i]
+    (pt, pv, pmode) = points[before]
+    samples = list()
+    if (pmode == SMOOTH):
+      for x in (0.25, 0.5, 0.75):
+        st = pt + ((t - pt) * x)
+        samples.append((st, curve.interpolate(before, st)))
+    if ((pmode != STEP) or (t - pt > gap)):
+      samples.append((t, curve.interpolate(before, t)))
+    samples.append((t, v))
+    return(samples)
+  kept = list()
+  a = 0
+  while (a < len(indices) - 1):
+    (ta, va, mode) = points[indices[a]]
+    # see how far the value can be held
+    step_to = a
+    for b in range(a + 1, len(indices)):
+      samples = limits(b)
+      if (any([ abs(v - va) > tolerance for (t, v) in samples[:-1] ])):
+        break
+      step_to = b
+      if (abs(samples[-1][1] - va) > tolerance): break
+    # see how far a straight line can go, keeping track of the range of
+    #  slopes that pass close enough to all values so far
+    line_to = a
+    low = float('-inf')
+    high = float('inf')
+    for b in range(a + 1, len(indices)):
+      (tb, vb, bmode) = points[indices[b]]
+      samples = limits(b)
+      for (t, v) in samples[:-1]:
+        dt = t - ta
+        low = max(low, (v - tolerance - va) / dt)
+        high = min(high, (v + tolerance - va) / dt)
+      slope = (vb - va) / (tb - ta)
+      if ((low <= slope) and (slope <= high)):
+        line_to = b
+      low = max(low, (vb - tolerance - va) / (tb - ta))
+      high = min(high, (vb + tolerance - va) / (tb - ta))
+      if (low > high): break
+    # use whichever reaches further, preferring to keep the original
+    #  shape of each segment
+    if (line_to > step_to):
+      kept.append((indices[a], LINEAR))
+      a = line_to
+    elif (step_to > a + 1):
+      kept.append((indices[a], STEP))
+      a = step_to
+    else:
+      kept.append((indices[a], mode))
+      a += 1
+  if (len(indices) > 0):
+    kept.append((indices[-1], points[indices[-1]][2]))
+  return(kept)
+
+class TestAutomation(unittest.TestCase):
+  def test_interpolation(self):
+    c = Curve([ (1.0, 0.0, LINEAR), (0.0, 0.5, STEP),
+                (2.0, 1.0, SMOOTH), (3.0, 0.0, LINEAR) ])
+    self.assertEqual(c.value_at(-1.0), None)
+    self.assertEqual(c.value_at(0.5), 0.5)
+    self.assertAlmostEqual(c.value_at(1.25), 0.25)
+    self.assertAlmostEqual(c.value_at(2.5), 0.5)
+    self.assertTrue(c.value_at(2.25) > 0.75)
+    self.assertEqual(c.value_at(10.0), 0.0)
+    self.assertEqual(c.ramp(0), None)
+    self.assertEqual(c.ramp(1), (1.0, 0.0, LINEAR, 2.0, 1.0))
+    self.assertEqual(c.ramp(3), None)
+  def test_render(self):
+    c = Curve([ (0.0, 0.0, LINEAR), (1.0, 1.0, STEP), (2.0, 0.0, STEP) ])
+    values = c.render(0.0, 3.0, 0.25)
+    self.assertEqual([ t for (t, v) in values ],
+                     [ 0.0, 0.25, 0.5, 0.75, 1.0, 2.0 ])
+    self.assertEqual(c.render(0.3, 0.8, 0.25), [ (0.5, 0.5), (0.75, 0.75) ])
+  def test_thin_steps(self):
+    points = [ (0.0, 0.5, STEP), (1.0, 0.5, STEP), (2.0, 0.5, STEP),
+               (3.0, 1.0, STEP), (3.0, 0.0, STEP), (4.0, 0.0, STEP) ]
+    self.assertEqual(thin(points), [ (0, STEP), (4, STEP), (5, STEP) ])
+  def test_thin_ramp(self):
+    # a recorded sweep becomes a ramp
+    points = [ (i * 0.01, round(i * 1.27) / 127.0, STEP)
+               for i in range(101) ]
+    points.append((5.0, 1.0, STEP))
+    kept = thin(points, 1.0 / 127.0)
+    self.assertTrue(len(kept) < 10)
+    self.assertEqual(kept[0], (0, LINEAR))
+    self.assertEqual(kept[-1], (101, STEP))
+    thinned = Curve([ (points[i][0], points[i][1], mode)
+                      for (i, mode) in kept ])
+    original = Curve(points)
+    for i in range(600):
+      t = i * 0.01
+      self.assertTrue(
+        abs(thinned.value_at(t) - original.value_at(t)) <= 1.0 / 127.0)
+  def test_thin_keeps_jumps(self):
+    # a pedal that's held shouldn't turn into a slow ramp
+    points = [ (0.0, 0.0, STEP), (5.0, 1.0, STEP), (6.0, 0.0, STEP) ]
+    self.assertEqual(thin(points), [ (0, STEP), (1, STEP), (2, STEP) ])
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
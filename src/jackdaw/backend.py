@@ -0,0 +1,12 @@
+import os
+
+# choose the implementation of the jackpatch interface to use, which can be
+#  set to 'fake' with the JACKDAW_BACKEND environment variable to run on an
+#  in-process simulation of JACK instead of a live server
+name = os.environ.get('JACKDAW_BACKEND', 'jack')
+if (name == 'fake'):
+  import fakejack as jackpatch
+elif (name == 'jack'):
+  import jackpatch
+else:
+  raise ImportError('unknown JACKDAW_BACKEND %r' % name)
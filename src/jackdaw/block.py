@@ -1,10 +1,12 @@
 import math
 import copy
+import bisect
 
 from PySide.QtCore import Signal
 
 import observable
 import serializable
+import automation
 from model import Model, ModelList
 
 # represents a single note event with time, pitch, velocity, and duration
@@ -14,7 +16,7 @@ from model import Model, ModelList
 class Note(Model):
   range_changed = Signal(object, tuple, tuple)
   def __init__(self, time=None, pitch=None, velocity=1, duration=0,
-                     bend=None, aftertouch=None):
+                     bend=None, aftertouch=None, timbre=None):
     Model.__init__(self)
     self._time = time
     self._duration = duration
@@ -22,6 +24,7 @@ class Note(Model):
     self._velocity = velocity
     self._bend = bend if bend is not None else list()
     self._aftertouch = aftertouch if aftertouch is not None else list()
+    self._timbre = timbre if timbre is not None else list()
     # track the number of full or partial semitones the note occupies above and 
     #  below its basic pitch due to bends
     self._bend_max = 0.0
@@ -109,6 +112,15 @@ class Note(Model):
   def add_aftertouch(self, time, velocity):
     self._aftertouch.append((time, velocity))
     self.on_change()
+  # a list of tuples of (time delta in seconds, value 0.0 to 1.0)
+  #  describing the note's timbre, which is sent as controller 74
+  #  on the note's channel following the MPE convention
+  @property
+  def timbre(self):
+    return(self._timbre)
+  def add_timbre(self, time, value):
+    self._timbre.append((time, value))
+    self.on_change()
   # define a copy operation for notes
   def __copy__(self):
     return(Note(time=self.time, 
@@ -125,18 +137,21 @@ class Note(Model):
       'velocity': self.velocity,
       'duration': self.duration,
       'bend': self.bend,
-      'aftertouch': self.aftertouch
+      'aftertouch': self.aftertouch,
+      'timbre': self.timbre
     })
 serializable.add(Note)
 
 # represents a single control-change message with time, controller number, 
 #  and controller value
 class CCSet(Model):
-  def __init__(self, time=None, number=None, value=None):
+  def __init__(self, time=None, number=None, value=None, 
+                     interpolation=automation.STEP):
     Model.__init__(self)
     self._time = time
     self._number = number
     self._value = value
+    self._interpolation = interpolation
   # the time relative to the beginning of its container when the 
   #  controller setting takes effect (in seconds)
   @property
@@ -162,22 +177,43 @@ class CCSet(Model):
     if (self._value != value):
       self._value = value
       self.on_change()
+  # how the controller gets from this value to the next one on the same
+  #  controller (see the modes in the automation module)
+  @property
+  def interpolation(self):
+    return(self._interpolation)
+  @interpolation.setter
+  def interpolation(self, value):
+    if (self._interpolation != value):
+      self._interpolation = value
+      self.on_change()
   # define a copy operation for control change messages
   def __copy__(self):
     return(CCSet(time=self.time, 
                  number=self.number,
-                 value=self.value))
+                 value=self.value,
+                 interpolation=self.interpolation))
   def __repr__(self):
-    return('CCSet(time=%0.9g, number=%d, value=%0.9g)' %
-            (self.time, self.number, self.value))
+    return('CCSet(time=%0.9g, number=%d, value=%0.9g, interpolation=%s)' %
+            (self.time, self.number, self.value, self.interpolation))
   def serialize(self):
     return({ 
       'time': self.time,
       'number': self.number,
-      'value': self.value
+      'value': self.value,
+      'interpolation': self.interpolation
     })
 serializable.add(CCSet)
 
+# a list of notes that reports when notes are added or removed, but not each
+#  change to the notes themselves, which anything that cares can observe
+#  directly, so that adding a note doesn't have to connect to it
+class NoteList(observable.List):
+  def _add_item(self, item):
+    pass
+  def _remove_item(self, item):
+    pass
+
 # represents a series of events grouped into a logical block with a duration
 class EventList(ModelList):
   def __init__(self, events=(), hue=None, duration=60, divisions=1):
@@ -185,12 +221,14 @@ class EventList(ModelList):
     self._divisions = divisions
     self._pitches = [ ]
     self._note_counts = dict()
-    self._notes = observable.List()
+    self._notes = NoteList()
     self._controllers = [ ]
     self._controller_counts = dict()
     self._ccsets_by_number = dict()
+    self._curves = dict()
     self._hue = hue
-    ModelList.__init__(self, events)
+    ModelList.__init__(self)
+    self._add_sorted_items(sorted(events, key=lambda e: e.time))
   # the total length of time the events occur in (in seconds)
   @property
   def duration(self):
@@ -253,6 +291,26 @@ class EventList(ModelList):
     if ((len(self) >= 2) and (self[-1] is item) and
         (item.time < self[-2].time)):
       self.sort(key=lambda e: e.time)
+  # add events that are already in time order all at once, which is how
+  #  large lists like imported files are built, skipping the checks for
+  #  out-of-order events that _add_item makes for each one
+  def _add_sorted_items(self, items):
+    notes = list()
+    on_range_changed = self._on_note_range_changed
+    on_change = self.on_change
+    for item in items:
+      if (isinstance(item, Note)):
+        notes.append(item)
+        on_range_changed(item, None, (item.min_pitch, item.max_pitch))
+        item.range_changed.connect(on_range_changed)
+      elif (isinstance(item, CCSet)):
+        self._add_controller_number(item.number)
+        self.ccsets_for_controller(item.number).append(item)
+      try:
+        item.add_observer(on_change)
+      except AttributeError: pass
+    self._items.extend(items)
+    self._notes.extend(notes)
   def _remove_item(self, item):
     # update the list of pitches
     if (isinstance(item, Note)):
@@ -267,38 +325,38 @@ class EventList(ModelList):
     ModelList._remove_item(self, item)
   # handle a change to a note's minimum or maximum pitch
   def _on_note_range_changed(self, item, old_range, new_range):
-    def apply_func_to_pitch_range(func, pitch_range):
-      if (pitch_range is None): return
-      (rmin, rmax) = pitch_range
-      if (rmin == rmax):
-        func(int(round(rmin)))
-      else:
-        slop = 0.25
-        for p in range(int(math.floor(rmin)), int(math.ceil(rmax)) + 1):
-          if ((p >= rmin - slop) and (p <= rmax + slop)):
-            func(p)
-    apply_func_to_pitch_range(self._remove_pitch, old_range)
-    apply_func_to_pitch_range(self._add_pitch, new_range)
+    if (old_range is not None):
+      self._apply_func_to_pitch_range(self._remove_pitch, old_range)
+    self._apply_func_to_pitch_range(self._add_pitch, new_range)
+  def _apply_func_to_pitch_range(self, func, pitch_range):
+    (rmin, rmax) = pitch_range
+    if (rmin == rmax):
+      func(int(round(rmin)))
+    else:
+      slop = 0.25
+      for p in range(int(math.floor(rmin)), int(math.ceil(rmax)) + 1):
+        if ((p >= rmin - slop) and (p <= rmax + slop)):
+          func(p)
   # respond to a pitch being added to or removed from the list
   def _add_pitch(self, pitch):
-    if (pitch not in self._pitches):
-      self._pitches.append(pitch)
-      self._pitches.sort()
+    count = self._note_counts.get(pitch, 0)
+    if (count <= 0):
+      bisect.insort(self._pitches, pitch)
       self._note_counts[pitch] = 1
     else:
-      self._note_counts[pitch] += 1
+      self._note_counts[pitch] = count + 1
   def _remove_pitch(self, pitch):
     self._note_counts[pitch] -= 1
     if (self._note_counts[pitch] <= 0):
       self._pitches.remove(pitch)
   # respond to a control number being added to or removed from the list
   def _add_controller_number(self, number):
-    if (number not in self._controllers):
-      self._controllers.append(number)
-      self._controllers.sort()
+    count = self._controller_counts.get(number, 0)
+    if (count <= 0):
+      bisect.insort(self._controllers, number)
       self._controller_counts[number] = 1
     else:
-      self._controller_counts[number] += 1
+      self._controller_counts[number] = count + 1
   def _remove_controller_number(self, number):
     self._controller_counts[number] -= 1
     if (self._controller_counts[number] <= 0):
@@ -311,7 +369,8 @@ class EventList(ModelList):
     old_ccsets = self.ccsets_for_controller(source)
     old_ccsets.begin_change_block()
     for event in old_ccsets:
-      self.append(CCSet(time=event.time, number=dest, value=event.value))
+      self.append(CCSet(time=event.time, number=dest, value=event.value,
+                        interpolation=event.interpolation))
     for event in list(old_ccsets):
       self.remove(event)
     old_ccsets.end_change_block()
@@ -325,6 +384,35 @@ class EventList(ModelList):
     if (number not in self._ccsets_by_number):
       self._ccsets_by_number[number] = observable.List()
     return(self._ccsets_by_number[number])
+  # get a curve describing the given controller's value over time, which
+  #  is cached until the list or its events change
+  def curve_for_controller(self, number):
+    if (number not in self._curves):
+      self._curves[number] = automation.Curve([ 
+        (event.time, event.value, event.interpolation) 
+          for event in self.ccsets_for_controller(number) ])
+    return(self._curves[number])
+  # remove control changes on a controller that can be done without while
+  #  staying within the given tolerance of the original values, limited to 
+  #  the given range of times if any
+  def thin_controller(self, number, begin=None, end=None,
+                      tolerance=automation.THIN_TOLERANCE):
+    ccsets = sorted(self.ccsets_for_controller(number), 
+                    key=lambda e: e.time)
+    ccsets = [ event for event in ccsets 
+      if (((begin is None) or (event.time >= begin)) and 
+          ((end is None) or (event.time <= end))) ]
+    kept = automation.thin([ (event.time, event.value, event.interpolation)
+                               for event in ccsets ], tolerance)
+    if (len(kept) == len(ccsets)): return
+    modes = dict([ (ccsets[i], mode) for (i, mode) in kept ])
+    self.begin_change_block()
+    for event in ccsets:
+      if (event in modes):
+        event.interpolation = modes[event]
+      else:
+        self.remove(event)
+    self.end_change_block()
   # get a list of unique pitches for all notes in the list
   @property
   def pitches(self):
@@ -338,6 +426,7 @@ class EventList(ModelList):
   def invalidate(self):
     self._times = [ ]
     self._snap_times = [ ]
+    self._curves = dict()
   # lazily get a list of unique times for all notes in the list
   @property
   def times(self):
@@ -6,6 +6,7 @@ from PySide.QtGui import *
 import observable
 import view
 import block
+import automation
 from doc import ViewScale
 from undo import UndoManager
 
@@ -177,10 +178,10 @@ class ControllerLayout(view.ListLayout):
     self._track = track
     view.ListLayout.__init__(self, parent, events.controllers, 
                              lambda(n): ControllerView(self._events, n))
-    self._track.add_observer(self.layout)
+    self._track.add_observer(self._layout)
     self._events.add_observer(self.on_events_change)
   def destroy(self):
-    self._track.remove_observer(self.layout)
+    self._track.remove_observer(self._layout)
     self._events.remove_observer(self.on_events_change)
     view.ListLayout.destroy(self)
   def on_events_change(self):
@@ -227,6 +228,8 @@ class ControllerView(view.Interactive, view.ModelView):
     self._number = number
     view.ModelView.__init__(self, events, parent)
     view.Interactive.__init__(self)
+    # the range of times drawn over by dragging
+    self._drawn = None
   @property
   def events(self):
     return(self._model)
@@ -242,13 +245,9 @@ class ControllerView(view.Interactive, view.ModelView):
     qp.setBrush(self.brush())
     last_time = None
     last_value = None
-    for event in self.events.ccsets_for_controller(self.number):
-      try:
-        time = event.time
-        number = event.number
-        value = event.value
-      except AttributeError: continue
-      if (number != self._number): continue
+    # draw ramps in steps a couple of pixels wide
+    curve = self.events.curve_for_controller(self.number)
+    for (time, value) in curve.render(0.0, self.events.duration, 2.0 * px):
       if (last_time is None):
         last_time = time
       elif (time - last_time >= px):
@@ -270,6 +269,7 @@ class ControllerView(view.Interactive, view.ModelView):
       x += repeat_time
   def on_drag_start(self, event):
     UndoManager.begin_action(self.events)
+    self._drawn = None
   def on_drag(self, event, delta_x, delta_y):
     h = self.rect().height()
     ta = event.lastPos().x()
@@ -308,9 +308,23 @@ class ControllerView(view.Interactive, view.ModelView):
       self.events.append(block.CCSet(time=ta, number=self.number, value=va))
     if ((count < 2) and (not on_end)):
       self.events.append(block.CCSet(time=tb, number=self.number, value=vb))
+    # ramp between values along the line, leaving the value at the end 
+    #  of the line to continue as it did before
+    for ccset in ccsets:
+      if ((ccset.time >= t1) and (ccset.time < t2)):
+        ccset.interpolation = automation.LINEAR
     ccsets.end_change_block()
     self.events.end_change_block()
+    if (self._drawn is None):
+      self._drawn = (t1, t2)
+    else:
+      self._drawn = (min(t1, self._drawn[0]), max(t2, self._drawn[1]))
   def on_drag_end(self, event):
+    # replace the values added along the way with as few as will do
+    if (self._drawn is not None):
+      (begin, end) = self._drawn
+      self.events.thin_controller(self.number, begin, end)
+      self._drawn = None
     UndoManager.end_action()
 
 # do layout for notes in a block
@@ -318,9 +332,9 @@ class NoteLayout(view.ListLayout):
   def __init__(self, parent, notes, track):
     self._track = track
     view.ListLayout.__init__(self, parent, notes, lambda n: NoteView(n))
-    self._track.add_observer(self.layout)
+    self._track.add_observer(self._layout)
   def destroy(self):
-    self._track.remove_observer(self.layout)
+    self._track.remove_observer(self._layout)
     view.ListLayout.destroy(self)
   def layout(self):
     r = self.boundingRect()
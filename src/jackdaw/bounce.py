@@ -0,0 +1,111 @@
+import observable
+import schedule
+from track import SequencerUnit, TrackOutputHandler, ControllerTrackOutput
+
+# render tracks offline into a list of timestamped MIDI messages by running
+#  the same scheduling logic used for playback against a virtual clock,
+#  which makes it possible to test and compare scheduling without JACK
+
+# the interval to advance the virtual clock by, which matches the rate
+#  at which the live transport notifies observers while rolling
+DEFAULT_INTERVAL = 0.05
+
+# render the tracks of all sequencers in a document, returning a list of
+#  tuples of (time, track, port name, message) sorted by time
+def bounce_document(document, start=0.0, end=None, interval=DEFAULT_INTERVAL):
+  tracks = list()
+  for unit in document.units:
+    if (isinstance(unit, SequencerUnit)):
+      tracks.extend(unit.tracks)
+  return(bounce_tracks(tracks, start=start, end=end, interval=interval))
+
+# render the given tracks from the start time to the end time, which
+#  defaults to the end of the longest track, returning a list of tuples
+#  of (time, track, port name, message) sorted by time
+def bounce_tracks(tracks, start=0.0, end=None, interval=DEFAULT_INTERVAL):
+  if (end is None):
+    end = 0.0
+    for t in tracks:
+      end = max(end, t.duration)
+  transport = VirtualTransport(time=start, update_interval=interval)
+  messages = list()
+  handlers = list()
+  for t in tracks:
+    port = BouncePort(t, 'playback', transport, messages)
+    handlers.append(BounceOutputHandler(port, t, transport, messages))
+  transport.playing = True
+  while (transport.time < end):
+    transport.time = min(end, transport.time + interval)
+  transport.playing = False
+  for handler in handlers:
+    handler.transport = None
+  # sort by time, keeping messages at the same time in the order sent
+  messages.sort(key=lambda m: m[0])
+  return(messages)
+
+# stand in for the transport, with time that only moves when told to
+class VirtualTransport(observable.Object):
+  def __init__(self, time=0.0, update_interval=DEFAULT_INTERVAL):
+    observable.Object.__init__(self)
+    self.update_interval = update_interval
+    # updates are never late on a virtual clock, so this stays fixed
+    self.schedule_ahead = schedule.ScheduleAhead(update_interval)
+    self._time = time
+    self._playing = False
+  @property
+  def time(self):
+    return(self._time)
+  @time.setter
+  def time(self, value):
+    if (value != self._time):
+      self._time = value
+      self.on_change()
+  @property
+  def playing(self):
+    return(self._playing)
+  @playing.setter
+  def playing(self, value):
+    if (value != self._playing):
+      self._playing = value
+      self.on_change()
+  @property
+  def recording(self):
+    return(False)
+
+# stand in for a JACK port, collecting messages with their absolute time
+class BouncePort(object):
+  def __init__(self, track, name, transport, messages):
+    self.track = track
+    self.name = name
+    self.transport = transport
+    self.messages = messages
+  def send(self, data, time=0.0):
+    self.messages.append(
+      (self.transport.time + time, self.track, self.name, tuple(data)))
+  # drop messages for the port that haven't been "sent" yet,
+  #  like clearing the port's queue would
+  def clear_send(self):
+    now = self.transport.time
+    self.messages[:] = [ m for m in self.messages
+                           if ((m[1] is not self.track) or 
+                               (m[2] != self.name) or (m[0] <= now)) ]
+
+# schedule a track's output to bounce ports instead of its JACK ports
+class BounceOutputHandler(TrackOutputHandler):
+  def __init__(self, port, track, transport, messages):
+    self._messages = messages
+    # outputs for controllers, keyed by number
+    self._controller_outputs = dict()
+    TrackOutputHandler.__init__(self, port, track, transport)
+  # send controller values through outputs with the same settings as
+  #  the track's, so their state isn't shared with live playback
+  def _output_for_controller(self, number):
+    if (number not in self._controller_outputs):
+      template = self.track.output_for_controller(number)
+      output = ControllerTrackOutput(number, 
+        fine=template.fine, min_interval=template.min_interval,
+        resolution=template.resolution)
+      output.source_port = BouncePort(self.track,
+        'CC %d' % number, self.port.transport, self._messages)
+      self._controller_outputs[number] = output
+    return(self._controller_outputs[number])
@@ -0,0 +1,119 @@
+import collections
+import unittest
+
+# assign MIDI channels to voices (i.e. notes) so that each sounding voice
+#  can be bent independently, reusing the channel that has been free for
+#  the longest so that a channel's last note has as long as possible to
+#  release before the channel is bent for another; voices that won't be
+#  bent can instead stay on the channels already in use
+class ChannelAllocator(object):
+  def __init__(self, channels=range(16)):
+    self.channels = tuple(channels)
+    self.reset()
+  # free all channels
+  def reset(self):
+    # free channels, with ones never used first in order, followed by
+    #  the least recently released, mapped to whether they've been used
+    self._free = collections.OrderedDict(
+      [ (channel, False) for channel in self.channels ])
+    # the voice using each channel, with the least recently allocated first
+    self._voices = collections.OrderedDict()
+    # the channel used by each voice
+    self._channels = dict()
+  # get the number of channels in use
+  def __len__(self):
+    return(len(self._voices))
+  # get the channel a voice is using, or None if it has none
+  def channel_for(self, voice):
+    return(self._channels.get(voice, None))
+  # get a channel for the given voice, returning a tuple of the channel
+  #  and the voice it was taken from if all channels were in use; unless 
+  #  rotating, this is the most recently released channel, or the first
+  #  one never used if none have been released
+  def allocate(self, voice, rotate=True):
+    if (voice in self._channels):
+      return((self._channels[voice], None))
+    stolen = None
+    if (len(self._free) > 0):
+      if (rotate):
+        channel = self._free.popitem(last=False)[0]
+      else:
+        channel = next(reversed(self._free))
+        if (not self._free[channel]):
+          channel = next(iter(self._free))
+        del self._free[channel]
+    else:
+      (channel, stolen) = self._voices.popitem(last=False)
+      del self._channels[stolen]
+    self._voices[channel] = voice
+    self._channels[voice] = channel
+    return((channel, stolen))
+  # mark a voice as using a specific channel, for example when it was
+  #  allocated before and needs to be tracked again, taking the channel
+  #  from any other voice using it
+  def assign(self, voice, channel):
+    if ((channel not in self._free) and (channel not in self._voices)):
+      return
+    self.release(voice)
+    if (channel in self._voices):
+      del self._channels[self._voices.pop(channel)]
+    else:
+      del self._free[channel]
+    self._voices[channel] = voice
+    self._channels[voice] = channel
+  # free the channel a voice was using, returning the channel or None
+  #  if the voice wasn't using one
+  def release(self, voice):
+    channel = self._channels.pop(voice, None)
+    if (channel is None): return(None)
+    del self._voices[channel]
+    self._free[channel] = True
+    return(channel)
+
+class TestChannelAllocator(unittest.TestCase):
+  def test_distinct(self):
+    a = ChannelAllocator()
+    channels = [ a.allocate(voice)[0] for voice in range(16) ]
+    self.assertEqual(sorted(channels), range(16))
+    self.assertEqual(len(a), 16)
+    self.assertEqual(a.allocate(3), (channels[3], None))
+  def test_least_recently_released(self):
+    a = ChannelAllocator(range(4))
+    for voice in 'abcd':
+      a.allocate(voice)
+    a.release('c')
+    a.release('a')
+    self.assertEqual(a.allocate('e'), (2, None))
+    self.assertEqual(a.allocate('f'), (0, None))
+  def test_steal(self):
+    a = ChannelAllocator(range(2))
+    a.allocate('a')
+    a.allocate('b')
+    self.assertEqual(a.allocate('c'), (0, 'a'))
+    self.assertEqual(a.channel_for('a'), None)
+    self.assertEqual(a.release('a'), None)
+    self.assertEqual(a.release('b'), 1)
+  def test_without_rotation(self):
+    a = ChannelAllocator(range(4))
+    # notes that don't overlap stay on the first channel
+    for voice in 'abc':
+      self.assertEqual(a.allocate(voice, rotate=False), (0, None))
+      a.release(voice)
+    # overlapping notes spread out, then reuse the last one released
+    self.assertEqual(a.allocate('d', rotate=False), (0, None))
+    self.assertEqual(a.allocate('e', rotate=False), (1, None))
+    a.release('e')
+    a.release('d')
+    self.assertEqual(a.allocate('f', rotate=False), (0, None))
+    self.assertEqual(a.allocate('g'), (2, None))
+  def test_assign(self):
+    a = ChannelAllocator(range(2))
+    a.allocate('a')
+    a.assign('b', 0)
+    self.assertEqual(a.channel_for('a'), None)
+    self.assertEqual(a.channel_for('b'), 0)
+    self.assertEqual(a.allocate('c'), (1, None))
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
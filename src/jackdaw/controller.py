@@ -0,0 +1,108 @@
+import unittest
+
+# turn controller values between 0.0 and 1.0 into control change messages,
+#  remembering what was last sent so values that wouldn't change anything
+#  on the receiver can be dropped, and optionally holding back values that
+#  come too soon after the last one so dense automation doesn't flood the
+#  MIDI connection
+class ControllerEncoder(object):
+  def __init__(self, number, fine=False, min_interval=0.0):
+    self.number = number
+    # whether to send 14-bit values, with the least significant 7 bits
+    #  on the controller 32 above the main one, which only controllers
+    #  below 32 have
+    self.fine = fine
+    # the minimum number of seconds between sent values, or zero to send
+    #  every value that changes
+    self.min_interval = min_interval
+    self.reset()
+  # forget what was sent, so the next value will be sent regardless
+  def reset(self):
+    self._sent = None
+    self._sent_at = None
+    self._held = None
+  @property
+  def fine(self):
+    return(self._fine)
+  @fine.setter
+  def fine(self, value):
+    self._fine = (value and (self.number < 32))
+    self.reset()
+  # whether a value is being held back by rate limiting
+  @property
+  def holding(self):
+    return(self._held is not None)
+  # convert a value to an integer in the range of the controller
+  def quantize(self, value):
+    steps = 0x3FFF if self._fine else 0x7F
+    return(min(max(0, int(round(value * steps))), steps))
+  # get the messages needed to change the receiver to a quantized value
+  def messages(self, quantized):
+    if (not self._fine):
+      return([ (0xB0, self.number, quantized) ])
+    msb = (quantized >> 7) & 0x7F
+    lsb = quantized & 0x7F
+    # receivers reset the fine part of a value when the coarse part
+    #  changes, so the coarse part can only be skipped when it's the same
+    if ((self._sent is not None) and ((self._sent >> 7) == msb)):
+      return([ (0xB0, self.number + 32, lsb) ])
+    return([ (0xB0, self.number, msb), (0xB0, self.number + 32, lsb) ])
+  # get the messages to send for a new value at the given absolute time,
+  #  which are none if the value wouldn't change or is being held back
+  def update(self, value, at=None):
+    quantized = self.quantize(value)
+    if (quantized == self._sent):
+      self._held = None
+      return([ ])
+    if ((at is not None) and (self.min_interval > 0.0) and
+        (self._sent_at is not None) and
+        (at < self._sent_at + self.min_interval)):
+      self._held = quantized
+      return([ ])
+    return(self._commit(quantized, at))
+  # release a held value if it can be sent by the given absolute time,
+  #  returning a tuple with the time to send it and its messages,
+  #  or None if there's nothing to send yet
+  def flush(self, until):
+    if (self._held is None): return(None)
+    at = self._sent_at + self.min_interval
+    if (at > until): return(None)
+    quantized = self._held
+    return((at, self._commit(quantized, at)))
+  def _commit(self, quantized, at):
+    messages = self.messages(quantized)
+    self._sent = quantized
+    self._sent_at = at
+    self._held = None
+    return(messages)
+
+class TestControllerEncoder(unittest.TestCase):
+  def test_redundant(self):
+    e = ControllerEncoder(7)
+    self.assertEqual(e.update(0.5), [ (0xB0, 7, 64) ])
+    self.assertEqual(e.update(0.502), [ ])
+    self.assertEqual(e.update(1.5), [ (0xB0, 7, 127) ])
+    e.reset()
+    self.assertEqual(e.update(1.0), [ (0xB0, 7, 127) ])
+  def test_fine(self):
+    e = ControllerEncoder(1, fine=True)
+    self.assertEqual(e.update(0.5), [ (0xB0, 1, 64), (0xB0, 33, 0) ])
+    self.assertEqual(e.update(0.5001), [ (0xB0, 33, 1) ])
+    self.assertEqual(e.update(0.502), [ (0xB0, 33, 32) ])
+    self.assertEqual(e.update(0.0), [ (0xB0, 1, 0), (0xB0, 33, 0) ])
+    self.assertFalse(ControllerEncoder(64, fine=True).fine)
+  def test_rate_limit(self):
+    e = ControllerEncoder(7, min_interval=0.1)
+    self.assertEqual(len(e.update(0.1, 0.0)), 1)
+    self.assertEqual(e.update(0.2, 0.05), [ ])
+    self.assertTrue(e.holding)
+    self.assertEqual(e.flush(0.08), None)
+    self.assertEqual(e.update(0.3, 0.08), [ ])
+    self.assertEqual(e.flush(0.2), (0.1, [ (0xB0, 7, 38) ]))
+    self.assertFalse(e.holding)
+    self.assertEqual(e.update(0.3, 0.15), [ ])
+    self.assertFalse(e.holding)
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
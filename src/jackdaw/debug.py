@@ -0,0 +1,84 @@
+import os
+import sys
+
+from PySide.QtCore import QObject, QTimer
+
+import serializable
+import unit
+import profiling
+import telemetry
+
+# a unit that shows what the profiler has collected on the workspace,
+#  which its view refreshes directly so that refreshing doesn't notify
+#  the document and add to what's being measured
+class ProfilerUnit(unit.Unit):
+  def __init__(self, interval=1.0, *args, **kwargs):
+    unit.Unit.__init__(self, *args, **kwargs)
+    self._interval = interval
+    # the last report from the profiler
+    self.report = profiling.report()
+    # the number of times each counter was incremented per second
+    #  over the last interval, keyed by counter name
+    self.rates = dict()
+  # get and set the number of seconds between updates
+  @property
+  def interval(self):
+    return(self._interval)
+  @interval.setter
+  def interval(self, value):
+    if (value != self._interval):
+      self._interval = value
+      self.on_change()
+  # get a new report from the profiler, returning whether there is one
+  def refresh(self):
+    if (not profiling.enabled): return(False)
+    report = profiling.report()
+    elapsed = report['time'] - self.report['time']
+    old_counters = self.report['counters']
+    rates = dict()
+    if (elapsed > 0.0):
+      for (name, count) in report['counters'].iteritems():
+        rates[name] = (count - old_counters.get(name, 0)) / elapsed
+    self.report = report
+    self.rates = rates
+    return(True)
+  def serialize(self):
+    obj = unit.Unit.serialize(self)
+    obj['interval'] = self.interval
+    return(obj)
+serializable.add(ProfilerUnit)
+
+# a unit that shows how well playback is keeping up with the transport,
+#  which its view polls for new measurements
+class PlaybackMeterUnit(unit.Unit):
+  def __init__(self, *args, **kwargs):
+    unit.Unit.__init__(self, *args, **kwargs)
+    self.telemetry = telemetry.Playback
+  # clear what's been measured so far, e.g. after changing settings
+  def reset(self):
+    self.telemetry.reset()
+    self.on_change()
+serializable.add(PlaybackMeterUnit)
+
+# periodically write what the profiler has collected to a JSON file
+class ProfileDumper(QObject):
+  def __init__(self, path, interval=5.0):
+    QObject.__init__(self)
+    self.path = path
+    self._timer = QTimer(self)
+    self._timer.timeout.connect(self.dump)
+    self._timer.start(int(interval * 1000))
+  def dump(self):
+    try:
+      profiling.dump(self.path, 
+        { 'playback': telemetry.Playback.as_dict() })
+    except (IOError, OSError) as e:
+      sys.stderr.write('WARNING: failed to write profile to %s: %s\n' %
+                       (self.path, e))
+
+# start dumping profiles if the JACKDAW_PROFILE_DUMP environment variable
+#  gives a path to write them to, returning the dumper if there is one
+def dump_from_environment():
+  path = os.environ.get('JACKDAW_PROFILE_DUMP')
+  if ((not path) or (not profiling.enabled)): return(None)
+  return(ProfileDumper(path))
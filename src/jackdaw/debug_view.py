@@ -0,0 +1,131 @@
+import math
+
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import debug
+import profiling
+import unit_view
+
+# show the busiest counters and slowest timings from the profiler
+class ProfilerUnitView(unit_view.UnitView):
+  # the maximum number of entries to show in each section
+  MAX_LINES = 12
+  def __init__(self, *args, **kwargs):
+    unit_view.UnitView.__init__(self, *args, **kwargs)
+    self.allow_resize_width = True
+    self.allow_resize_height = True
+    text = QGraphicsTextItem(self)
+    text.setPos(QPointF(0.0, 0.0))
+    font = QFont('monospace')
+    font.setStyleHint(QFont.Monospace)
+    text.setFont(font)
+    self._content = text
+    # refresh at the unit's interval while the view exists
+    self._timer = QTimer(self)
+    self._timer.timeout.connect(self.refresh)
+    self._interval = None
+    self.unit.add_observer(self.on_unit_change)
+    self.on_unit_change()
+  def destroy(self):
+    self._timer.stop()
+    self.unit.remove_observer(self.on_unit_change)
+    unit_view.UnitView.destroy(self)
+  def on_unit_change(self):
+    if (self.unit.interval != self._interval):
+      self._interval = self.unit.interval
+      self._timer.start(int(self._interval * 1000))
+    self.render()
+  def refresh(self):
+    if (self.unit.refresh()):
+      self.render()
+  # allow the area to expand independent of the text view
+  def content_size(self):
+    s = unit_view.UnitView.content_size(self)
+    s.setWidth(max(s.width(), self.unit.width))
+    s.setHeight(max(s.height(), self.unit.height))
+    return(s)
+  def render(self):
+    if (not profiling.enabled):
+      self._content.setPlainText(
+        'Profiling is off.\nSet JACKDAW_PROFILE=1 to turn it on.')
+      self.layout()
+      return
+    lines = [ 'per second:' ]
+    rates = sorted(self.unit.rates.iteritems(),
+                   key=lambda item: item[1], reverse=True)
+    for (name, rate) in rates[0:self.MAX_LINES]:
+      if (rate <= 0.0): break
+      lines.append('%8.1f  %s' % (rate, name))
+    lines.append('')
+    lines.append('total    mean     max      count  name')
+    stats = sorted(self.unit.report['stats'].iteritems(),
+                   key=lambda item: item[1]['total'], reverse=True)
+    for (name, stat) in stats[0:self.MAX_LINES]:
+      lines.append('%-8.3g %-8.3g %-8.3g %-6d %s' % (stat['total'],
+        stat['mean'], stat['max'], stat['count'], name))
+    self._content.setPlainText('\n'.join(lines))
+    self.layout()
+unit_view.UnitView.register_unit_view(
+  debug.ProfilerUnit, ProfilerUnitView)
+
+# show histograms of playback timing as rows of bars
+class PlaybackMeterUnitView(unit_view.UnitView):
+  # the number of characters in the longest bar
+  BAR_WIDTH = 24
+  def __init__(self, *args, **kwargs):
+    unit_view.UnitView.__init__(self, *args, **kwargs)
+    self.allow_resize_width = True
+    self.allow_resize_height = True
+    text = QGraphicsTextItem(self)
+    text.setPos(QPointF(0.0, 0.0))
+    font = QFont('monospace')
+    font.setStyleHint(QFont.Monospace)
+    text.setFont(font)
+    self._content = text
+    # poll for new measurements on a timer owned by the view, so it stops
+    #  when the unit is removed and doesn't notify the document
+    self._timer = QTimer(self)
+    self._timer.timeout.connect(self.render)
+    self._timer.start(1000)
+    self.unit.add_observer(self.render)
+    self.render()
+  def destroy(self):
+    self._timer.stop()
+    self.unit.remove_observer(self.render)
+    unit_view.UnitView.destroy(self)
+  def content_size(self):
+    s = unit_view.UnitView.content_size(self)
+    s.setWidth(max(s.width(), self.unit.width))
+    s.setHeight(max(s.height(), self.unit.height))
+    return(s)
+  # format the buckets of a histogram as lines of text
+  def format_histogram(self, title, histogram):
+    lines = [ '%s (%d)' % (title, histogram.count) ]
+    if (histogram.count == 0): return(lines)
+    peak = max(histogram.counts)
+    edges = histogram.edges
+    for (i, count) in enumerate(histogram.counts):
+      if (count == 0): continue
+      if (i < len(edges)):
+        label = '<=%gms' % (edges[i] * 1000.0)
+      else:
+        label = '>%gms' % (edges[-1] * 1000.0)
+      bar = '#' * int(math.ceil(self.BAR_WIDTH * count / float(peak)))
+      lines.append('%9s %-*s %d' % (label, self.BAR_WIDTH, bar, count))
+    lines.append('   p50 %.1fms  p99 %.1fms  max %.1fms' % (
+      histogram.percentile(0.5) * 1000.0, 
+      histogram.percentile(0.99) * 1000.0, 
+      histogram.max * 1000.0))
+    return(lines)
+  def render(self):
+    t = self.unit.telemetry
+    lines = self.format_histogram('tick lateness', t.tick_lateness)
+    lines.append('')
+    lines.extend(self.format_histogram('scheduled ahead', t.schedule_ahead))
+    lines.append('')
+    lines.append('ran dry %d of %d sends' % (t.underruns, t.sends))
+    self._content.setPlainText('\n'.join(lines))
+    self.layout()
+unit_view.UnitView.register_unit_view(
+  debug.PlaybackMeterUnit, PlaybackMeterUnitView)
@@ -1,11 +1,14 @@
 # coding=utf-8
 
 import yaml
+import threading
 try:
   import cPickle as pickle
 except:
   import pickle
 
+from PySide.QtCore import QTimer
+
 import observable
 import serializable
 from model import Model, ModelList
@@ -13,7 +16,7 @@ from track import TrackList, SequencerUnit
 from transport import Transport
 from midi import DeviceAdapterList, DeviceListUnit
 from audio import SystemPlaybackUnit
-from unit import UnitList, PatchBay
+from unit import UnitList, PatchBay, Connection
 from undo import UndoManager
 
 # make a units-to-pixels mapping with observable changes
@@ -89,6 +92,8 @@ class Document(Model):
     Model.__init__(self)
     # the file path to save to
     self.path = None
+    # the most recent background save, if any
+    self._saver = None
     # transport
     if (transport is None):
       transport = Transport()
@@ -130,11 +135,15 @@ class Document(Model):
     units = self.units
     patch_bay = self.patch_bay
     UndoManager.begin_action((units, patch_bay, inputs, outputs))
-    patch_bay.remove_connections_for_unit(unit)
-    for item in inputs:
-      patch_bay.remove_connections_for_unit(item)
-    for item in outputs:
-      patch_bay.remove_connections_for_unit(item)
+    Connection.begin_routing()
+    try:
+      patch_bay.remove_connections_for_unit(unit)
+      for item in inputs:
+        patch_bay.remove_connections_for_unit(item)
+      for item in outputs:
+        patch_bay.remove_connections_for_unit(item)
+    finally:
+      Connection.end_routing()
     units.remove(unit)
     # remove the unit from any groups it might be a part of
     for group in units:
@@ -151,12 +160,13 @@ class Document(Model):
     self.transport.duration = duration
   # save the document to a file
   def save(self):
-    output_stream = open(self.path, 'w')
-    if (self.path.endswith('.yml')):
-      output_stream.write(yaml.dump(self))
-    else:
-      output_stream.write(pickle.dumps(self, protocol=2))
-    output_stream.close()
+    serializable.dump_to_path(serializable.snapshot(self), self.path)
+  # save the document to a file without blocking, returning a 
+  #  DocumentSaver that can be observed for progress
+  def save_in_background(self):
+    self._saver = DocumentSaver(self, previous=self._saver)
+    self._saver.start()
+    return(self._saver)
   # load a document from a file
   @classmethod
   def get_from_path(self, path):
@@ -166,11 +176,91 @@ class Document(Model):
     s = input_stream.read()
     input_stream.close()
     document = None
-    if (path.endswith('.yml')):
-      document = yaml.load(s)
-    if (document is None):
-      document = pickle.loads(s)
+    # make all the document's connections in one pass
+    Connection.begin_routing()
+    try:
+      if (path.endswith('.yml')):
+        document = yaml.load(s)
+      if (document is None):
+        document = pickle.loads(s)
+    finally:
+      Connection.end_routing()
     if (document is not None):
       document.path = path
     return(document)
 serializable.add(Document)
+
+# save a document by taking a snapshot of its state and writing it 
+#  to disk on a worker thread
+class DocumentSaver(observable.Object):
+  def __init__(self, document, path=None, previous=None):
+    observable.Object.__init__(self)
+    self.document = document
+    self.path = path if path is not None else document.path
+    # a saver that may still be writing an earlier snapshot
+    self._previous = previous
+    self._snapshot = None
+    self._context = None
+    self._thread = None
+    self._error = None
+    self._saving = False
+    self._last_progress = None
+    # poll the worker from the GUI thread so observers are only 
+    #  ever notified there
+    self._timer = QTimer(self)
+    self._timer.setInterval(100)
+    self._timer.timeout.connect(self._check)
+  # whether the save is still in progress
+  @property
+  def saving(self):
+    return(self._saving)
+  # the exception raised while saving, if any
+  @property
+  def error(self):
+    return(self._error)
+  # the fraction of the document that has been written, from 0.0 to 1.0
+  @property
+  def progress(self):
+    if (self._context is None): return(0.0)
+    return(self._context.progress)
+  # take a snapshot and start writing it
+  def start(self):
+    if (self._saving): return
+    self._snapshot = serializable.snapshot(self.document)
+    self._context = self._snapshot.context
+    self._saving = True
+    # use a non-daemon thread so exiting waits for the file to be written
+    self._thread = threading.Thread(target=self._run, 
+                                    name='jackdaw-save')
+    self._thread.start()
+    self._timer.start()
+    self.on_change()
+  # block until the save is complete
+  def wait(self):
+    self.join()
+    self._check()
+  def join(self):
+    if (self._thread is not None):
+      self._thread.join()
+  def _run(self):
+    # make sure saves land on disk in the order they were requested
+    if (self._previous is not None):
+      self._previous.join()
+      self._previous = None
+    try:
+      serializable.dump_to_path(self._snapshot, self.path)
+    except Exception as e:
+      self._error = e
+  # notify observers of progress and completion
+  def _check(self):
+    if ((self._thread is not None) and (self._thread.is_alive())):
+      progress = self.progress
+      if (progress != self._last_progress):
+        self._last_progress = progress
+        self.on_change()
+      return
+    if (not self._saving): return
+    self._timer.stop()
+    self._saving = False
+    self._snapshot = None
+    self.on_change()
@@ -0,0 +1,262 @@
+import re
+import time
+import heapq
+import itertools
+import unittest
+
+# an in-process stand-in for the jackpatch module, which implements the
+#  parts of its interface the application uses on a simulated JACK server
+#  with a controllable clock, so that scheduling and recording can be
+#  tested and benchmarked on machines without JACK
+
+# port flags, matching the values used by JACK
+JackPortIsInput = 0x1
+JackPortIsOutput = 0x2
+JackPortIsPhysical = 0x4
+JackPortCanMonitor = 0x8
+JackPortIsTerminal = 0x10
+
+# port types
+MIDI_TYPE = '8 bit raw midi'
+AUDIO_TYPE = '32 bit float mono audio'
+
+class JackError(Exception):
+  pass
+
+# simulate a JACK server with a port graph, a transport, and a clock
+class Server(object):
+  def __init__(self):
+    self.reset()
+  # remove all clients, ports, and connections and restart the clock
+  def reset(self):
+    self.clients = list()
+    # all registered ports keyed by full name, in order of registration
+    self.ports = dict()
+    self._port_order = list()
+    # connections as a set of (output name, input name) tuples
+    self.connections = set()
+    self._start_time = time.time()
+    self._frozen_time = None
+    # transport state
+    self._transport_position = 0.0
+    self._transport_started = None
+    # a counter to keep messages at the same time in the order sent
+    self._sequence = itertools.count()
+  # get the current time on the server's clock in seconds, which
+  #  follows the system clock unless frozen
+  @property
+  def time(self):
+    if (self._frozen_time is not None):
+      return(self._frozen_time)
+    return(time.time() - self._start_time)
+  # stop the clock at the given time, or the current time by default
+  def freeze(self, at=None):
+    self._frozen_time = self.time if at is None else at
+  # move a frozen clock forward
+  def advance(self, seconds):
+    if (self._frozen_time is None):
+      self.freeze()
+    self._frozen_time += seconds
+  # let the clock follow the system clock again from its current time
+  def unfreeze(self):
+    if (self._frozen_time is None): return
+    self._start_time = time.time() - self._frozen_time
+    self._frozen_time = None
+  # get the transport position at the given server time
+  def transport_time(self, at=None):
+    if (self._transport_started is None):
+      return(self._transport_position)
+    if (at is None):
+      at = self.time
+    return(self._transport_position + (at - self._transport_started))
+  def _notify(self, method, *args):
+    for client in self.clients:
+      callback = getattr(client, method)
+      if (callback is not None):
+        callback(*args)
+  def _register(self, port):
+    if (port.name in self.ports):
+      raise JackError('port %s already exists' % port.name)
+    self.ports[port.name] = port
+    self._port_order.append(port.name)
+    self._notify('_registration_callback', port.name, True)
+  def _connect(self, source, sink, connected):
+    if (not (source.flags & JackPortIsOutput)):
+      (source, sink) = (sink, source)
+    key = (source.name, sink.name)
+    if ((key in self.connections) == connected): return
+    if (connected):
+      self.connections.add(key)
+    else:
+      self.connections.discard(key)
+    self._notify('_connect_callback', source.name, sink.name, connected)
+server = Server()
+
+# make a connection to the simulated server
+class Client(object):
+  def __init__(self, name):
+    self.name = name
+    self.active = False
+    self._registration_callback = None
+    self._connect_callback = None
+    server.clients.append(self)
+  def activate(self):
+    self.active = True
+  def deactivate(self):
+    self.active = False
+  # callbacks can only be set before activation, as with JACK
+  def set_port_registration_callback(self, callback):
+    if (self.active):
+      raise JackError('callbacks must be set before activation')
+    self._registration_callback = callback
+  def set_port_connect_callback(self, callback):
+    if (self.active):
+      raise JackError('callbacks must be set before activation')
+    self._connect_callback = callback
+  # get ports whose names and types match the given regular expressions
+  #  and which have all the given flags
+  def get_ports(self, name_pattern='', type_pattern='', flags=0):
+    name_regex = re.compile(name_pattern) if name_pattern else None
+    type_regex = re.compile(type_pattern) if type_pattern else None
+    ports = list()
+    for name in server._port_order:
+      port = server.ports[name]
+      if ((name_regex) and (not name_regex.search(port.name))): continue
+      if ((type_regex) and (not type_regex.search(port.type))): continue
+      if ((port.flags & flags) != flags): continue
+      ports.append(port)
+    return(ports)
+  def connect(self, source, sink):
+    server._connect(_get_port(source), _get_port(sink), True)
+  def disconnect(self, source, sink):
+    server._connect(_get_port(source), _get_port(sink), False)
+
+# look up a port by name if needed
+def _get_port(port):
+  if (isinstance(port, basestring)):
+    return(server.ports[port])
+  return(port)
+
+# make a port on the simulated server, which records the timestamps of
+#  all messages sent and received
+class Port(object):
+  def __init__(self, client, name, flags=JackPortIsOutput, type=MIDI_TYPE):
+    self.client = client
+    self.name = client.name+':'+name
+    self.flags = flags
+    self.type = type
+    # messages waiting to be received as a heap of
+    #  (server time, sequence, data, source name) tuples
+    self._inbox = list()
+    # logs of (server time, data) for messages sent and received
+    self.sent = list()
+    self.received = list()
+    server._register(self)
+  def get_connections(self):
+    if (self.flags & JackPortIsOutput):
+      names = [ sink for (source, sink) in server.connections
+                  if source == self.name ]
+    else:
+      names = [ source for (source, sink) in server.connections
+                  if sink == self.name ]
+    return([ server.ports[name] for name in sorted(names) ])
+  # send a message the given number of seconds from now
+  def send(self, data, time=0.0):
+    at = server.time + max(0.0, time)
+    data = tuple(data)
+    self.sent.append((at, data))
+    for sink in self.get_connections():
+      heapq.heappush(sink._inbox,
+        (at, next(server._sequence), data, self.name))
+  # drop sent messages that haven't been delivered yet
+  def clear_send(self):
+    now = server.time
+    for sink in self.get_connections():
+      sink._inbox = [ m for m in sink._inbox
+                        if ((m[3] != self.name) or (m[0] <= now)) ]
+      heapq.heapify(sink._inbox)
+  # receive the next message that has arrived as a tuple of
+  #  (data, transport time), or None if there isn't one
+  def receive(self):
+    if ((len(self._inbox) == 0) or (self._inbox[0][0] > server.time)):
+      return(None)
+    (at, sequence, data, source) = heapq.heappop(self._inbox)
+    self.received.append((at, data))
+    return((data, server.transport_time(at)))
+
+# control the simulated server's transport
+class Transport(object):
+  def __init__(self, client=None):
+    self.client = client
+  @property
+  def time(self):
+    return(server.transport_time())
+  @time.setter
+  def time(self, value):
+    server._transport_position = value
+    if (server._transport_started is not None):
+      server._transport_started = server.time
+  @property
+  def is_rolling(self):
+    return(server._transport_started is not None)
+  def start(self):
+    if (server._transport_started is None):
+      server._transport_started = server.time
+  def stop(self):
+    if (server._transport_started is not None):
+      server._transport_position = server.transport_time()
+      server._transport_started = None
+
+class TestFakeJack(unittest.TestCase):
+  def setUp(self):
+    server.reset()
+    server.freeze(0.0)
+    self.client = Client('test')
+    self.client.activate()
+    self.output = Port(self.client, 'out', JackPortIsOutput)
+    self.input = Port(self.client, 'in', JackPortIsInput)
+  def test_get_ports(self):
+    self.assertEqual(self.client.get_ports(name_pattern='test:.*',
+      flags=JackPortIsInput), [ self.input ])
+    self.assertEqual(len(self.client.get_ports(type_pattern='.*audio.*')), 0)
+  def test_delivery(self):
+    self.output.send((0x90, 60, 100), 0.5)
+    self.output.send((0x80, 60, 0), 1.0)
+    # messages sent before connecting don't arrive
+    self.client.connect(self.output, self.input)
+    self.assertEqual(self.input.get_connections(), [ self.output ])
+    self.output.send((0x90, 62, 100), 0.5)
+    self.output.send((0x80, 62, 0), 1.0)
+    self.assertIsNone(self.input.receive())
+    server.advance(0.75)
+    self.assertEqual(self.input.receive(), ((0x90, 62, 100), 0.0))
+    self.assertIsNone(self.input.receive())
+    self.output.clear_send()
+    server.advance(1.0)
+    self.assertIsNone(self.input.receive())
+    self.assertEqual(len(self.output.sent), 4)
+    self.assertEqual(self.input.received, [ (0.5, (0x90, 62, 100)) ])
+  def test_transport(self):
+    transport = Transport(self.client)
+    transport.time = 2.0
+    transport.start()
+    server.advance(1.5)
+    self.assertEqual(transport.time, 3.5)
+    transport.stop()
+    server.advance(1.0)
+    self.assertEqual(transport.time, 3.5)
+    self.assertFalse(transport.is_rolling)
+  def test_callbacks(self):
+    changes = list()
+    client = Client('watcher')
+    client.set_port_connect_callback(lambda *args: changes.append(args))
+    client.activate()
+    self.client.connect(self.output, self.input)
+    self.client.disconnect(self.input, self.output)
+    self.assertEqual(changes, [ ('test:out', 'test:in', True),
+                                ('test:out', 'test:in', False) ])
+    self.assertRaises(JackError, client.set_port_connect_callback, None)
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
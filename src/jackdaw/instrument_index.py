@@ -0,0 +1,554 @@
+import os
+import re
+import sys
+import json
+import struct
+import tempfile
+import threading
+import unittest
+
+# the file types the index knows how to read
+EXTENSIONS = ('.gig', '.sfz', '.sf2')
+
+# READING #####################################################################
+
+# read a summary of an instrument file without loading its samples,
+#  returning a dict with these keys:
+#   name: the name stored in the file, or the file's base name
+#   format: the file extension in lowercase without a dot
+#   key_range: the lowest and highest MIDI notes the regions cover,
+#     or None if no regions were found
+#   velocity_layers: the greatest number of velocity ranges a note has
+#   regions: the number of regions (or zones) in the file
+#   sample_bytes: the amount of sample data the file will load
+def read_info(path):
+  (base, ext) = os.path.splitext(os.path.basename(path))
+  ext = ext.lower()
+  info = { 'name': base, 'format': ext[1:], 'key_range': None,
+           'velocity_layers': 0, 'regions': 0, 'sample_bytes': 0 }
+  if (ext == '.sfz'):
+    _read_sfz(path, info)
+  elif (ext == '.sf2'):
+    _read_sf2(path, info)
+  elif (ext == '.gig'):
+    _read_gig(path, info)
+  else:
+    raise ValueError('unknown instrument format "%s"' % ext)
+  return(info)
+
+# summarize a list of (key range, velocity range) tuples for regions
+def _summarize_regions(info, regions):
+  info['regions'] = len(regions)
+  if (len(regions) == 0): return
+  info['key_range'] = (min([ k[0] for (k, v) in regions ]),
+                       max([ k[1] for (k, v) in regions ]))
+  # count the velocity ranges that apply to each key
+  layers = dict()
+  for (keys, velocities) in regions:
+    for key in range(keys[0], keys[1] + 1):
+      if (key not in layers):
+        layers[key] = set()
+      layers[key].add(velocities)
+  info['velocity_layers'] = max([ len(v) for v in layers.itervalues() ])
+
+# SFZ files are text, with samples stored in separate files
+_sfz_note_regex = re.compile('^([a-g])([#b]?)(-?\\d+)$', re.IGNORECASE)
+_sfz_pitch_classes = { 'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11 }
+def _sfz_key(value):
+  try:
+    return(int(value))
+  except ValueError: pass
+  m = _sfz_note_regex.match(value)
+  if (not m):
+    raise ValueError('invalid key "%s"' % value)
+  key = _sfz_pitch_classes[m.group(1).lower()]
+  if (m.group(2) == '#'): key += 1
+  elif (m.group(2) == 'b'): key -= 1
+  return(((int(m.group(3)) + 1) * 12) + key)
+# read the text of an SFZ file, expanding includes and definitions
+def _sfz_text(path, depth=0):
+  with open(path, 'r') as f:
+    text = f.read()
+  # remove comments
+  text = re.sub('//[^\\n]*', '', text)
+  text = re.sub('/\\*.*?\\*/', '', text, flags=re.DOTALL)
+  def include(m):
+    if (depth > 8): return('')
+    included = os.path.join(os.path.dirname(path),
+                            m.group(1).replace('\\', '/'))
+    try:
+      return(_sfz_text(included, depth + 1))
+    except IOError:
+      return('')
+  text = re.sub('#include\\s+"([^"]*)"', include, text)
+  for (name, value) in re.findall('#define\\s+(\\$\\w+)\\s+(\\S+)', text):
+    text = text.replace(name, value)
+  return(re.sub('#define\\s+\\S+\\s+\\S+', '', text))
+# match headers and opcodes, allowing spaces in sample paths
+_sfz_token_regex = re.compile(
+  '<(\\w+)>|(\\w+)=(.*?)(?=\\s+\\w+=|\\s*<|\\s*$)', re.DOTALL)
+def _read_sfz(path, info):
+  text = _sfz_text(path)
+  directory = os.path.dirname(path)
+  # opcodes inherited from enclosing headers
+  scopes = { 'control': dict(), 'global': dict(), 'master': dict(),
+             'group': dict() }
+  inherit = { 'global': (), 'master': ('global',),
+              'group': ('global', 'master'),
+              'region': ('global', 'master', 'group') }
+  region_opcodes = list()
+  header = None
+  current = dict()
+  def finish():
+    if (header == 'region'):
+      region_opcodes.append(current)
+  for (name, opcode, value) in _sfz_token_regex.findall(text):
+    if (name):
+      finish()
+      header = name.lower()
+      current = dict()
+      for scope in inherit.get(header, ()):
+        current.update(scopes[scope])
+      if (header in scopes):
+        # a new header resets the headers it contains
+        scopes[header] = current
+        for scope in ('master', 'group'):
+          if (header in inherit[scope]):
+            scopes[scope] = dict(current)
+    elif (header is not None):
+      current[opcode] = value.strip()
+  finish()
+  sample_dir = os.path.join(directory,
+    scopes['control'].get('default_path', '').replace('\\', '/'))
+  regions = list()
+  samples = set()
+  for opcodes in region_opcodes:
+    try:
+      if ('key' in opcodes):
+        key = _sfz_key(opcodes['key'])
+        keys = (key, key)
+      else:
+        keys = (_sfz_key(opcodes.get('lokey', '0')),
+                _sfz_key(opcodes.get('hikey', '127')))
+      velocities = (int(opcodes.get('lovel', 1)),
+                    int(opcodes.get('hivel', 127)))
+    except ValueError:
+      continue
+    regions.append((keys, velocities))
+    if ('sample' in opcodes):
+      samples.add(os.path.normpath(os.path.join(sample_dir,
+        opcodes['sample'].replace('\\', '/'))))
+  _summarize_regions(info, regions)
+  for sample in samples:
+    try:
+      info['sample_bytes'] += os.path.getsize(sample)
+    except OSError: pass
+
+# RIFF files store data in nested chunks, which are walked by seeking past
+#  chunk data so that sample data is never read
+def _riff_chunks(f, start, end):
+  position = start
+  while (position + 8 <= end):
+    f.seek(position)
+    header = f.read(8)
+    if (len(header) < 8): return
+    (chunk_id, size) = struct.unpack('<4sL', header)
+    list_type = None
+    if (chunk_id in ('RIFF', 'LIST')):
+      list_type = f.read(4)
+    yield((chunk_id, list_type, position + 8, size))
+    # chunks are padded to an even size
+    position += 8 + size + (size & 1)
+# find the first chunk with the given ID and list type in a sequence
+def _find_chunk(chunks, chunk_id, list_type=None):
+  for chunk in chunks:
+    if ((chunk[0] == chunk_id) and (chunk[1] == list_type)):
+      return(chunk)
+  return(None)
+# read the name from an INFO list chunk
+def _read_riff_name(f, chunk):
+  if (chunk is None): return(None)
+  (chunk_id, list_type, offset, size) = chunk
+  inam = _find_chunk(_riff_chunks(f, offset + 4, offset + size), 'INAM')
+  if (inam is None): return(None)
+  f.seek(inam[2])
+  name = f.read(inam[3]).split('\x00')[0].strip()
+  return(name if (len(name) > 0) else None)
+# open a RIFF file and return the chunks in the top-level form
+def _riff_form(f, form_type):
+  f.seek(0, os.SEEK_END)
+  file_size = f.tell()
+  form = _find_chunk(_riff_chunks(f, 0, file_size), 'RIFF', form_type)
+  if (form is None):
+    raise ValueError('not a RIFF %s file' % form_type)
+  (chunk_id, list_type, offset, size) = form
+  return(list(_riff_chunks(f, offset + 4, min(file_size, offset + size))))
+
+# SF2 files are RIFF files with sample data and presets in one file
+def _read_sf2(path, info):
+  with open(path, 'rb') as f:
+    chunks = _riff_form(f, 'sfbk')
+    name = _read_riff_name(f, _find_chunk(chunks, 'LIST', 'INFO'))
+    if (name is not None):
+      info['name'] = name
+    # add up the size of the sample data
+    sdta = _find_chunk(chunks, 'LIST', 'sdta')
+    if (sdta is not None):
+      for (chunk_id, list_type, offset, size) in _riff_chunks(
+          f, sdta[2] + 4, sdta[2] + sdta[3]):
+        if (chunk_id in ('smpl', 'sm24')):
+          info['sample_bytes'] += size
+    # read instrument zones from the preset data
+    pdta = _find_chunk(chunks, 'LIST', 'pdta')
+    if (pdta is None): return
+    tables = dict()
+    for (chunk_id, list_type, offset, size) in _riff_chunks(
+        f, pdta[2] + 4, pdta[2] + pdta[3]):
+      if (chunk_id in ('inst', 'ibag', 'igen')):
+        f.seek(offset)
+        tables[chunk_id] = f.read(size)
+  if (len(tables) < 3): return
+  instruments = [ struct.unpack_from('<H', tables['inst'], i + 20)[0]
+                  for i in range(0, len(tables['inst']) - 21, 22) ]
+  bags = [ struct.unpack_from('<H', tables['ibag'], i)[0]
+           for i in range(0, len(tables['ibag']) - 3, 4) ]
+  generators = [ struct.unpack_from('<HBB', tables['igen'], i)
+                 for i in range(0, len(tables['igen']) - 3, 4) ]
+  regions = list()
+  # the last instrument and bag are terminal records
+  for i in range(0, len(instruments) - 1):
+    global_zone = dict()
+    for b in range(instruments[i], min(instruments[i + 1], len(bags) - 1)):
+      zone = dict(global_zone)
+      for (operator, lo, hi) in generators[bags[b]:bags[b + 1]]:
+        zone[operator] = (lo, hi)
+      # zones without a sample (generator 53) are global zones,
+      #  and only the first zone can be one
+      if (53 not in zone):
+        if (b == instruments[i]):
+          global_zone = zone
+        continue
+      regions.append((zone.get(43, (0, 127)), zone.get(44, (0, 127))))
+  _summarize_regions(info, regions)
+
+# GIG files are DLS files with extensions, and may store samples
+#  in extension files (.gx01, .gx02, ...) next to the main file
+_GIG_VELOCITY_DIMENSION = 0x82
+def _read_gig(path, info):
+  with open(path, 'rb') as f:
+    chunks = _riff_form(f, 'DLS ')
+    name = _read_riff_name(f, _find_chunk(chunks, 'LIST', 'INFO'))
+    # add up the size of the sample data
+    wvpl = _find_chunk(chunks, 'LIST', 'wvpl')
+    if (wvpl is not None):
+      for wave in _riff_chunks(f, wvpl[2] + 4, wvpl[2] + wvpl[3]):
+        if (wave[1] != 'wave'): continue
+        data = _find_chunk(_riff_chunks(f, wave[2] + 4, wave[2] + wave[3]),
+                           'data')
+        if (data is not None):
+          info['sample_bytes'] += data[3]
+    regions = list()
+    lins = _find_chunk(chunks, 'LIST', 'lins')
+    if (lins is not None):
+      for ins in _riff_chunks(f, lins[2] + 4, lins[2] + lins[3]):
+        if (ins[1] != 'ins '): continue
+        ins_chunks = list(_riff_chunks(f, ins[2] + 4, ins[2] + ins[3]))
+        if (name is None):
+          name = _read_riff_name(f, _find_chunk(ins_chunks, 'LIST', 'INFO'))
+        lrgn = _find_chunk(ins_chunks, 'LIST', 'lrgn')
+        if (lrgn is None): continue
+        for rgn in _riff_chunks(f, lrgn[2] + 4, lrgn[2] + lrgn[3]):
+          if (rgn[1] not in ('rgn ', 'rgn2')): continue
+          regions.extend(_read_gig_region(f, rgn))
+    _summarize_regions(info, regions)
+  if (name is not None):
+    info['name'] = name
+  # include the size of extension files
+  (base, ext) = os.path.splitext(path)
+  for i in range(1, 100):
+    try:
+      info['sample_bytes'] += os.path.getsize('%s.gx%02d' % (base, i))
+    except OSError:
+      break
+# get a list of (key range, velocity range) tuples for a region,
+#  splitting it by the velocity dimension if it has one
+def _read_gig_region(f, rgn):
+  rgn_chunks = list(_riff_chunks(f, rgn[2] + 4, rgn[2] + rgn[3]))
+  rgnh = _find_chunk(rgn_chunks, 'rgnh')
+  if (rgnh is None): return(())
+  f.seek(rgnh[2])
+  (key_lo, key_hi, vel_lo, vel_hi) = struct.unpack('<4H', f.read(8))
+  keys = (key_lo, key_hi)
+  lnk = _find_chunk(rgn_chunks, '3lnk')
+  if (lnk is not None):
+    f.seek(lnk[2] + 4)
+    dimensions = f.read(5 * 8)
+    for i in range(0, len(dimensions) - 7, 8):
+      (dimension, bits, zones) = struct.unpack_from('<BB2xB', dimensions, i)
+      if (dimension == _GIG_VELOCITY_DIMENSION):
+        if (zones == 0):
+          zones = 1 << bits
+        return([ (keys, (z, z)) for z in range(zones) ])
+  return([ (keys, (vel_lo, vel_hi)) ])
+
+# make a short description of an instrument's info for display
+def describe(info):
+  if ((info is None) or ('error' in info)): return('')
+  parts = list()
+  size = float(info['sample_bytes'])
+  for unit in ('bytes', 'KB', 'MB', 'GB'):
+    if ((size < 1024.0) or (unit == 'GB')): break
+    size /= 1024.0
+  parts.append(('%d %s' if (unit == 'bytes') else '%.1f %s') % (size, unit))
+  if (info['velocity_layers'] > 1):
+    parts.append('%d velocity layers' % info['velocity_layers'])
+  if (info['key_range'] is not None):
+    parts.append('keys %d-%d' % tuple(info['key_range']))
+  return(', '.join(parts))
+
+# INDEXING ####################################################################
+
+# keep a cache of instrument file summaries on disk, which are looked up
+#  by path and are only valid while the file's size and modification
+#  time haven't changed
+class InstrumentIndex(object):
+  def __init__(self, path=None):
+    if (path is None):
+      path = os.path.join(os.path.expanduser('~'), '.jackdaw',
+                          'instrument_index.json')
+    self.path = path
+    self._lock = threading.RLock()
+    self._entries = None
+    self._changed = False
+    self._indexer = None
+  # load the cache from disk the first time it's needed
+  def _load(self):
+    if (self._entries is not None): return
+    self._entries = dict()
+    try:
+      with open(self.path, 'r') as f:
+        entries = json.load(f)
+      if (isinstance(entries, dict)):
+        self._entries = entries
+    except (IOError, ValueError): pass
+  # write the cache to disk if it's changed
+  def save(self):
+    with self._lock:
+      if (not self._changed): return
+      self._load()
+      data = json.dumps(self._entries)
+      self._changed = False
+    directory = os.path.dirname(self.path)
+    try:
+      if (not os.path.isdir(directory)):
+        os.makedirs(directory)
+      (fd, temp_path) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+      with os.fdopen(fd, 'w') as f:
+        f.write(data)
+      os.rename(temp_path, self.path)
+    except (IOError, OSError) as e:
+      sys.stderr.write('WARNING: failed to save instrument index: %s\n' % e)
+  # get the cached info for a file, or None if it isn't in the cache or
+  #  has changed since it was indexed; if parse is True, missing info
+  #  is read from the file and cached
+  def get(self, path, parse=False):
+    path = os.path.abspath(path)
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return(None)
+    with self._lock:
+      self._load()
+      entry = self._entries.get(path)
+    if ((entry is not None) and (entry['mtime'] == stat.st_mtime) and
+        (entry['size'] == stat.st_size)):
+      return(entry)
+    if (not parse): return(None)
+    return(self._index_file(path, stat))
+  # read a file and add it to the cache
+  def _index_file(self, path, stat):
+    try:
+      entry = read_info(path)
+    except (IOError, ValueError, struct.error) as e:
+      entry = { 'name': os.path.splitext(os.path.basename(path))[0],
+                'error': str(e) }
+    entry['path'] = path
+    entry['mtime'] = stat.st_mtime
+    entry['size'] = stat.st_size
+    # store key ranges the way they'll come back from the cache file
+    if (entry.get('key_range') is not None):
+      entry['key_range'] = list(entry['key_range'])
+    with self._lock:
+      self._load()
+      self._entries[path] = entry
+      self._changed = True
+    return(entry)
+  # get cached info for all valid instrument files matching the given
+  #  criteria, sorted by path:
+  #   directory: only include files in this directory or below it
+  #   name: only include files whose name contains this text
+  #   formats: only include files with these formats (e.g. 'sfz')
+  #   key: only include instruments which can play this MIDI note
+  #   max_bytes: only include instruments with less sample data than this
+  def query(self, directory=None, name=None, formats=None, key=None,
+            max_bytes=None):
+    if (directory is not None):
+      directory = os.path.join(os.path.abspath(directory), '')
+    if (name is not None):
+      name = name.lower()
+    with self._lock:
+      self._load()
+      entries = list(self._entries.values())
+    results = list()
+    for entry in entries:
+      if ('error' in entry): continue
+      if ((directory is not None) and
+          (not entry['path'].startswith(directory))): continue
+      if ((name is not None) and (name not in entry['name'].lower())):
+        continue
+      if ((formats is not None) and (entry['format'] not in formats)):
+        continue
+      if (key is not None):
+        key_range = entry['key_range']
+        if ((key_range is None) or
+            (key < key_range[0]) or (key > key_range[1])): continue
+      if ((max_bytes is not None) and (entry['sample_bytes'] > max_bytes)):
+        continue
+      # skip files that have changed or been removed
+      if (self.get(entry['path']) is None): continue
+      results.append(entry)
+    results.sort(key=lambda e: e['path'])
+    return(results)
+  # start indexing instrument files in the given directories on a
+  #  background thread, returning the Indexer doing the work
+  def index_in_background(self, directories, recursive=True):
+    with self._lock:
+      indexer = Indexer(self, directories, recursive=recursive,
+                        previous=self._indexer)
+      self._indexer = indexer
+    indexer.start()
+    return(indexer)
+
+# index instrument files in a set of directories on a background thread
+class Indexer(threading.Thread):
+  def __init__(self, index, directories, recursive=True, previous=None):
+    threading.Thread.__init__(self, name='jackdaw-instrument-index')
+    self.daemon = True
+    self.index = index
+    self.directories = directories
+    self.recursive = recursive
+    self._previous = previous
+    self._stopped = threading.Event()
+    # the number of files checked and the number that had to be read
+    self.checked = 0
+    self.indexed = 0
+  def stop(self):
+    self._stopped.set()
+  def run(self):
+    # let any earlier indexer finish so they don't read the same files
+    if (self._previous is not None):
+      self._previous.join()
+      self._previous = None
+    for directory in self.directories:
+      for path in self._find_files(directory):
+        if (self._stopped.is_set()): break
+        self.checked += 1
+        if (self.index.get(path) is None):
+          self.index.get(path, parse=True)
+          self.indexed += 1
+    self.index.save()
+  def _find_files(self, directory):
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+      dirnames.sort()
+      for filename in sorted(filenames):
+        if (os.path.splitext(filename)[1].lower() in EXTENSIONS):
+          yield(os.path.join(dirpath, filename))
+      if (not self.recursive): break
+
+# a shared index for the application
+Index = InstrumentIndex()
+
+class TestInstrumentIndex(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.index = InstrumentIndex(os.path.join(self.directory, 'index.json'))
+  def tearDown(self):
+    for (dirpath, dirnames, filenames) in os.walk(self.directory,
+                                                  topdown=False):
+      for filename in filenames:
+        os.remove(os.path.join(dirpath, filename))
+      os.rmdir(dirpath)
+  def write(self, name, data):
+    path = os.path.join(self.directory, name)
+    with open(path, 'wb') as f:
+      f.write(data)
+    return(path)
+  def test_sfz(self):
+    self.write('a.wav', '0' * 100)
+    self.write('b.wav', '0' * 50)
+    path = self.write('piano.sfz',
+      '// comment\n<group> lokey=c4 hikey=e4\n'
+      '<region> sample=a.wav lovel=1 hivel=63\n'
+      '<region> sample=b.wav lovel=64 hivel=127\n'
+      '<region> key=20 sample=a.wav\n')
+    info = read_info(path)
+    self.assertEqual(info['name'], 'piano')
+    self.assertEqual(info['regions'], 3)
+    self.assertEqual(info['key_range'], (20, 64))
+    self.assertEqual(info['velocity_layers'], 2)
+    self.assertEqual(info['sample_bytes'], 150)
+  def test_sf2(self):
+    def chunk(chunk_id, data):
+      return(struct.pack('<4sL', chunk_id, len(data)) + data +
+             ('\x00' if (len(data) & 1) else ''))
+    def riff(chunk_id, list_type, *chunks):
+      return(chunk(chunk_id, list_type + ''.join(chunks)))
+    inst = (struct.pack('<20sH', 'Strings', 0) +
+            struct.pack('<20sH', 'EOI', 2))
+    ibag = struct.pack('<HH', 0, 0) + struct.pack('<HH', 2, 0) + \
+           struct.pack('<HH', 3, 0)
+    igen = (struct.pack('<HBB', 43, 40, 80) + struct.pack('<HBB', 53, 0, 0) +
+            struct.pack('<HBB', 53, 1, 0) + struct.pack('<HBB', 0, 0, 0))
+    path = self.write('strings.sf2', riff('RIFF', 'sfbk',
+      riff('LIST', 'INFO', chunk('INAM', 'Nice Strings\x00')),
+      riff('LIST', 'sdta', chunk('smpl', '\x00' * 1000)),
+      riff('LIST', 'pdta', chunk('inst', inst), chunk('ibag', ibag),
+                           chunk('igen', igen))))
+    info = read_info(path)
+    self.assertEqual(info['name'], 'Nice Strings')
+    self.assertEqual(info['sample_bytes'], 1000)
+    self.assertEqual(info['regions'], 2)
+    self.assertEqual(info['key_range'], (0, 127))
+  def test_describe(self):
+    self.assertEqual(describe({ 'sample_bytes': 3 * 1024 * 1024,
+      'velocity_layers': 2, 'key_range': [ 21, 108 ] }),
+      '3.0 MB, 2 velocity layers, keys 21-108')
+  def test_cache(self):
+    path = self.write('x.sfz', '<region> key=60\n')
+    self.assertEqual(self.index.get(path), None)
+    self.assertEqual(self.index.get(path, parse=True)['key_range'], [60, 60])
+    self.index.save()
+    # the cache should survive being reloaded
+    index = InstrumentIndex(self.index.path)
+    self.assertEqual(index.get(path)['regions'], 1)
+    self.assertEqual(len(index.query(key=60)), 1)
+    self.assertEqual(len(index.query(key=61)), 0)
+    # changing the file should invalidate the entry
+    self.write('x.sfz', '<region> key=60\n<region> key=61\n')
+    os.utime(path, (0, 0))
+    self.assertEqual(index.get(path), None)
+  def test_indexer(self):
+    self.write('a.sfz', '<region> key=60\n')
+    os.mkdir(os.path.join(self.directory, 'sub'))
+    self.write(os.path.join('sub', 'b.sfz'), '<region> key=61\n')
+    indexer = self.index.index_in_background([ self.directory ])
+    indexer.join()
+    self.assertEqual(indexer.indexed, 2)
+    self.assertEqual([ e['name'] for e in self.index.query() ], ['a', 'b'])
+    indexer = self.index.index_in_background([ self.directory ])
+    indexer.join()
+    self.assertEqual(indexer.indexed, 0)
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,310 @@
+import re
+import sys
+import errno
+import socket
+import select
+import threading
+import traceback
+import collections
+import unittest
+
+# make a pipelined connection to an LSCP (LinuxSampler Control Protocol)
+#  server, which sends commands as soon as they're made and matches
+#  responses to callbacks in the order the commands were sent
+class Connection(object):
+  def __init__(self, sock, warn=None, log=None):
+    self.socket = sock
+    self.socket.setblocking(0)
+    self._warn = warn
+    self._log = log
+    # data waiting to be sent
+    self._outgoing = ''
+    # data received that doesn't make up a complete line yet
+    self._partial = ''
+    # lines received for a multiline response that isn't finished
+    self._lines = list()
+    # commands that have been sent but not answered, as tuples of
+    #  (command, callback)
+    self._pending = collections.deque()
+  # connect to a server at the given address and port
+  @classmethod
+  def open(cls, address, port, **kwargs):
+    return(cls(socket.create_connection((address, int(port))), **kwargs))
+  def fileno(self):
+    return(self.socket.fileno())
+  def close(self):
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR)
+    except socket.error: pass
+    self.socket.close()
+  # get the number of commands that haven't been answered yet
+  @property
+  def pending(self):
+    return(len(self._pending))
+  # get whether there's data that couldn't be sent without blocking
+  @property
+  def has_outgoing(self):
+    return(len(self._outgoing) > 0)
+  # send a command, calling the callback with the result when
+  #  the response arrives
+  def send(self, command, callback=None):
+    if (self._log):
+      self._log('making call: '+command)
+    self._pending.append((command, callback))
+    self._outgoing += command+'\r\n'
+    self.flush()
+  # send as much outgoing data as possible without blocking, returning
+  #  whether any is left over
+  def flush(self):
+    while (len(self._outgoing) > 0):
+      try:
+        sent = self.socket.send(self._outgoing)
+      except socket.error as e:
+        if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)):
+          break
+        raise
+      self._outgoing = self._outgoing[sent:]
+    return(len(self._outgoing) > 0)
+  # read all available data from the socket and dispatch any complete
+  #  responses, returning False if the server closed the connection
+  def read(self):
+    chunks = list()
+    is_open = True
+    while (True):
+      try:
+        data = self.socket.recv(4096)
+      except socket.error as e:
+        if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)):
+          break
+        raise
+      if (len(data) == 0):
+        is_open = False
+        break
+      chunks.append(data)
+    if (len(chunks) > 0):
+      self.feed(''.join(chunks))
+    return(is_open)
+  # parse received data and dispatch complete responses
+  def feed(self, data):
+    lines = (self._partial + data).split('\r\n')
+    # the last item is an incomplete line or an empty string
+    self._partial = lines.pop()
+    for line in lines:
+      self._on_line(line)
+  def _on_line(self, line):
+    # ignore data nobody asked for
+    if (len(self._pending) == 0): return
+    (command, callback) = self._pending[0]
+    if (len(self._lines) == 0):
+      # the first line determines whether a response is a single line
+      #  or a set of fields terminated by a line with a period
+      if ((line.startswith('ERR')) or (line.startswith('WRN'))):
+        if (self._warn):
+          self._warn(line)
+        result = line
+      elif (_field_regex.match(line)):
+        self._lines.append(line)
+        return
+      elif (command.startswith('LIST')):
+        result = _parse_list(line)
+      else:
+        result = line
+    elif (line == '.'):
+      result = _parse_fields(self._lines)
+      self._lines = list()
+    else:
+      self._lines.append(line)
+      return
+    self._pending.popleft()
+    if (self._log):
+      self._log('server responded: '+repr(result))
+    # an error in one callback shouldn't stop later responses from
+    #  reaching theirs, or they would all be matched to the wrong ones
+    if (callback is not None):
+      try:
+        callback(result)
+      except Exception:
+        message = ('error handling response to %s: %s' %
+                   (command, traceback.format_exc()))
+        if (self._warn):
+          self._warn(message)
+        else:
+          sys.stderr.write('WARNING: LSCP: '+message+'\n')
+
+# parse parts of a response
+_field_regex = re.compile('^(\\w+):\\s*(.*)$')
+def _parse_fields(lines):
+  result = dict()
+  for line in lines:
+    m = _field_regex.match(line)
+    if (m):
+      result[m.group(1)] = m.group(2)
+  return(result)
+def _parse_list(line):
+  return([ item.strip('\'"') for item in line.split(',') ])
+
+# run a minimal LSCP server on a local port for testing clients without
+#  a running LinuxSampler, optionally replying slowly or in small pieces
+#  to simulate network latency and fragmentation
+class FakeServer(object):
+  def __init__(self, engines=('GIG', 'SFZ', 'SF2'), delay=0.0,
+               chunk_size=None):
+    self.engines = engines
+    self.delay = delay
+    self.chunk_size = chunk_size
+    # all commands received in the order they arrived
+    self.commands = list()
+    self._next_channel_id = 0
+    self._next_device_id = 0
+    self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind(('127.0.0.1', 0))
+    self._listener.listen(1)
+    (self.address, self.port) = self._listener.getsockname()
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._serve,
+                                    name='jackdaw-fake-lscp')
+    self._thread.daemon = True
+  def start(self):
+    self._thread.start()
+    return(self)
+  def stop(self):
+    self._stopped.set()
+    try:
+      self._listener.close()
+    except socket.error: pass
+    self._thread.join(1.0)
+  def _serve(self):
+    try:
+      (client, address) = self._listener.accept()
+    except socket.error:
+      return
+    received = ''
+    while (not self._stopped.is_set()):
+      (readable, w, x) = select.select((client,), (), (), 0.05)
+      if (len(readable) == 0): continue
+      data = client.recv(4096)
+      if (len(data) == 0): break
+      received += data
+      lines = received.split('\r\n')
+      received = lines.pop()
+      for line in lines:
+        self.commands.append(line)
+        self._reply(client, self.respond(line))
+    client.close()
+  def _reply(self, client, response):
+    if (self.delay > 0):
+      self._stopped.wait(self.delay)
+    size = self.chunk_size if self.chunk_size else len(response)
+    for i in range(0, len(response), size):
+      client.sendall(response[i:i + size])
+  # make a response to a command
+  def respond(self, command):
+    if (command == 'GET SERVER INFO'):
+      return(self._fields((('DESCRIPTION', 'Fake LinuxSampler'),
+                           ('VERSION', '0.0'),
+                           ('PROTOCOL_VERSION', '1.7'))))
+    if (command == 'LIST AVAILABLE_ENGINES'):
+      return(','.join([ "'%s'" % e for e in self.engines ])+'\r\n')
+    if (command == 'ADD CHANNEL'):
+      self._next_channel_id += 1
+      return('OK[%d]\r\n' % (self._next_channel_id - 1))
+    if (command.startswith('CREATE ')):
+      self._next_device_id += 1
+      return('OK[%d]\r\n' % (self._next_device_id - 1))
+    if (command.startswith('LOAD ENGINE ')):
+      engine = command.split(' ')[2]
+      if (engine not in self.engines):
+        return('ERR:0:Unknown engine %s\r\n' % engine)
+      return('OK\r\n')
+    if (command.startswith('GET CHANNEL INFO ')):
+      return(self._fields((('ENGINE_NAME', self.engines[0]),
+                           ('INSTRUMENT_STATUS', '100'))))
+    if ((command.startswith('SET ')) or
+        (command.startswith('ADD CHANNEL MIDI_INPUT ')) or
+        (command.startswith('REMOVE CHANNEL MIDI_INPUT ')) or
+        (command.startswith('DESTROY ')) or
+        (command.startswith('LOAD INSTRUMENT '))):
+      return('OK\r\n')
+    return('ERR:0:Unknown command\r\n')
+  def _fields(self, pairs):
+    return(''.join([ '%s: %s\r\n' % pair for pair in pairs ])+'.\r\n')
+
+class TestConnection(unittest.TestCase):
+  def setUp(self):
+    self.server = None
+    self.connection = None
+    self.results = list()
+  def tearDown(self):
+    if (self.connection is not None):
+      self.connection.close()
+    if (self.server is not None):
+      self.server.stop()
+  def connect(self, **kwargs):
+    self.server = FakeServer(**kwargs).start()
+    self.connection = Connection.open(self.server.address, self.server.port)
+  # wait for all pending commands to be answered
+  def wait(self, timeout=5.0):
+    while (self.connection.pending > 0):
+      (readable, w, x) = select.select((self.connection,), (), (), timeout)
+      self.assertTrue(len(readable) > 0, 'timed out waiting for a response')
+      self.assertTrue(self.connection.read())
+  def on_result(self, result):
+    self.results.append(result)
+  # test that responses of every kind come back in order
+  def test_pipelined(self):
+    self.connect(chunk_size=3)
+    commands = ('GET SERVER INFO', 'LIST AVAILABLE_ENGINES',
+                'ADD CHANNEL', 'LOAD ENGINE SFZ 0', 'LOAD ENGINE XYZ 0',
+                'GET CHANNEL INFO 0', 'ADD CHANNEL')
+    for command in commands:
+      self.connection.send(command, self.on_result)
+    self.wait()
+    self.assertEqual(self.server.commands, list(commands))
+    self.assertEqual(self.results[0]['DESCRIPTION'], 'Fake LinuxSampler')
+    self.assertEqual(self.results[1], [ 'GIG', 'SFZ', 'SF2' ])
+    self.assertEqual(self.results[2], 'OK[0]')
+    self.assertEqual(self.results[3], 'OK')
+    self.assertTrue(self.results[4].startswith('ERR'))
+    self.assertEqual(self.results[5]['INSTRUMENT_STATUS'], '100')
+    self.assertEqual(self.results[6], 'OK[1]')
+  # test that commands don't wait for earlier responses to be sent
+  def test_no_round_trip_per_command(self):
+    self.connect(delay=0.05)
+    for i in range(10):
+      self.connection.send('ADD CHANNEL', self.on_result)
+    # all commands should be on their way before any response arrives
+    self.assertFalse(self.connection.has_outgoing)
+    self.wait()
+    self.assertEqual(self.results, [ 'OK[%d]' % i for i in range(10) ])
+  # test that a failing callback doesn't stop other responses from
+  #  reaching the right callbacks
+  def test_callback_error(self):
+    warnings = list()
+    connection = Connection(socket.socket(), warn=warnings.append)
+    def fail(result):
+      raise ValueError(result)
+    connection._pending.append(('ADD CHANNEL', fail))
+    for i in range(3):
+      connection._pending.append(('ADD CHANNEL', self.on_result))
+    connection.feed('OK[0]\r\nOK[1]\r\nOK[2]\r\n')
+    self.assertEqual(connection.pending, 1)
+    connection.feed('OK[3]\r\n')
+    connection.socket.close()
+    self.assertEqual(self.results, [ 'OK[1]', 'OK[2]', 'OK[3]' ])
+    self.assertEqual(len(warnings), 1)
+    self.assertTrue('ValueError' in warnings[0])
+  # test parsing responses split at arbitrary points
+  def test_feed(self):
+    connection = Connection(socket.socket())
+    connection._pending.append(('GET SERVER INFO', self.on_result))
+    connection._pending.append(('LIST X', self.on_result))
+    for c in 'VERSION: 1\r\nA: b c\r\n.\r\n\'a\',\'b\'\r\n':
+      connection.feed(c)
+    connection.socket.close()
+    self.assertEqual(self.results, [ { 'VERSION': '1', 'A': 'b c' },
+                                     [ 'a', 'b' ] ])
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
@@ -12,10 +12,14 @@ from model import Selection
 from undo import UndoManager
 
 import sampler
+import instrument_index
 import audio
 import transport
 import track
 import midi
+import smf
+import debug
+import profiling
 from unit import Unit, GroupUnit
 
 # this class holds the stack of views and models a context click 
@@ -93,6 +97,13 @@ class WorkspaceMenu(QMenu):
                     'Add a system audio output unit', self.on_add_audio_output)
     self.add_action('data', 'MIDI Monitor', 
                     'Add a visual MIDI message monitor', self.on_add_midi_monitor)
+    self.add_action('data', 'Playback Meter', 
+                    'Add a meter showing playback timing', 
+                    self.on_add_playback_meter)
+    if (profiling.enabled):
+      self.add_action('data', 'Profiler', 
+                      'Add a unit showing profiling statistics',
+                      self.on_add_profiler)
   def add_action(self, icon_name, name, description, callback):
     action = QAction(icon.get(icon_name), name, self)
     action.setStatusTip(description)
@@ -154,6 +165,18 @@ class WorkspaceMenu(QMenu):
         name='Monitor',
         x=self.scene_pos.x(),
         y=self.scene_pos.y()))
+  # add a playback timing meter
+  def on_add_playback_meter(self, *args):
+    self.add_unit(debug.PlaybackMeterUnit(
+        name='Playback',
+        x=self.scene_pos.x(),
+        y=self.scene_pos.y()))
+  # add a profiler overlay
+  def on_add_profiler(self, *args):
+    self.add_unit(debug.ProfilerUnit(
+        name='Profiler',
+        x=self.scene_pos.x(),
+        y=self.scene_pos.y()))
 ContextMenu.register_context('WorkspaceView', WorkspaceMenu, ('document',))
 
 # make a context menu for an instrument
@@ -171,6 +194,10 @@ class InstrumentMenu(QMenu):
       for path in glob.glob(os.path.join(search_dir, '*'+ext)):
         (name, ext) = os.path.splitext(os.path.basename(path))
         action = QAction(name, self)
+        description = instrument_index.describe(
+          instrument_index.Index.get(path))
+        if (len(description) > 0):
+          action.setStatusTip(description)
         is_current = (path == self.instrument.path)
         action.setEnabled(not is_current)
         action.setCheckable(is_current)
@@ -181,6 +208,13 @@ class InstrumentMenu(QMenu):
     action = QAction(icon.get('instrument'), 'Browse...', self)
     action.triggered.connect(self.on_browse)
     self.addAction(action)
+    action = QAction('Share Sampler Channel', self)
+    action.setStatusTip('Load the file once for all instruments that '+
+                        'use it, sharing their audio output')
+    action.triggered.connect(self.on_toggle_shared)
+    if (self.instrument.shared):
+      action.setIcon(icon.get('check'))
+    self.addAction(action)
     if (self.instruments):
       action = QAction(icon.get('delete'), 'Remove', self)
       action.triggered.connect(self.on_remove)
@@ -193,6 +227,10 @@ class InstrumentMenu(QMenu):
     UndoManager.begin_action(self.instrument)
     self.instrument.browse()
     UndoManager.end_action()
+  def on_toggle_shared(self):
+    UndoManager.begin_action(self.instrument)
+    self.instrument.shared = not self.instrument.shared
+    UndoManager.end_action()
   def on_remove(self):
     UndoManager.begin_action((self.instruments, self.document))
     if (self.document is not None):
@@ -224,6 +262,46 @@ class TransportUnitMenu(QMenu):
     self.transport.protocol = protocol
 ContextMenu.register_context('TransportUnitView', TransportUnitMenu, ('unit',))
 
+# make a context menu for a sequencer unit
+class SequencerUnitMenu(QMenu):
+  def __init__(self, unit, event, parent, view=None):
+    QMenu.__init__(self, parent)
+    self.setTitle('Sequencer')
+    self.setIcon(icon.get('tracks'))
+    self.unit = unit
+    action = QAction(icon.get('midi'), 'Import MIDI File...', self)
+    action.setStatusTip('Add tracks from a standard MIDI file')
+    action.triggered.connect(self.on_import)
+    self.addAction(action)
+    action = QAction(icon.get('midi'), 'Export MIDI File...', self)
+    action.setStatusTip('Save the tracks to a standard MIDI file')
+    action.triggered.connect(self.on_export)
+    self.addAction(action)
+  def on_import(self):
+    (path, group) = QFileDialog.getOpenFileName(None,
+      "Import MIDI File", "~", "MIDI Files (*.mid *.midi);;All Files (*.*)")
+    if (len(path) == 0): return
+    try:
+      with open(path, 'rb') as f:
+        tracks = smf.read_tracks(f, transport=self.unit.transport)
+    except (IOError, ValueError) as e:
+      sys.stderr.write('WARNING: failed to import %s: %s\n' % (path, e))
+      return
+    UndoManager.begin_action(self.unit.tracks)
+    self.unit.tracks.extend(tracks)
+    UndoManager.end_action()
+  def on_export(self):
+    (path, group) = QFileDialog.getSaveFileName(None,
+      "Export MIDI File", "~", "MIDI Files (*.mid *.midi);;All Files (*.*)")
+    if (len(path) == 0): return
+    try:
+      with open(path, 'wb') as f:
+        for chunk in smf.write_tracks(self.unit.tracks):
+          f.write(chunk)
+    except IOError as e:
+      sys.stderr.write('WARNING: failed to export %s: %s\n' % (path, e))
+ContextMenu.register_context('SequencerUnitView', SequencerUnitMenu, ('unit',))
+
 class TrackMenu(QMenu):
   def __init__(self, track, event, parent, view=None):
     QMenu.__init__(self, parent)
@@ -242,11 +320,31 @@ class TrackMenu(QMenu):
     delete_action.setStatusTip('Delete this track')
     delete_action.triggered.connect(self.on_delete)
     self.addAction(delete_action)
+    self.mpe_menu = QMenu(self)
+    self.mpe_menu.setTitle('MPE')
+    zones = ((None, 'Off'),
+             ('lower', 'Lower Zone'),
+             ('upper', 'Upper Zone'))
+    for (zone, label) in zones:
+      action = QAction(label, self.mpe_menu)
+      action.setStatusTip(
+        'Play and record each note on its own channel' if zone else
+        'Rotate notes through all channels')
+      action.triggered.connect(functools.partial(self.on_set_mpe_zone, zone))
+      if (zone == self.track.mpe_zone):
+        action.setIcon(icon.get('check'))
+      self.mpe_menu.addAction(action)
+    self.addMenu(self.mpe_menu)
   # delete the block
   def on_delete(self, *args):
     UndoManager.begin_action((self.tracks, self.patch_bay))
     self.tracks.remove(self.track)
     UndoManager.end_action()
+  # set the MPE zone the track uses
+  def on_set_mpe_zone(self, zone):
+    UndoManager.begin_action(self.track)
+    self.track.mpe_zone = zone
+    UndoManager.end_action()
 ContextMenu.register_context('TrackView', TrackMenu, ('track',))
 
 class BlockMenu(QMenu):
@@ -367,6 +465,12 @@ class ControllerMenu(QMenu):
     change_action.setStatusTip('Change the number of this controller')
     change_action.triggered.connect(self.on_change)
     self.addAction(change_action)
+    simplify_action = QAction('Simplify', self)
+    simplify_action.setStatusTip(
+      'Remove changes on controller %d that can be done without' % 
+        self.number)
+    simplify_action.triggered.connect(self.on_simplify)
+    self.addAction(simplify_action)
     delete_action = QAction(icon.get('delete'), 'Delete', self)
     delete_action.setStatusTip(
       'Delete all changes on controller %d' % self.number)
@@ -382,6 +486,10 @@ class ControllerMenu(QMenu):
       new_number = dialog.intValue()
       if (new_number != self.number):
         self.events.remap_ccsets(self.number, new_number)
+  def on_simplify(self):
+    UndoManager.begin_action(self.events)
+    self.events.thin_controller(self.number)
+    UndoManager.end_action()
   def on_delete(self):
     self.events.begin_change_block()
     for event in set(self.events):
@@ -460,10 +568,40 @@ class MidiMonitorMenu(QMenu):
     if (self.unit.show_time):
       action.setIcon(icon.get('check'))
     self.addAction(action)
+    self.type_menu = QMenu(self)
+    self.type_menu.setTitle('Show Messages')
+    for (message_type, label) in self.unit.MESSAGE_TYPES:
+      action = QAction(label, self.type_menu)
+      action.setStatusTip('Show or hide %s messages' % label.lower())
+      action.triggered.connect(
+        functools.partial(self.on_toggle_type, message_type))
+      if (message_type not in self.unit.hidden_types):
+        action.setIcon(icon.get('check'))
+      self.type_menu.addAction(action)
+    self.addMenu(self.type_menu)
+    action = QAction(icon.get('delete'), 'Clear', self)
+    action.setStatusTip('Remove all messages from the monitor')
+    action.triggered.connect(self.on_clear)
+    self.addAction(action)
+    if (self.unit.dropped > 0):
+      action = QAction('%d Messages Dropped' % self.unit.dropped, self)
+      action.setStatusTip(
+        'Messages that arrived too fast to be shown')
+      action.setEnabled(False)
+      self.addAction(action)
   def on_set_style(self, style):
     self.unit.style = style
   def on_toggle_show_time(self):
     self.unit.show_time = not self.unit.show_time
+  def on_toggle_type(self, message_type):
+    hidden = set(self.unit.hidden_types)
+    if (message_type in hidden):
+      hidden.remove(message_type)
+    else:
+      hidden.add(message_type)
+    self.unit.hidden_types = hidden
+  def on_clear(self):
+    self.unit.clear()
 ContextMenu.register_context('MidiMonitorUnitView', MidiMonitorMenu, ('unit',))
 
 # make a context menu for a connection
@@ -511,4 +649,18 @@ class HueMenu(QMenu):
       action.triggered.connect(functools.partial(self.on_hue, hue))
       self.addAction(action)
   def on_hue(self, hue):
-    self._target.hue = hue
\ No newline at end of file
+    self._target.hue = hue
+# make a context menu for a playback meter
+class PlaybackMeterMenu(QMenu):
+  def __init__(self, unit, event, parent, view=None):
+    QMenu.__init__(self, parent)
+    self.setTitle('Playback Meter')
+    self.setIcon(icon.get('data'))
+    self.unit = unit
+    action = QAction(icon.get('delete'), 'Reset', self)
+    action.setStatusTip('Clear all timing measurements')
+    action.triggered.connect(self.on_reset)
+    self.addAction(action)
+  def on_reset(self):
+    self.unit.reset()
+ContextMenu.register_context('PlaybackMeterUnitView', PlaybackMeterMenu, ('unit',))
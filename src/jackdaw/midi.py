@@ -1,5 +1,6 @@
 import time
-import jackpatch
+import collections
+from backend import jackpatch
 import re
 import yaml
 
@@ -8,6 +9,7 @@ from PySide.QtCore import QTimer
 import observable
 import serializable
 import unit
+import profiling
 
 # handles a placeholder and adapter for a JACK midi device
 class DeviceAdapter(unit.Source, unit.Sink, observable.Object):
@@ -89,10 +91,18 @@ class DeviceAdapterList(observable.List):
     # map devices by name
     self._name_map = dict()
     observable.List.__init__(self, adapters)
-    # make a client connection to jack
-    self._client = jackpatch.Client('jackdaw-devices')
-    # scan for devices on a regular basis
-    self.startTimer(1000)
+    # the MIDI ports found by the last scan, keyed by name
+    self._ports = dict()
+    self._scan_pending = False
+    # use the shared client connection to jack
+    self._client = unit.JackClient.client
+    # scan whenever JACK tells us ports have come or gone, if it can, 
+    #  otherwise fall back to scanning on a regular basis
+    if (unit.JackClient.notifies_port_registration):
+      unit.JackClient.ports_changed.connect(self._on_ports_changed)
+    else:
+      self.startTimer(1000)
+    self.scan()
   # get an adapter for the device with the given name
   def adapter_named(self, name):
     if (name not in self._name_map):
@@ -108,24 +118,31 @@ class DeviceAdapterList(observable.List):
   # respond to timer events by scanning for devices
   def timerEvent(self, event):
     self.scan()
-  # scan for changes to the set of plugged in devices
+  # scan once for a burst of changes, like a device adding several ports
+  def _on_ports_changed(self):
+    if (self._scan_pending): return
+    self._scan_pending = True
+    QTimer.singleShot(0, self.scan)
+  # scan for changes to the set of plugged in devices, only updating
+  #  adapters for ports that have appeared or disappeared
   def scan(self):
-    not_found = set(self._name_map.keys())
-    # make sure all plugged-in devices have adapters
-    devices = self._client.get_ports(type_pattern='.*midi.*')
-    for device in devices:
-      name = device.name
+    self._scan_pending = False
+    ports = dict()
+    for device in self._client.get_ports(type_pattern='.*midi.*'):
       # ignore ports created by this application
-      if (name.startswith('jackdaw')): continue
-      if (name in not_found):
-        not_found.remove(name)
+      if (device.name.startswith('jackdaw')): continue
+      ports[device.name] = device
+    # disconnect missing devices from their adapters
+    for name in self._ports.iterkeys():
+      if ((name not in ports) and (name in self._name_map)):
+        self._name_map[name].device = None
+    # make sure all plugged-in devices have adapters
+    for (name, device) in ports.iteritems():
+      if (name in self._ports): continue
       adapter = self.adapter_named(name)
       if (adapter.device is None):
         adapter.device = device
-    # disconnect missing devices from their adapters
-    for name in not_found:
-      adapter = self.adapter_named(name)
-      adapter.device = None
+    self._ports = ports
   # adapter list serialization
   def serialize(self):
     # serialize only devices with some connections
@@ -191,15 +208,22 @@ class InputHandler(observable.Object):
       try:
         model.begin_change_block()
       except AttributeError: pass
+    received = 0
     while (True):
       result = self._port.receive()
       if (result is None): break
       (data, msg_time) = result
       self.handle_message(data, msg_time)
+      received += 1
       # handle at least one message per run, but limit overall processing time
       #  to keep the UI responsive, allowing the jackpatch buffer to handle 
       #  the backlog
-      if ((limit_time) and (time.time() > time_limit)): break
+      if ((limit_time) and (time.time() > time_limit)):
+        if (profiling.enabled):
+          profiling.count('input.receive_time_limited')
+        break
+    if ((profiling.enabled) and (received > 0)):
+      profiling.record('input.messages_per_receive', received)
     for model in target_and_refs:
       try:
         model.end_change_block()
@@ -210,18 +234,43 @@ class InputHandler(observable.Object):
   
 # a unit for examining MIDI messages
 class MidiMonitorUnit(unit.Sink, unit.Unit):
-  def __init__(self, style='hex', show_time=False, *args, **kwargs):
+  # the types of message that can be hidden, in display order
+  MESSAGE_TYPES = (('note', 'Notes'),
+                   ('control', 'Control Changes'),
+                   ('program', 'Program Changes'),
+                   ('bend', 'Pitch Bend'),
+                   ('aftertouch', 'Aftertouch'),
+                   ('sysex', 'System Exclusive'),
+                   ('system', 'System Common'),
+                   ('clock', 'Clock'),
+                   ('realtime', 'Other Realtime'))
+  def __init__(self, style='hex', show_time=False, hidden_types=(),
+               *args, **kwargs):
     unit.Unit.__init__(self, *args, **kwargs)
     unit.Sink.__init__(self)
     self._style = style
     self._show_time = show_time
-    self.messages = list()
+    self._hidden_types = frozenset(hidden_types)
+    # keep the most recent messages in a ring buffer
     self._max_messages = 100
-    self._client = jackpatch.Client('jackdaw-monitor')
-    self._client.activate()
+    self.messages = collections.deque(maxlen=self._max_messages)
+    # the total number of messages stored, which views can use to 
+    #  find which messages are new since they last looked
+    self.received = 0
+    # the number of messages that were pushed out of the buffer by
+    #  newer ones before observers were notified of them
+    self.dropped = 0
+    self._unseen = 0
+    # the number of times the messages have been cleared
+    self.cleared = 0
+    # limit change notifications to about the display's refresh rate
+    self._notify_interval = 1.0 / 60.0
+    self._last_notify = 0.0
+    self._client = unit.JackClient.client
     self._sink_type = 'midi'
-    self._sink_port = jackpatch.Port(client=self._client,
-      name='capture', flags=jackpatch.JackPortIsInput)
+    self._sink_port = unit.JackClient.make_port(
+      unit.JackClient.make_namespace('monitor'), 
+      'capture', jackpatch.JackPortIsInput)
     self._timer = QTimer()
     self._timer.setInterval(0)
     self._timer.timeout.connect(self.receive)
@@ -242,22 +291,67 @@ class MidiMonitorUnit(unit.Sink, unit.Unit):
     if (value != self._show_time):
       self._show_time = value
       self.on_change()
+  # the types of message (see MESSAGE_TYPES) that aren't stored
+  @property
+  def hidden_types(self):
+    return(self._hidden_types)
+  @hidden_types.setter
+  def hidden_types(self, value):
+    value = frozenset(value)
+    if (value != self._hidden_types):
+      self._hidden_types = value
+      self.on_change()
+  # get the type of a message from its status byte
+  @staticmethod
+  def message_type(data):
+    if (len(data) == 0): return(None)
+    status = data[0]
+    kind = status & 0xF0
+    if ((kind == 0x80) or (kind == 0x90)): return('note')
+    if ((kind == 0xA0) or (kind == 0xD0)): return('aftertouch')
+    if (kind == 0xB0): return('control')
+    if (kind == 0xC0): return('program')
+    if (kind == 0xE0): return('bend')
+    if (status in (0xF0, 0xF7)): return('sysex')
+    if (status == 0xF8): return('clock')
+    if (status > 0xF8): return('realtime')
+    return('system')
   def receive(self):
-    message_added = False
+    hidden = self._hidden_types
     while (True):
       result = self._sink_port.receive()
       if (result is None): break
-      (data, time) = result
-      self.messages.append((data, time))
-      message_added = True
-    if (message_added):
-      # trim the message list if it gets too long to conserve memory
-      if (len(self.messages) > self._max_messages):
-        self.messages = self.messages[-self._max_messages:]
+      (data, msg_time) = result
+      if ((hidden) and (self.message_type(data) in hidden)): continue
+      self.messages.append((data, msg_time))
+      self.received += 1
+      self._unseen += 1
+    if (self._unseen > 0):
+      # notify no more often than the display can show changes
+      now = time.time()
+      if (now - self._last_notify < self._notify_interval): return
+      self._last_notify = now
+      # count messages that came in too fast to be seen
+      if (self._unseen > self._max_messages):
+        self.dropped += self._unseen - self._max_messages
+      self._unseen = 0
       self.on_change()
+  # get the messages stored since the given count of received messages
+  def messages_since(self, received):
+    count = min(len(self.messages), max(0, self.received - received))
+    if (count == 0): return([ ])
+    return(list(self.messages)[-count:])
+  # remove all messages
+  def clear(self):
+    self.messages.clear()
+    self.cleared += 1
+    self.dropped = 0
+    self._unseen = 0
+    self.on_change()
   def serialize(self):
     obj = unit.Unit.serialize(self)
     obj['style'] = self.style
     obj['show_time'] = self.show_time
+    obj['hidden_types'] = sorted(self.hidden_types)
     return(obj)
 serializable.add(MidiMonitorUnit)
\ No newline at end of file
@@ -102,6 +102,9 @@ class MidiMonitorUnitView(unit_view.UnitView):
     text.setFont(font)
     self._content = text
     self._metrics = QFontMetrics(font)
+    # keep track of what's been rendered so new messages can be appended
+    self._rendered = None
+    self._rendered_received = 0
     self.unit.add_observer(self.render)
   def destroy(self):
     self.unit.remove_observer(self.render)
@@ -112,26 +115,49 @@ class MidiMonitorUnitView(unit_view.UnitView):
     s.setWidth(max(s.width(), self.unit.width))
     s.setHeight(max(s.height(), self.unit.height))
     return(s)
+  # format a message as a line of text
+  def format_message(self, data, time):
+    style = self.unit.style
+    if (style == 'decimal'):
+      line = ', '.join(map(str, data))+' '
+    elif (style == 'binary'):
+      line = ' '.join(map('{0:08b}'.format, data))+' '
+    else:
+      line = ('%02X ' * len(data)) % tuple(data)
+    if (self.unit.show_time):
+      line += '(%0.3f)' % time
+    return(line)
   # show a textual represenation of MIDI events
   def render(self):
-    messages = self.unit.messages
-    lines = list()
+    unit = self.unit
     line_height = self._metrics.lineSpacing()
-    max_height = self.unit.height
-    style = self.unit.style
-    show_time = self.unit.show_time
-    for (data, time) in reversed(messages):
-      if (style == 'decimal'):
-        line = ', '.join(map(str, data))+' '
-      elif (style == 'binary'):
-        line = ' '.join(map('{0:08b}'.format, data))+' '
-      else:
-        line = ('%02X ' * len(data)) % tuple(data)
-      if (show_time):
-        line += '(%0.3f)' % time
-      lines.append(line)
-      if (len(lines) * line_height >= max_height): break
-    self._content.setPlainText('\n'.join(reversed(lines)))
+    max_lines = max(1, int(math.ceil(unit.height / line_height)))
+    settings = (unit.style, unit.show_time, unit.hidden_types, 
+                unit.cleared, max_lines)
+    document = self._content.document()
+    if (settings != self._rendered):
+      # redraw everything if the way messages are shown has changed
+      self._rendered = settings
+      messages = list(unit.messages)[-max_lines:]
+      self._content.setPlainText('\n'.join(
+        [ self.format_message(*message) for message in messages ]))
+      # let the document drop old lines as new ones are added
+      document.setMaximumBlockCount(max_lines)
+    else:
+      messages = unit.messages_since(self._rendered_received)
+      if (len(messages) > 0):
+        # only format the lines that will be visible
+        lines = [ self.format_message(*message) 
+                  for message in messages[-max_lines:] ]
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        if (not document.isEmpty()):
+          cursor.insertText('\n')
+        cursor.insertText('\n'.join(lines))
+    self._rendered_received = unit.received
+    self._content.setToolTip(
+      '%d messages arrived too fast to show' % unit.dropped
+      if (unit.dropped > 0) else '')
     self.layout()
 unit_view.UnitView.register_unit_view(
   midi.MidiMonitorUnit, MidiMonitorUnitView)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import unittest
+
+# support for MIDI Polyphonic Expression (MPE), where each sounding note
+#  gets its own "member" channel so that pitch bend, pressure, and timbre
+#  (CC 74) can be applied to notes independently, and a "master" channel
+#  carries messages that apply to the whole zone
+
+# the controller number used for per-note timbre
+TIMBRE_CONTROLLER = 74
+
+# the center value of a 14-bit pitch bend
+BEND_CENTER = 0x2000
+
+# convert a pitch bend in semitones to a 14-bit value given the bend range
+#  in semitones that the receiver will use for a full bend
+def encode_bend(bend, bend_range):
+  value = int(BEND_CENTER + round(bend * (float(BEND_CENTER) / bend_range)))
+  return(min(max(0, value), 0x3FFF))
+# convert a 14-bit pitch bend value to semitones
+def decode_bend(value, bend_range):
+  return((float(value - BEND_CENTER) / float(BEND_CENTER)) * bend_range)
+
+# make the messages to set the pitch bend range of the given channels
+#  in semitones with Registered Parameter Number 0
+def bend_range_messages(bend_range, channels=range(16)):
+  semitones = int(bend_range)
+  cents = int(round((bend_range - semitones) * 100.0))
+  messages = list()
+  for channel in channels:
+    messages.extend(rpn_messages(channel, 0x0000, semitones, cents))
+  return(messages)
+
+# make the messages to set a registered parameter, ending with the null
+#  parameter so later data entry can't change it by accident
+def rpn_messages(channel, parameter, msb, lsb=None):
+  cc = 0xB0 | (channel & 0xF)
+  messages = [ (cc, 0x65, (parameter >> 7) & 0x7F),
+               (cc, 0x64, parameter & 0x7F),
+               (cc, 0x06, msb & 0x7F) ]
+  if (lsb is not None):
+    messages.append((cc, 0x26, lsb & 0x7F))
+  messages.extend(((cc, 0x65, 0x7F), (cc, 0x64, 0x7F)))
+  return(messages)
+
+# describe an MPE zone, which can be the lower zone with its master
+#  channel on channel 1 (0 here) and members above it, or the upper zone
+#  with its master on channel 16 (15 here) and members below it
+class Zone(object):
+  SIDES = ('lower', 'upper')
+  def __init__(self, side='lower', members=15):
+    if (side not in self.SIDES):
+      raise ValueError('Unknown MPE zone %r' % side)
+    self.side = side
+    self.members = min(max(1, members), 15)
+  @property
+  def master_channel(self):
+    return(0 if self.side == 'lower' else 15)
+  @property
+  def member_channels(self):
+    if (self.side == 'lower'):
+      return(range(1, 1 + self.members))
+    return(range(14, 14 - self.members, -1))
+  # return whether a channel is a member of the zone
+  def is_member(self, channel):
+    if (self.side == 'lower'):
+      return(1 <= channel <= self.members)
+    return(15 - self.members <= channel <= 14)
+  # make the MPE Configuration Message that sets up the zone on a receiver,
+  #  which also resets the bend range of member channels to 48 semitones
+  def configuration_messages(self):
+    return(rpn_messages(self.master_channel, 0x0006, self.members))
+
+# remember the last value of per-channel state like pitch bend, pressure,
+#  and controllers so messages that wouldn't change anything can be skipped
+class ChannelState(object):
+  def __init__(self):
+    self.reset()
+  # forget all state, so the next value sent for anything will be sent
+  def reset(self):
+    self._values = dict()
+  # get the last value of a kind of state on a channel, or the
+  #  given default if it's unknown
+  def get(self, kind, channel, default=None):
+    return(self._values.get((kind, channel), default))
+  # store a new value, returning whether it's different from the last one
+  def update(self, kind, channel, value):
+    key = (kind, channel)
+    if (self._values.get(key, None) == value): return(False)
+    self._values[key] = value
+    return(True)
+  # get the channels that have a known value for a kind of state
+  def channels(self, kind):
+    return([ channel for (k, channel) in self._values.iterkeys()
+             if k == kind ])
+
+class TestMPE(unittest.TestCase):
+  def test_bend(self):
+    self.assertEqual(encode_bend(0.0, 2.0), 0x2000)
+    self.assertEqual(encode_bend(2.0, 2.0), 0x3FFF)
+    self.assertEqual(encode_bend(-2.0, 2.0), 0x0000)
+    self.assertEqual(encode_bend(-5.0, 2.0), 0x0000)
+    self.assertAlmostEqual(decode_bend(encode_bend(1.5, 48.0), 48.0), 1.5,
+                           places=2)
+    self.assertTrue(decode_bend(0x3000, 2.0) > 0.0)
+  def test_zones(self):
+    lower = Zone('lower', 3)
+    self.assertEqual(lower.master_channel, 0)
+    self.assertEqual(lower.member_channels, [ 1, 2, 3 ])
+    self.assertTrue(lower.is_member(3))
+    self.assertFalse(lower.is_member(4))
+    upper = Zone('upper', 2)
+    self.assertEqual(upper.master_channel, 15)
+    self.assertEqual(upper.member_channels, [ 14, 13 ])
+    self.assertFalse(upper.is_member(12))
+    self.assertEqual(Zone('lower', 99).members, 15)
+    self.assertRaises(ValueError, Zone, 'middle')
+  def test_configuration(self):
+    messages = Zone('upper', 7).configuration_messages()
+    self.assertEqual(messages[0:3],
+      [ (0xBF, 0x65, 0x00), (0xBF, 0x64, 0x06), (0xBF, 0x06, 7) ])
+    self.assertEqual(messages[-1], (0xBF, 0x64, 0x7F))
+  def test_channel_state(self):
+    state = ChannelState()
+    self.assertTrue(state.update('bend', 1, 0x2000))
+    self.assertFalse(state.update('bend', 1, 0x2000))
+    self.assertTrue(state.update('bend', 2, 0x2000))
+    self.assertEqual(sorted(state.channels('bend')), [ 1, 2 ])
+    state.reset()
+    self.assertEqual(state.get('bend', 1), None)
+    self.assertTrue(state.update('bend', 1, 0x2000))
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
@@ -2,6 +2,8 @@ import unittest
 
 from PySide.QtCore import QObject, Signal
 
+import profiling
+
 # make an object which can report changes to itself
 class Object(QObject):
   changed = Signal()
@@ -20,6 +22,8 @@ class Object(QObject):
       # block change events from firing while sending the signal to avoid 
       #  unbounded recursion
       self._change_block_level += 1
+      if (profiling.enabled):
+        profiling.count('on_change.'+type(self).__name__)
       self.changed.emit()
       self._change_block_level = max(0, self._change_block_level - 1)
     else:
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import collections
+import unittest
+
+# collect counts and timings from hot paths so we can see which of them are
+#  behind a stutter, which is off unless the JACKDAW_PROFILE environment
+#  variable is set (or JACKDAW_PROFILE_DUMP, see debug.py), and which 
+#  callers should check before doing any work to keep the cost near zero 
+#  when it's off
+enabled = bool(os.environ.get('JACKDAW_PROFILE') or 
+               os.environ.get('JACKDAW_PROFILE_DUMP'))
+
+# keep running statistics for a series of values
+class Stat(object):
+  __slots__ = ('count', 'total', 'min', 'max', 'last')
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.min = None
+    self.max = None
+    self.last = None
+  def add(self, value):
+    self.count += 1
+    self.total += value
+    if ((self.min is None) or (value < self.min)):
+      self.min = value
+    if ((self.max is None) or (value > self.max)):
+      self.max = value
+    self.last = value
+  @property
+  def mean(self):
+    if (self.count == 0): return(None)
+    return(self.total / self.count)
+  def as_dict(self):
+    return({ 'count': self.count, 'total': self.total, 'mean': self.mean,
+             'min': self.min, 'max': self.max, 'last': self.last })
+
+_counters = collections.defaultdict(int)
+_stats = collections.defaultdict(Stat)
+_start_time = time.time()
+
+# add to the counter with the given name
+def count(name, n=1):
+  _counters[name] += n
+# add a value, such as a duration in seconds, to the named statistics
+def record(name, value):
+  _stats[name].add(value)
+# clear everything collected so far
+def reset():
+  global _start_time
+  _counters.clear()
+  _stats.clear()
+  _start_time = time.time()
+
+# get a copy of the counters, keyed by name
+def counters():
+  return(dict(_counters))
+# get a summary of everything collected as a dict that can be
+#  encoded as JSON
+def report():
+  return({
+    'enabled': enabled,
+    'time': time.time(),
+    'elapsed': time.time() - _start_time,
+    'counters': dict(_counters),
+    'stats': dict([ (name, stat.as_dict())
+                    for (name, stat) in _stats.iteritems() ])
+  })
+# write a report to the given path as JSON, adding any extra
+#  sections given as a dict
+def dump(path, extra=None):
+  data = report()
+  if (extra is not None):
+    data.update(extra)
+  temp_path = path+'.tmp'
+  with open(temp_path, 'w') as f:
+    json.dump(data, f, indent=2, sort_keys=True)
+  os.rename(temp_path, path)
+
+class TestProfiling(unittest.TestCase):
+  def setUp(self):
+    reset()
+  def test_counters(self):
+    count('a')
+    count('a', 2)
+    count('b')
+    self.assertEqual(counters(), { 'a': 3, 'b': 1 })
+  def test_stats(self):
+    for value in (2.0, 1.0, 3.0):
+      record('t', value)
+    stats = report()['stats']['t']
+    self.assertEqual(stats['count'], 3)
+    self.assertEqual(stats['mean'], 2.0)
+    self.assertEqual((stats['min'], stats['max'], stats['last']),
+                     (1.0, 3.0, 3.0))
+  def test_reset(self):
+    count('a')
+    record('t', 1.0)
+    reset()
+    self.assertEqual(report()['counters'], { })
+    self.assertEqual(report()['stats'], { })
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
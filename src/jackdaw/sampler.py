@@ -5,21 +5,26 @@ import re
 import subprocess
 import fcntl
 import atexit
+import functools
 import socket
-import jackpatch
+import collections
+import unittest
+from backend import jackpatch
 
 from PySide.QtCore import *
-from PySide.QtGui import QFileDialog
 
 import observable
 import serializable
 import unit
+import lscp
+import instrument_index
+import profiling
 
 # manage a sampler-based instrument
 class Instrument(observable.Object, unit.Source, unit.Sink):
   # the path to browse for instruments in
   _instrument_dir = "~"
-  def __init__(self, path=None, name=None, sampler=None):
+  def __init__(self, path=None, name=None, shared=False, sampler=None):
     observable.Object.__init__(self)
     unit.Source.__init__(self)
     unit.Sink.__init__(self)
@@ -30,20 +35,29 @@ class Instrument(observable.Object, unit.Source, unit.Sink):
       sampler = LinuxSampler
     self._name = name
     self._sampler = sampler
+    # whether to share a sampler channel with other instruments 
+    #  that have the same path, which is off for documents saved before
+    #  it was possible so their routing is kept as it was
+    self._shared = shared
+    # a MIDI input of the instrument's own when it shares a channel that
+    #  another instrument was already using, so they can be routed 
+    #  separately
+    self._input = None
     self._progress = 0
-    self._progress_timer = None
     self._path = None
     self._channel = None
+    self._channel_path = None
     self._channel_connected = False
     self._path_loading = False
     self._path_loaded = False
     self.path = path
   def __del__(self):
-    if (self._channel is not None):
-      self._sampler.release_channel(self._channel)
-      self._channel = None
+    self._sampler.loader.remove(self)
+    self._detach()
   @classmethod
   def path_from_browse(cls, dirpath=None):
+    # import the GUI here so the engine can run without it
+    from PySide.QtGui import QFileDialog
     if (dirpath is None):
       dirpath = cls._instrument_dir
     (path, group) = QFileDialog.getOpenFileName(None,
@@ -52,12 +66,16 @@ class Instrument(observable.Object, unit.Source, unit.Sink):
     # store the directory for the next browse
     if (len(path) > 0):
       cls._instrument_dir = os.path.dirname(path)
+      # index the other instruments there so they can be described
+      #  without loading them
+      instrument_index.Index.index_in_background(
+        (cls._instrument_dir,), recursive=False)
     return(path)
   @classmethod
   def new_from_browse(cls):
     path = cls.path_from_browse()
     if (len(path) == 0): return(None)
-    return(cls(path=path))
+    return(cls(path=path, shared=True))
   def browse(self):
     path = Instrument.path_from_browse(os.path.dirname(self.path))
     if (len(path) == 0): return
@@ -74,6 +92,8 @@ class Instrument(observable.Object, unit.Source, unit.Sink):
       self.on_change()
   @property
   def sink_port(self):
+    if (self._input is not None):
+      return(self._input.port)
     if (self._channel is None):
       return(None)
     return(self._channel.input_port)
@@ -85,20 +105,52 @@ class Instrument(observable.Object, unit.Source, unit.Sink):
   @property
   def channel(self):
     return(self._channel)
+  # get a summary of the instrument file from the index, if it's been
+  #  indexed, which can be used to predict the cost of loading it
+  @property
+  def info(self):
+    if (self._path is None): return(None)
+    return(instrument_index.Index.get(self._path))
+  # whether the instrument shares its sampler channel (and therefore its
+  #  audio output) with others that load the same file
+  @property
+  def shared(self):
+    return(self._shared)
+  @shared.setter
+  def shared(self, value):
+    if (value != self._shared):
+      # give up the channel the way it was acquired before switching
+      self._detach()
+      self._shared = value
+      self._attach()
+      self.on_change()
+  # get how much of the instrument file has been loaded from 0.0 to 1.0
+  @property
+  def progress(self):
+    if (self._path_loaded): return(1.0)
+    return(max(0.0, min(1.0, self._progress / 100.0)))
+  # whether the instrument file is currently being loaded
+  @property
+  def loading(self):
+    return(self._path_loading)
   @property
   def path(self):
     return(self._path)
   @path.setter
   def path(self, value):
     if (value != self._path):
+      self._sampler.loader.remove(self)
       self._path_loading = False
       self._path_loaded = False
+      self._progress = 0
       self._path = value
       self._attach()   
       self.on_change()
   # add a sampler channel for the instrument and load a sample file, if any
   def _attach(self):
-    if (self._path is None): return
+    if (self._path is None):
+      self._detach()
+      return
     m = re.search('(.*)\.([^.]+)$', os.path.basename(self._path))
     if (not m):
       self._sampler.warn(
@@ -106,63 +158,70 @@ class Instrument(observable.Object, unit.Source, unit.Sink):
     engine = m.group(2).upper()
     if (self._name is None):
       self.name = m.group(1)
-    # make sure we have a channel with the right engine
-    if ((self._channel is None) or (self._channel.engine != engine)):
-      if (self._channel is not None):
-        self._channel.remove_observer(self._load_path)
-        self._channel.remove_observer(self.on_change)
-        self._sampler.release_channel(self._channel)
-      self._channel = self._sampler.allocate_channel_with_engine(engine)
+    # get a channel with the right engine, which may already have the
+    #  file loaded for another instrument
+    if (self._channel_path != self._path):
+      self._detach()
+      if (self._shared):
+        self._channel = self._sampler.acquire_channel_for_path(
+          engine, self._path)
+        # the first instrument on a shared channel uses the channel's own
+        #  MIDI input, and later ones get their own mapped onto it
+        if (self._sampler.shared_channel_users(self._path) > 1):
+          self._input = self._sampler.make_input()
+          self._channel.add_input(self._input)
+      else:
+        self._channel = self._sampler.allocate_channel_with_engine(engine)
+      self._channel_path = self._path
     # once the channel is ready, load the instrument file onto it
     self._channel.add_observer(self._load_path)
     self._channel.add_observer(self.on_change)
     self._load_path()
-  # load a new instrument
+  # give up the current sampler channel, if any
+  def _detach(self):
+    if (self._channel is None): return
+    self._channel.remove_observer(self._load_path)
+    self._channel.remove_observer(self.on_change)
+    if (self._input is not None):
+      self._channel.remove_input(self._input)
+      self._input.destroy()
+      self._input = None
+    if (self._shared):
+      self._sampler.release_channel_for_path(self._channel, 
+                                             self._channel_path)
+    else:
+      self._sampler.release_channel(self._channel)
+    self._channel = None
+    self._channel_path = None
+  # load the instrument file onto the channel unless it's already loaded
+  #  or loading there, and keep track of the channel's progress
   def _load_path(self):
-    # if the path is already loaded, we don't need to do anything
-    if ((self._path_loading) or (self._path_loaded)): return
     # make sure we have a file to load
-    if (self._path is None): return
+    if ((self._path is None) or (self._channel is None)): return
     # make sure the channel is ready
     if (not self._channel.is_ready): return
-    # stop the progress timer if an instrument was being loaded
-    if (self._progress_timer is not None):
-      self._progress_timer.stop()
-      self._progress_timer = None
-    # reset the progress
-    self._progress = 0
-    # start loading the instrument from the current path
-    self._path_loading = True
-    self._sampler.call('LOAD INSTRUMENT NON_MODAL "%s" 0 %d' %
-      (_escape(self._path), self._channel._channel_id), self._on_load_start)
-  # handle the instrument beginning to load
-  def _on_load_start(self, result):
-    if (result.startswith('OK')):
-      self._path_loading = True
-      self._progress_timer = QTimer(self)
-      self._progress_timer.timeout.connect(self._update_progress)
-      self._progress_timer.start(500)
+    if (self._channel.instrument_path != self._path):
+      self._channel.load_instrument(self._path)
+    # update loading state from the channel
+    loading = self._channel.instrument_loading
+    loaded = self._channel.instrument_loaded
+    progress = self._channel.instrument_progress
+    if ((loading == self._path_loading) and (loaded == self._path_loaded) and
+        (progress == self._progress)): return
+    self._path_loading = loading
+    self._path_loaded = loaded
+    self._progress = progress
+    # let the sampler's loader poll for progress along with any
+    #  other instruments that are loading
+    if (loading):
+      self._sampler.loader.add(self)
     else:
-      self._path_loading = False
-  # check for progress in loading the instrument
-  def _update_progress(self):
-    # see if we're finished loading
-    if ((self._progress >= 100) or (self._progress < 0)):
-      self._progress_timer.stop()
-      self._progress_timer = None
-      self._path_loading = False
-      self._path_loaded = (self._progress >= 100)
-      return
-    # ask for another progress report
-    self._sampler.call('GET CHANNEL INFO %d' % self._channel.channel_id, 
-      self._on_progress)
-  def _on_progress(self, result):
-    if ((result) and ('INSTRUMENT_STATUS' in result)):
-      self._progress = int(result['INSTRUMENT_STATUS'])
+      self._sampler.loader.remove(self)
   def serialize(self):
     return({ 
       'name': self.name,
-      'path': self.path
+      'path': self.path,
+      'shared': self.shared
     })
 serializable.add(Instrument)
 
@@ -188,6 +247,89 @@ class InstrumentListUnit(unit.Unit):
     return(obj)
 serializable.add(InstrumentListUnit)
 
+# poll the progress of all instruments being loaded at once, keeping track
+#  of the overall progress of each batch of instruments loaded together
+class InstrumentLoader(observable.Object):
+  def __init__(self, interval=500):
+    observable.Object.__init__(self)
+    self.interval = interval
+    # instruments that are still loading
+    self._loading = list()
+    # all instruments added since nothing was loading
+    self._batch = list()
+    self._batch_start = None
+    self._timer = None
+  # start tracking an instrument that has begun loading
+  def add(self, instrument):
+    if (instrument in self._loading): return
+    if (len(self._loading) == 0):
+      self._batch = list()
+      self._batch_start = time.time()
+    self._loading.append(instrument)
+    if (instrument not in self._batch):
+      self._batch.append(instrument)
+    if (self._timer is None):
+      self._timer = QTimer(self)
+      self._timer.timeout.connect(self._poll)
+      self._timer.start(self.interval)
+    self.on_change()
+  # stop tracking an instrument, e.g. because it finished loading
+  def remove(self, instrument):
+    if (instrument not in self._loading): return
+    self._loading.remove(instrument)
+    if (len(self._loading) == 0):
+      self._stop()
+      # don't keep finished instruments alive
+      self._batch = list()
+    self.on_change()
+  def _stop(self):
+    if (self._timer is not None):
+      self._timer.stop()
+      self._timer = None
+  # request progress for all loading instruments, which are sent to the
+  #  sampler together without waiting for each other's responses
+  def _poll(self):
+    channels = set()
+    for instrument in list(self._loading):
+      channel = instrument.channel
+      # instruments sharing a channel only need to ask once
+      if ((channel is None) or (channel in channels)): continue
+      channels.add(channel)
+      channel.request_progress()
+    self.on_change()
+  # whether any instruments are loading
+  @property
+  def loading(self):
+    return(len(self._loading) > 0)
+  # the number of instruments in the current batch
+  @property
+  def count(self):
+    return(len(self._batch))
+  # the number of instruments in the current batch that are done
+  @property
+  def finished_count(self):
+    return(len(self._batch) - len(self._loading))
+  # get the overall progress of the current batch from 0.0 to 1.0
+  @property
+  def progress(self):
+    if (len(self._batch) == 0): return(1.0)
+    total = 0.0
+    for instrument in self._batch:
+      if (instrument in self._loading):
+        total += instrument.progress
+      else:
+        total += 1.0
+    return(total / len(self._batch))
+  # estimate the number of seconds until the current batch is loaded,
+  #  or None if there isn't enough information to tell
+  @property
+  def eta(self):
+    if (len(self._loading) == 0): return(0.0)
+    progress = self.progress
+    if ((progress <= 0.0) or (self._batch_start is None)): return(None)
+    elapsed = time.time() - self._batch_start
+    return(elapsed * (1.0 - progress) / progress)
+
 # manage a MIDI input device in LinuxSampler
 class SamplerInput(observable.Object):
   def __init__(self, sampler=None, name=None):
@@ -198,6 +340,7 @@ class SamplerInput(observable.Object):
     self._sampler = sampler
     self._name = name
     self._input_id = None
+    self._destroyed = False
     # this is used to cache the JACK port associated with the input
     self.port = None
     self._allocate()
@@ -219,10 +362,31 @@ class SamplerInput(observable.Object):
       m = re.match('OK\[(.*)\]', result)
       if (m):
         self._input_id = int(m.group(1))
+        # finish destroying an input that was destroyed while it was 
+        #  being created
+        if (self._destroyed):
+          self.destroy()
+          return
         self.on_change()
       self.on_change()
     else:
       self._sampler.warn('failed to connect MIDI input: %s' % result)    
+  # find the JACK port the sampler made for the input, if any
+  def find_port(self):
+    if ((self.port is None) and (self._name is not None)):
+      ports = self._sampler._client.get_ports(
+        name_pattern=self._name+':.*',
+        flags=jackpatch.JackPortIsInput)
+      if (len(ports) > 0):
+        self.port = ports[0]
+    return(self.port)
+  # remove the input device from the sampler
+  def destroy(self):
+    self._destroyed = True
+    if (self._input_id is not None):
+      self._sampler.call('DESTROY MIDI_INPUT_DEVICE %d' % self._input_id)
+      self._input_id = None
+      self.port = None
 
 # manage an audio output device in LinuxSampler
 class SamplerOutput(observable.Object):
@@ -274,10 +438,18 @@ class SamplerChannel(observable.Object):
     self._input_connected = False
     self._input_connecting = False
     self._input_port = None
+    # more MIDI inputs mapped onto the channel, each mapped to True once
+    #  it's connected, None while connecting, and False before that
+    self._extra_inputs = dict()
     self._output = None
     self._output_connected = False
     self._output_connecting = False
     self._output_port = None
+    # the path of the instrument file loaded onto the channel
+    self._instrument_path = None
+    self._instrument_loading = False
+    self._instrument_loaded = False
+    self._instrument_progress = 0
     # load the right sampler engine and allocate a channel id
     self._allocate()
   @property
@@ -297,6 +469,53 @@ class SamplerChannel(observable.Object):
   @property
   def output_port(self):
     return(self._output_port)
+  # the state of the instrument file loaded onto the channel
+  @property
+  def instrument_path(self):
+    return(self._instrument_path)
+  @property
+  def instrument_loading(self):
+    return(self._instrument_loading)
+  @property
+  def instrument_loaded(self):
+    return(self._instrument_loaded)
+  # get the percentage of the instrument that's been loaded
+  @property
+  def instrument_progress(self):
+    return(self._instrument_progress)
+  # start loading an instrument file onto the channel
+  def load_instrument(self, path):
+    self._instrument_path = path
+    self._instrument_loading = True
+    self._instrument_loaded = False
+    self._instrument_progress = 0
+    self._sampler.call('LOAD INSTRUMENT NON_MODAL "%s" 0 %d' %
+      (_escape(path), self.channel_id), 
+      functools.partial(self._on_load_start, path))
+    self.on_change()
+  def _on_load_start(self, path, result):
+    if (path != self._instrument_path): return
+    if (not result.startswith('OK')):
+      self._instrument_loading = False
+      self.on_change()
+  # ask for a report on the progress of loading the instrument
+  def request_progress(self):
+    if (not self._instrument_loading): return
+    self._sampler.call('GET CHANNEL INFO %d' % self.channel_id, 
+      functools.partial(self._on_progress, self._instrument_path))
+  def _on_progress(self, path, result):
+    if ((path != self._instrument_path) or 
+        (not self._instrument_loading)): return
+    progress = self._instrument_progress
+    if ((result) and ('INSTRUMENT_STATUS' in result)):
+      progress = int(result['INSTRUMENT_STATUS'])
+    # see if we're finished loading
+    if ((progress >= 100) or (progress < 0)):
+      self._instrument_loading = False
+      self._instrument_loaded = (progress >= 100)
+    elif (progress == self._instrument_progress): return
+    self._instrument_progress = progress
+    self.on_change()
   # allocate a new sampler channel
   def _allocate(self):
     self._sampler.call('ADD CHANNEL', self._on_channel_add)
@@ -306,6 +525,7 @@ class SamplerChannel(observable.Object):
       self._channel_id = int(m.group(1))
       self.on_change()
       self._load_engine()
+      self._connect_extra_inputs()
     else:
       self._sampler.warn('failed to add channel: %s' % str(result))
   # load a sampler engine for the channel
@@ -349,15 +569,42 @@ class SamplerChannel(observable.Object):
       self._input_connected = True
       # attempt to bind to the input to a JACK port
       if (self._input_port is None):
-        ports = self._sampler._client.get_ports(
-          name_pattern=self._input.name+':.*',
-          flags=jackpatch.JackPortIsInput)
-        if (len(ports) > 0):
-          self._input.port = ports[0]
-          self._input_port = self._input.port
+        self._input_port = self._input.find_port()
       self.on_change()
     else:
       self._sampler.warn('failed to set channel input: %s' % str(result))
+  # map another MIDI input onto the channel, so it plays the channel as
+  #  well as the channel's own input does
+  def add_input(self, input):
+    if (input in self._extra_inputs): return
+    self._extra_inputs[input] = False
+    input.add_observer(self._connect_extra_inputs)
+    self._connect_extra_inputs()
+  # stop a MIDI input added with add_input from playing the channel
+  def remove_input(self, input):
+    if (input not in self._extra_inputs): return
+    state = self._extra_inputs.pop(input)
+    input.remove_observer(self._connect_extra_inputs)
+    if ((state is not False) and (input.input_id is not None)):
+      self._sampler.call('REMOVE CHANNEL MIDI_INPUT %d %d' % 
+        (self.channel_id, input.input_id))
+  # connect extra inputs when they and the channel are available
+  def _connect_extra_inputs(self):
+    if (self.channel_id is None): return
+    for (input, state) in self._extra_inputs.items():
+      if ((state is False) and (input.input_id is not None)):
+        self._extra_inputs[input] = None
+        self._sampler.call('ADD CHANNEL MIDI_INPUT %d %d' % 
+          (self.channel_id, input.input_id), 
+          functools.partial(self._on_extra_input_set, input))
+  def _on_extra_input_set(self, input, result):
+    if (input not in self._extra_inputs): return
+    if (result.startswith('OK')):
+      self._extra_inputs[input] = True
+      input.find_port()
+      self.on_change()
+    else:
+      self._sampler.warn('failed to add channel input: %s' % str(result))
   # make a property to get or set the output device
   @property
   def output(self):
@@ -399,16 +646,40 @@ class SamplerChannel(observable.Object):
     else:
       self._sampler.warn('failed to set channel output: %s' % str(result))
 
+# get the number of spare sampler channels to keep for each engine from
+#  the JACKDAW_SAMPLER_POOL environment variable, if it's set
+def pool_size_from_environment(default=1):
+  value = os.environ.get('JACKDAW_SAMPLER_POOL')
+  if (not value): return(default)
+  try:
+    return(max(0, int(value)))
+  except ValueError:
+    sys.stderr.write(
+      'WARNING: JACKDAW_SAMPLER_POOL should be a number, not %r\n' % value)
+    return(default)
+
 # manage a LinuxSampler process acting as a backend for sample playback
 class LinuxSamplerSingleton(observable.Object):
-  def __init__(self, verbose=False):
+  def __init__(self, verbose=False, pool_size=None, 
+                     pool_engines=('GIG', 'SFZ', 'SF2')):
     observable.Object.__init__(self)
     self.verbose = verbose
+    # the number of ready channels to keep on hand for each engine once
+    #  an instrument has used it, so more instruments can be added 
+    #  without waiting for a channel to be set up; each channel has its 
+    #  own MIDI input and audio output in JACK, so engines that are never
+    #  used get no spares
+    if (pool_size is None):
+      pool_size = pool_size_from_environment()
+    self.pool_size = pool_size
+    self.pool_engines = pool_engines
     self.address = '0.0.0.0'
     self.port = '8888'
     self.device_id = None
-    # make a JACK client for querying ports
-    self._client = jackpatch.Client('jackdaw-sampler')
+    # use the shared JACK client for querying ports
+    self._client = unit.JackClient.client
+    # track the progress of instruments being loaded
+    self.loader = InstrumentLoader()
     self._reset()
   # log activity
   def _log(self, message):
@@ -425,20 +696,24 @@ class LinuxSamplerSingleton(observable.Object):
     # status flags about the sampler
     self.started = False
     self.ready = False
-    # a socket for communicating with the sampler
+    # a pipelined connection for communicating with the sampler
     self.connection = None
-    self._received = ''
-    # queued calls to the sampler
-    self._pending_call = None
-    self._queued_calls = list()
+    # calls made before the connection was opened
+    self._queued_calls = collections.deque()
     # info about the server
     self.server_info = dict()
     self.engines = list()
-    # active timers
+    # active timers and socket notifiers
     self._status_timer = None
-    self._receive_timer = None
+    self._read_notifier = None
+    self._write_notifier = None
     # a list of unused sampler channels
     self._unused_channels_by_engine = dict()
+    # the engines instruments have used, which get spare channels
+    self._used_engines = set()
+    # channels shared by instruments with the same path, as lists of
+    #  [ channel, reference count ] keyed by path
+    self._shared_channels = dict()
     # a unique numeric id to assign created input/output ports
     self._unique_port_id = 1
     # when started, check the status of the connection by asking for info
@@ -467,15 +742,7 @@ class LinuxSamplerSingleton(observable.Object):
     # stop timeouts
     if (self._status_timer):
       self._status_timer.stop()
-    elif (self._receive_timer):
-      self._receive_timer.stop()
-    if (self.connection):
-      self._log('closing connection')
-      try:
-        self.connection.shutdown(1)
-        self.connection.close()
-      except socket.error:
-        pass
+    self._close_connection()
     self._log('terminating sampler')
     self.process.terminate()
     time.sleep(0.25)
@@ -529,82 +796,79 @@ class LinuxSamplerSingleton(observable.Object):
     self.warn(error)
   # respond to the sampler being started
   def _on_start(self):
-    self.connection = socket.create_connection((self.address, self.port))
-    self.connection.setblocking(0)
-    self._next_call()
-  # send a command to the sampler
+    self.connect(self.address, self.port)
+  # connect to an LSCP server and send any calls made before now
+  def connect(self, address, port):
+    self.connection = lscp.Connection.open(address, port,
+                                           warn=self.warn, log=self._log)
+    self._read_notifier = QSocketNotifier(
+      self.connection.fileno(), QSocketNotifier.Read, self)
+    self._read_notifier.activated.connect(self._receive)
+    self._write_notifier = QSocketNotifier(
+      self.connection.fileno(), QSocketNotifier.Write, self)
+    self._write_notifier.activated.connect(self._send)
+    self._write_notifier.setEnabled(False)
+    while (len(self._queued_calls) > 0):
+      self.call(*self._queued_calls.popleft())
+  def _close_connection(self):
+    for notifier in (self._read_notifier, self._write_notifier):
+      if (notifier is not None):
+        notifier.setEnabled(False)
+    self._read_notifier = None
+    self._write_notifier = None
+    if (self.connection):
+      self._log('closing connection')
+      try:
+        self.connection.close()
+      except socket.error:
+        pass
+    self.connection = None
+  # send a command to the sampler, which will call the callback with the
+  #  result once it responds; commands are sent without waiting for 
+  #  earlier ones to finish, and responses arrive in the order they're sent
   def call(self, command, callback=None):
-    # queue calls if the connection isn't open or one is pending
-    if ((self._pending_call) or not (self.connection)):
+    # queue calls if the connection isn't open
+    if (not self.connection):
       self._queued_calls.append((command, callback))
       return
-    # make a call
-    self._log('making call: '+command)
-    self._pending_call = (command, callback)
-    command = command+'\r\n'
-    while (len(command) > 0):
-      bytes = self.connection.send(command)
-      command = command[bytes:]
-    # listen for the response
-    self._receive_timer = QTimer(self)
-    self._receive_timer.timeout.connect(self._receive)
-    self._receive_timer.start(100)
-  def _next_call(self):
-    # send the next call in the queue if there is one
-    if (len(self._queued_calls) > 0):
-      params = self._queued_calls[0]
-      self._queued_calls = self._queued_calls[1:]
-      self.call(*params)
-      return(True)
-    else:
-      return(False)
-  # receive a response from the sampler
+    if (profiling.enabled):
+      callback = self._timed_callback(callback)
+    try:
+      self.connection.send(command, callback)
+    except socket.error as e:
+      self.warn('failed to send command %s: %s' % (command, e))
+      return
+    # if the socket's buffer is full, send the rest when there's room
+    if (self.connection.has_outgoing):
+      self._write_notifier.setEnabled(True)
+  # wrap a callback to record the time until the response arrives
+  def _timed_callback(self, callback):
+    sent = time.time()
+    def on_response(result):
+      profiling.record('lscp.round_trip', time.time() - sent)
+      if (callback is not None):
+        callback(result)
+    return(on_response)
+  # send data that couldn't be sent without blocking
+  def _send(self):
+    if (not self.connection): return
+    try:
+      if (not self.connection.flush()):
+        self._write_notifier.setEnabled(False)
+    except socket.error as e:
+      self.warn('failed to send: %s' % e)
+      self._close_connection()
+  # receive and dispatch responses from the sampler
   def _receive(self):
+    if (not self.connection): return
     try:
-      self._received += self.connection.recv(1024)
-    except IOError:
-      return(True)
-    # only consider the request finished if we have a complete line
-    if ((len(self._received) < 2) or (self._received[-2:] != '\r\n')):
-      return(True)
-    # break into lines
-    lines = self._received[0:-2].split('\r\n')
-    # if we got a single line, the request is complete
-    result = None
-    if (len(lines) == 1):
-      line = lines[0]
-      # detect errors
-      if ((line.startswith('WRN')) or (line.startswith('ERR'))):
-        self.warn(line)
-      # handle list-like responses
-      command = self._pending_call[0]
-      if (command.startswith('LIST')):
-        result = line.split(',')
-        for i in range(0, len(result)):
-          result[i] = result[i].strip('\'"')
-      else:
-        result = line
-    # if multiline, wait for a final line with just a period
-    elif ((len(lines) > 1) and (lines[-1] == '.')):
-      result = dict()
-      for line in lines[0:-1]:
-        m = re.match('^(\\w+):\\s*(.*)$', line)
-        if (m):
-          result[m.group(1)] = m.group(2)
-    else:
-      return(True)
-    self._received = ''
-    # show the result
-    self._log('server responded: '+repr(result))
-    # trigger the callback
-    callback = self._pending_call[1]
-    if (callback is not None):
-      callback(result)
-    self._pending_call = None
-    # send the next call in the queue if there is one
-    if (not self._next_call()):
-      self._receive_timer = None
-    return(False)
+      is_open = self.connection.read()
+    except socket.error as e:
+      self.warn('failed to receive: %s' % e)
+      is_open = False
+    if (not is_open):
+      self._log('connection closed by sampler')
+      self._close_connection()
   # respond to getting the first info from the server
   def _on_server_info(self, info):
     self.server_info.update(info)
@@ -614,12 +878,68 @@ class LinuxSamplerSingleton(observable.Object):
     self.on_change()
   def _on_engines(self, engines):
     self.engines = engines
+    # make spare channels for engines used before the list arrived
+    for engine in self._used_engines:
+      self._fill_pool(engine)
   # allocate a new sampler channel or get an unused one from the pool
   def allocate_channel_with_engine(self, engine):
-    if (engine in self._unused_channels_by_engine):
-      channels = self._unused_channels_by_engine[engine]
-      if (len(channels) > 0):
-        return(channels.pop())
+    self._used_engines.add(engine)
+    # fill the pool after any calls the caller is about to make
+    QTimer.singleShot(0, functools.partial(self._fill_pool, engine))
+    channels = self._unused_channels_by_engine.get(engine, ())
+    if (len(channels) > 0):
+      # prefer channels that have finished being set up
+      channel = channels[-1]
+      for ready_channel in channels:
+        if (ready_channel.is_ready):
+          channel = ready_channel
+          break
+      channels.remove(channel)
+      return(channel)
+    return(self._make_channel(engine))
+  # get a channel for the given instrument file which is shared with any
+  #  other instruments that use the same file, so that it's only loaded once
+  def acquire_channel_for_path(self, engine, path):
+    if (path in self._shared_channels):
+      entry = self._shared_channels[path]
+      if (entry[0].engine == engine):
+        entry[1] += 1
+        return(entry[0])
+    channel = self.allocate_channel_with_engine(engine)
+    self._shared_channels[path] = [ channel, 1 ]
+    return(channel)
+  # get the number of instruments sharing the channel for a file
+  def shared_channel_users(self, path):
+    entry = self._shared_channels.get(path)
+    if (entry is None): return(0)
+    return(entry[1])
+  # release a channel acquired with acquire_channel_for_path once
+  #  nothing else is using it
+  def release_channel_for_path(self, channel, path):
+    entry = self._shared_channels.get(path)
+    if ((entry is None) or (entry[0] is not channel)):
+      self.release_channel(channel)
+      return
+    entry[1] -= 1
+    if (entry[1] <= 0):
+      del self._shared_channels[path]
+      self.release_channel(channel)
+  # add channels to the pool for the given engine until it's full
+  def _fill_pool(self, engine):
+    if ((engine not in self.pool_engines) or
+        (engine not in self.engines)): return
+    if (engine not in self._unused_channels_by_engine):
+      self._unused_channels_by_engine[engine] = list()
+    channels = self._unused_channels_by_engine[engine]
+    while (len(channels) < self.pool_size):
+      channels.append(self._make_channel(engine))
+  # make a new MIDI input device with a unique name
+  def make_input(self):
+    name = 'LinuxSampler-'+str(self._unique_port_id)
+    self._unique_port_id += 1
+    return(SamplerInput(sampler=self, name=name))
+  # make a new channel with its own input and output
+  def _make_channel(self, engine):
     # make a name for the channel's input/output JACK client
     name = 'LinuxSampler-'+str(self._unique_port_id)
     self._unique_port_id += 1
@@ -651,3 +971,46 @@ def _escape(s):
 # make a singleton instance of the sampler backend
 LinuxSampler = LinuxSamplerSingleton(verbose=False)
 
+class TestInstrument(unittest.TestCase):
+  def setUp(self):
+    self.sampler = LinuxSamplerSingleton(pool_size=0)
+  def unused_channels(self):
+    return([ channel
+      for channels in self.sampler._unused_channels_by_engine.itervalues()
+        for channel in channels ])
+  def test_toggle_shared(self):
+    a = Instrument(path='/x/a.sfz', shared=True, sampler=self.sampler)
+    b = Instrument(path='/x/a.sfz', shared=True, sampler=self.sampler)
+    self.assertIs(a.channel, b.channel)
+    shared = self.sampler._shared_channels['/x/a.sfz']
+    self.assertEqual(shared[1], 2)
+    # turning sharing off should leave the shared channel in use by the
+    #  other instrument rather than returning it to the pool
+    b.shared = False
+    self.assertIsNot(a.channel, b.channel)
+    self.assertEqual(shared[1], 1)
+    self.assertNotIn(a.channel, self.unused_channels())
+    # turning it back on should join the other instrument again
+    b.shared = True
+    self.assertIs(a.channel, b.channel)
+    self.assertEqual(shared[1], 2)
+    self.assertEqual(len(self.unused_channels()), 1)
+  def test_separate_inputs(self):
+    a = Instrument(path='/x/a.sfz', shared=True, sampler=self.sampler)
+    b = Instrument(path='/x/a.sfz', shared=True, sampler=self.sampler)
+    # the second instrument gets a MIDI input of its own on the channel
+    self.assertIsNone(a._input)
+    self.assertIsNotNone(b._input)
+    self.assertIn(b._input, a.channel._extra_inputs)
+    b.shared = False
+    self.assertIsNone(b._input)
+    self.assertEqual(a.channel._extra_inputs, dict())
+  def test_unshared_by_default(self):
+    # documents saved before sharing existed keep separate channels
+    a = Instrument(path='/x/a.sfz', sampler=self.sampler)
+    b = Instrument(path='/x/a.sfz', sampler=self.sampler)
+    self.assertIsNot(a.channel, b.channel)
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+# decide how far into the future to queue events for playback, which
+#  trades off how quickly edits are heard against how likely the queue
+#  is to run dry before the next update; the window is sized to cover
+#  the update interval plus the worst recent lateness of updates,
+#  growing as soon as updates are late and shrinking slowly as the
+#  event loop proves responsive again
+class ScheduleAhead(object):
+  def __init__(self, interval=0.05, floor=0.1, ceiling=1.0,
+               margin=0.02, decay=0.98):
+    # the expected number of seconds between updates
+    self.interval = interval
+    # the smallest and largest number of seconds to keep queued
+    self.floor = floor
+    self.ceiling = ceiling
+    # extra time to queue beyond what measurements suggest is needed
+    self.margin = margin
+    # the fraction of the peak lateness to keep for each update
+    #  that isn't later than that
+    self.decay = decay
+    self._peak = 0.0
+  # the worst recent lateness in seconds, decayed over time
+  @property
+  def peak(self):
+    return(self._peak)
+  # update the estimate with the lateness of an update
+  def on_tick(self, interval, lateness):
+    self.interval = interval
+    self._peak = max(lateness, self._peak * self.decay, 0.0)
+  # update the estimate after the queue ran dry by the given
+  #  number of seconds, which every track playing may report for the
+  #  same late update, so reports are combined rather than added up
+  def on_underrun(self, deficit):
+    self._peak = max(self._peak, deficit)
+  # the amount of time to keep queued, below which more
+  #  events should be scheduled
+  @property
+  def minimum(self):
+    ahead = self.interval + (2.0 * self._peak) + self.margin
+    return(min(max(self.floor, ahead), self.ceiling))
+  # the amount of time to queue when scheduling more events
+  @property
+  def maximum(self):
+    return(self.minimum + self.interval)
+
+class TestScheduleAhead(unittest.TestCase):
+  def test_floor(self):
+    s = ScheduleAhead(interval=0.05)
+    self.assertEqual(s.minimum, 0.1)
+    self.assertAlmostEqual(s.maximum, 0.15)
+  def test_grows_under_load(self):
+    s = ScheduleAhead(interval=0.05)
+    s.on_tick(0.05, 0.1)
+    self.assertAlmostEqual(s.minimum, 0.27)
+    s.on_tick(0.05, 5.0)
+    self.assertEqual(s.minimum, 1.0)
+  def test_shrinks_when_responsive(self):
+    s = ScheduleAhead(interval=0.05)
+    s.on_tick(0.05, 0.1)
+    grown = s.minimum
+    s.on_tick(0.05, 0.0)
+    self.assertTrue(s.minimum < grown)
+    for i in range(1000):
+      s.on_tick(0.05, -0.001)
+    self.assertEqual(s.minimum, 0.1)
+  def test_underrun(self):
+    s = ScheduleAhead(interval=0.05)
+    s.on_underrun(0.2)
+    self.assertAlmostEqual(s.peak, 0.2)
+    # many tracks running dry on the same update count once
+    for i in range(20):
+      s.on_underrun(0.1)
+    self.assertAlmostEqual(s.peak, 0.2)
+    self.assertAlmostEqual(s.minimum, 0.47)
+    s.on_underrun(0.3)
+    self.assertAlmostEqual(s.peak, 0.3)
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
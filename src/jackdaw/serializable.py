@@ -1,4 +1,14 @@
+import os
 import yaml
+import tempfile
+try:
+  import cPickle as pickle
+except:
+  import pickle
+try:
+  from copy_reg import __newobj__
+except ImportError:
+  from copyreg import __newobj__
 
 _classes = set()
 def add(cls):
@@ -21,4 +31,110 @@ def add(cls):
     self.__init__(**d)
   cls.__getstate__ = getstate
   cls.__setstate__ = setstate
-    
+
+# keep track of how much of a snapshot has been written
+class SnapshotContext(object):
+  def __init__(self):
+    # the total number of objects in the snapshot
+    self.count = 0
+    # the number of objects that have been encoded so far
+    self.written = 0
+  # get the fraction of objects written from 0.0 to 1.0
+  @property
+  def progress(self):
+    if (self.count == 0): return(1.0)
+    return(min(1.0, float(self.written) / float(self.count)))
+
+# hold the serialized state of an object at a point in time, so it can
+#  be encoded without touching the live object (e.g. on another thread)
+class Snapshot(object):
+  def __init__(self, cls, context):
+    self.cls = cls
+    self.context = context
+    self.state = None
+  # pickle to exactly what the original object would have pickled to,
+  #  which requires posing as the original class for pickle's sanity check
+  @property
+  def __class__(self):
+    return(self.cls)
+  def __reduce_ex__(self, protocol):
+    self.context.written += 1
+    return((__newobj__, (self.cls,), self.state))
+def _represent_snapshot(dumper, snapshot):
+  snapshot.context.written += 1
+  return(dumper.represent_mapping(
+    u'!%s' % snapshot.cls.__name__, snapshot.state))
+yaml.add_representer(Snapshot, _represent_snapshot)
+
+# make a snapshot of the serialized state of the given object and
+#  everything it references, which can later be passed to dump
+def snapshot(thing):
+  return(_snapshot_value(thing, dict(), SnapshotContext()))
+def _snapshot_value(value, memo, context):
+  t = type(value)
+  if (t is tuple):
+    return(tuple([ _snapshot_value(v, memo, context) for v in value ]))
+  if ((t not in _classes) and (t is not list) and (t is not dict)):
+    return(value)
+  # preserve shared references, keeping the original value alive so
+  #  its id can't be reused by a temporary object
+  key = id(value)
+  if (key in memo):
+    return(memo[key][1])
+  if (t is list):
+    copy = list()
+    memo[key] = (value, copy)
+    for item in value:
+      copy.append(_snapshot_value(item, memo, context))
+  elif (t is dict):
+    copy = dict()
+    memo[key] = (value, copy)
+    for (k, v) in value.iteritems():
+      copy[_snapshot_value(k, memo, context)] = (
+        _snapshot_value(v, memo, context))
+  else:
+    copy = Snapshot(t, context)
+    memo[key] = (value, copy)
+    context.count += 1
+    copy.state = _snapshot_value(value.serialize(), memo, context)
+  return(copy)
+
+# encode a snapshot to a stream as YAML or pickle data
+def dump(snapshot, stream, use_yaml=False):
+  if (use_yaml):
+    yaml.dump(snapshot, stream)
+  else:
+    pickle.dump(snapshot, stream, 2)
+
+# the process's file creation mask, which can only be read by setting it,
+#  so it's read once on import rather than on the thread that saves
+_umask = os.umask(0)
+os.umask(_umask)
+
+# write a snapshot to the given path, replacing any existing file only
+#  once the new one has been completely written
+def dump_to_path(snapshot, path):
+  (fd, temp_path) = tempfile.mkstemp(
+    dir=os.path.dirname(os.path.abspath(path)),
+    prefix='.'+os.path.basename(path), suffix='.tmp')
+  try:
+    # keep the permissions of the file being replaced, or give a new file
+    #  the ones it would have had if opened normally, since temporary
+    #  files are only readable by their owner
+    if (os.path.exists(path)):
+      os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+    else:
+      os.chmod(temp_path, 0o666 & ~_umask)
+    output_stream = os.fdopen(fd, 'wb')
+    try:
+      dump(snapshot, output_stream, use_yaml=path.endswith('.yml'))
+      output_stream.flush()
+      os.fsync(output_stream.fileno())
+    finally:
+      output_stream.close()
+    os.rename(temp_path, path)
+  except:
+    try:
+      os.remove(temp_path)
+    except OSError: pass
+    raise
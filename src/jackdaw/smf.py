@@ -0,0 +1,551 @@
+import gc
+import io
+import math
+import heapq
+import struct
+import itertools
+import unittest
+import contextlib
+
+import block
+import track
+import mpe
+import bounce
+
+# the number of ticks per quarter note to use when writing files
+DEFAULT_DIVISION = 480
+# the tempo files are assumed to have before any tempo change, and the one
+#  to write them with, in microseconds per quarter note (i.e. 120 BPM)
+DEFAULT_TEMPO = 500000
+# the pitch bend range to assume until a file sets one with RPN 0
+DEFAULT_BEND_RANGE = 6.0
+# the number of seconds between values written along ramps between
+#  controller values
+RAMP_RESOLUTION = 0.01
+
+# READING #####################################################################
+
+# read a standard MIDI file into a list of tracks
+def read_tracks(stream, transport=None):
+  tracks = list()
+  with _collection_paused():
+    for (name, events, duration, bend_range) in _read_file(stream):
+      # skip tracks with no channel events, like format 1 tempo tracks
+      if (len(events) == 0): continue
+      event_list = block.EventList(events, duration=duration)
+      tracks.append(track.Track(
+        blocks=(block.Block(event_list, time=0.0, duration=duration),),
+        name=(name if name else 'Track'),
+        bend_range=bend_range,
+        transport=transport))
+  return(tracks)
+# read a standard MIDI file into a track list
+def read_track_list(stream, transport=None):
+  return(track.TrackList(tracks=read_tracks(stream, transport=transport),
+                         transport=transport))
+# read a standard MIDI file into one event list, merging all tracks
+def read_events(stream):
+  all_events = list()
+  max_duration = 0.0
+  with _collection_paused():
+    for (name, events, duration, bend_range) in _read_file(stream):
+      all_events.extend(events)
+      max_duration = max(max_duration, duration)
+    return(block.EventList(all_events, duration=max_duration))
+
+# pause the cyclic garbage collector while reading, since a large file
+#  makes many long-lived objects and nothing to collect, and the collector
+#  would otherwise rescan them over and over as they're made
+@contextlib.contextmanager
+def _collection_paused():
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if (enabled):
+      gc.enable()
+
+# read the chunks of a file one at a time, generating a tuple of
+#  (name, events, duration, bend range) for each track chunk
+def _read_file(stream):
+  chunks = _read_chunks(stream)
+  try:
+    (kind, data) = next(chunks)
+  except StopIteration:
+    raise ValueError('MIDI file is empty')
+  if ((kind != b'MThd') or (len(data) < 6)):
+    raise ValueError('MIDI file has no header')
+  (file_format, track_count, division) = struct.unpack('>HHH',
+                                                       bytes(data[0:6]))
+  if (file_format > 2):
+    raise ValueError('unsupported MIDI file format %d' % file_format)
+  tempo_map = None
+  for (kind, data) in chunks:
+    # skip unknown chunk types as the standard requires
+    if (kind != b'MTrk'): continue
+    # in format 1 files, the tempo map in the first track applies to all
+    #  tracks, otherwise each track has its own
+    use_tempo = ((tempo_map is None) or (file_format != 1))
+    if (use_tempo):
+      tempo_map = _TempoMap(division)
+    yield(_convert_track(_parse_track(data), tempo_map, use_tempo))
+
+# generate (type, data) tuples for the chunks in a stream
+def _read_chunks(stream):
+  while (True):
+    header = stream.read(8)
+    if (len(header) < 8): return
+    (kind, length) = struct.unpack('>4sL', header)
+    data = stream.read(length)
+    if (len(data) < length):
+      raise ValueError('MIDI file is truncated')
+    yield((kind, bytearray(data)))
+
+# parse the data of a track chunk into a list of tuples of
+#  (tick, status, data1, data2), where meta events have a status of 0xFF,
+#  the meta type as data1, and the meta data as data2
+def _parse_track(data):
+  events = list()
+  append = events.append
+  i = 0
+  n = len(data)
+  tick = 0
+  status = 0
+  try:
+    while (i < n):
+      # read the variable-length delta time
+      b = data[i]
+      i += 1
+      delta = b & 0x7F
+      while (b & 0x80):
+        b = data[i]
+        i += 1
+        delta = (delta << 7) | (b & 0x7F)
+      tick += delta
+      # get the status byte, allowing for running status
+      b = data[i]
+      if (b & 0x80):
+        status = b
+        i += 1
+      elif (status == 0):
+        raise ValueError('MIDI track has data with no status')
+      if (status < 0xF0):
+        high = status & 0xF0
+        if ((high == 0xC0) or (high == 0xD0)):
+          append((tick, status, data[i], 0))
+          i += 1
+        else:
+          append((tick, status, data[i], data[i + 1]))
+          i += 2
+        continue
+      # meta events and sysex cancel running status
+      meta_type = None
+      if (status == 0xFF):
+        meta_type = data[i]
+        i += 1
+      status = 0
+      b = data[i]
+      i += 1
+      length = b & 0x7F
+      while (b & 0x80):
+        b = data[i]
+        i += 1
+        length = (length << 7) | (b & 0x7F)
+      if (meta_type is not None):
+        append((tick, 0xFF, meta_type, data[i:i + length]))
+        # stop at the end of the track
+        if (meta_type == 0x2F): break
+      i += length
+  except IndexError:
+    raise ValueError('MIDI track is truncated')
+  return(events)
+
+# convert tick times into seconds using a sequence of tempo changes
+class _TempoMap(object):
+  def __init__(self, division):
+    self._ticks_per_beat = None
+    # SMPTE divisions specify a fixed time per tick
+    if (division & 0x8000):
+      frames_per_second = 256 - (division >> 8)
+      ticks_per_frame = division & 0xFF
+      seconds_per_tick = 1.0 / float(frames_per_second * ticks_per_frame)
+    else:
+      self._ticks_per_beat = float(division)
+      seconds_per_tick = self._seconds_per_tick(DEFAULT_TEMPO)
+    # store tuples of (tick, seconds, seconds per tick) for each tempo
+    self.segments = [ (0, 0.0, seconds_per_tick) ]
+  def _seconds_per_tick(self, tempo):
+    return(float(tempo) / (1000000.0 * self._ticks_per_beat))
+  # change the tempo at the given tick, which can't be before the
+  #  last change
+  def set_tempo(self, tick, tempo):
+    if (self._ticks_per_beat is None): return
+    (t0, s0, spt) = self.segments[-1]
+    segment = (tick, s0 + ((tick - t0) * spt), self._seconds_per_tick(tempo))
+    if (tick == t0):
+      self.segments[-1] = segment
+    else:
+      self.segments.append(segment)
+
+# convert parsed track data into a tuple of
+#  (name, events, duration, bend range)
+def _convert_track(raw, tempo_map, use_tempo):
+  name = None
+  events = list()
+  append = events.append
+  bend_range = DEFAULT_BEND_RANGE
+  # notes that are currently sounding, as lists of
+  #  [ time, pitch, velocity, channel, bend, aftertouch ] keyed by
+  #  (channel, pitch), so they can be built all at once when they end
+  sounding = dict()
+  channel_bends = dict()
+  # the RPN being addressed on each channel as (MSB, LSB)
+  rpns = dict()
+  # step through tempo segments as the ticks increase
+  segments = tempo_map.segments
+  si = 0
+  (seg_tick, seg_seconds, spt) = segments[0]
+  t = 0.0
+  for (tick, status, data1, data2) in raw:
+    while ((si + 1 < len(segments)) and (segments[si + 1][0] <= tick)):
+      si += 1
+      (seg_tick, seg_seconds, spt) = segments[si]
+    t = seg_seconds + ((tick - seg_tick) * spt)
+    kind = status & 0xF0
+    channel = status & 0x0F
+    # note on
+    if ((kind == 0x90) and (data2 > 0)):
+      bend = list()
+      channel_bend = channel_bends.get(channel, 0.0)
+      if (channel_bend != 0.0):
+        bend.append((0.0, channel_bend))
+      key = (channel, data1)
+      if (key not in sounding):
+        sounding[key] = list()
+      sounding[key].append(
+        [ t, data1, data2 / 127.0, channel, bend, list() ])
+    # note off
+    elif ((kind == 0x80) or (kind == 0x90)):
+      try:
+        record = sounding[(channel, data1)].pop(0)
+      # a note-off with no prior note-on isn't a big deal
+      except (KeyError, IndexError): continue
+      append(_make_note(record, t))
+    # polyphonic aftertouch
+    elif (kind == 0xA0):
+      try:
+        record = sounding[(channel, data1)][-1]
+      except (KeyError, IndexError): continue
+      aftertouch = record[5]
+      # give the velocity curve a fixed start point for drawing
+      if ((len(aftertouch) == 0) and (t > record[0])):
+        aftertouch.append((0.0, record[2]))
+      aftertouch.append((t - record[0], data2 / 127.0))
+    # pitch bend
+    elif (kind == 0xE0):
+      bend = mpe.decode_bend((data2 << 7) | data1, bend_range)
+      channel_bends[channel] = bend
+      for records in sounding.itervalues():
+        for record in records:
+          if (record[3] != channel): continue
+          if ((len(record[4]) == 0) and (t > record[0])):
+            record[4].append((0.0, 0.0))
+          record[4].append((t - record[0], bend))
+    # control change
+    elif (kind == 0xB0):
+      # RPN selection and pitch bend sensitivity set the bend range
+      #  instead of being stored as controller values
+      if (data1 == 101):
+        rpns[channel] = (data2, rpns.get(channel, (0x7F, 0x7F))[1])
+      elif (data1 == 100):
+        rpns[channel] = (rpns.get(channel, (0x7F, 0x7F))[0], data2)
+      elif ((data1 in (6, 38)) and (rpns.get(channel) == (0, 0))):
+        if (data1 == 6):
+          bend_range = float(data2) + (bend_range - math.floor(bend_range))
+        else:
+          bend_range = math.floor(bend_range) + (data2 / 100.0)
+      else:
+        append(block.CCSet(time=t, number=data1, value=(data2 / 127.0)))
+    # meta events
+    elif (status == 0xFF):
+      if (data1 == 0x03):
+        name = bytes(data2).decode('latin-1')
+      elif ((data1 == 0x51) and (use_tempo) and (len(data2) == 3)):
+        tempo_map.set_tempo(tick,
+          (data2[0] << 16) | (data2[1] << 8) | data2[2])
+  # end any notes still sounding at the end of the track
+  for records in sounding.itervalues():
+    for record in records:
+      append(_make_note(record, t))
+  events.sort(key=lambda e: e.time)
+  return((name, events, t, bend_range))
+
+# make a note from a list of data collected while it was sounding
+def _make_note(record, end_time):
+  (time, pitch, velocity, channel, bend, aftertouch) = record
+  duration = max(0.0, end_time - time)
+  # cap the bend and velocity curves, if any
+  if ((len(bend) > 0) and (bend[-1][0] < duration)):
+    bend.append((duration, bend[-1][1]))
+  if ((len(aftertouch) > 0) and (aftertouch[-1][0] < duration)):
+    aftertouch.append((duration, aftertouch[-1][1]))
+  note = block.Note(time=time, pitch=pitch, velocity=velocity,
+                    duration=duration, bend=bend, aftertouch=aftertouch)
+  note.channel = channel
+  return(note)
+
+# WRITING #####################################################################
+
+# generate the bytes of a format 1 standard MIDI file containing a
+#  tempo track and one track for each of the given tracks
+def write_tracks(tracks, division=DEFAULT_DIVISION):
+  tracks = list(tracks)
+  yield(struct.pack('>4sLHHH', b'MThd', 6, 1, len(tracks) + 1, division))
+  for chunk in _write_track(lambda: _tempo_messages(), division):
+    yield(chunk)
+  for t in tracks:
+    for chunk in _write_track(
+        lambda: _track_messages(t, t.name, t.bend_range), division):
+      yield(chunk)
+# generate the bytes of a format 0 standard MIDI file containing the
+#  events in an event list
+def write_events(events, bend_range=DEFAULT_BEND_RANGE,
+                 division=DEFAULT_DIVISION):
+  yield(struct.pack('>4sLHHH', b'MThd', 6, 0, 1, division))
+  def make_messages():
+    return(heapq.merge(
+      _tempo_messages(), _event_list_messages(events, None, bend_range)))
+  for chunk in _write_track(make_messages, division):
+    yield(chunk)
+
+# generate the bytes of a track chunk, given a function that makes a
+#  time-sorted sequence of (time, order, sequence, data) tuples
+def _write_track(make_messages, division, buffer_size=4096):
+  ticks_per_second = (float(division) * 1000000.0) / float(DEFAULT_TEMPO)
+  # measure the track first so its length can be written up front without
+  #  holding the whole track in memory
+  length = 0
+  for data in _encode_messages(make_messages(), ticks_per_second):
+    length += len(data)
+  yield(struct.pack('>4sL', b'MTrk', length))
+  chunk = bytearray()
+  for data in _encode_messages(make_messages(), ticks_per_second):
+    chunk.extend(data)
+    if (len(chunk) >= buffer_size):
+      yield(bytes(chunk))
+      chunk = bytearray()
+  if (len(chunk) > 0):
+    yield(bytes(chunk))
+
+# encode messages with delta times, using running status where possible
+#  and ending with an end-of-track event
+def _encode_messages(messages, ticks_per_second):
+  last_tick = 0
+  running_status = None
+  for (time, order, sequence, data) in messages:
+    tick = max(last_tick, int(round(time * ticks_per_second)))
+    out = _encode_vlq(tick - last_tick)
+    last_tick = tick
+    status = data[0]
+    if (status >= 0xF0):
+      running_status = None
+      out.extend(data)
+    elif (status == running_status):
+      out.extend(data[1:])
+    else:
+      running_status = status
+      out.extend(data)
+    yield(out)
+  yield(bytearray((0x00, 0xFF, 0x2F, 0x00)))
+
+# encode a number as a MIDI variable-length quantity
+def _encode_vlq(value):
+  out = bytearray((value & 0x7F,))
+  value >>= 7
+  while (value > 0):
+    out.insert(0, 0x80 | (value & 0x7F))
+    value >>= 7
+  return(out)
+
+# order messages at the same time so that notes end before new ones start
+#  and channel setup precedes the notes that depend on it
+_ORDER_END = 0
+_ORDER_SETUP = 1
+_ORDER_START = 2
+_ORDER_CURVE = 3
+_sequence = itertools.count()
+
+# make messages to set the tempo
+def _tempo_messages():
+  tempo = DEFAULT_TEMPO
+  yield((0.0, _ORDER_SETUP, next(_sequence),
+         bytearray((0xFF, 0x51, 0x03,
+                    (tempo >> 16) & 0xFF, (tempo >> 8) & 0xFF, tempo & 0xFF))))
+
+# make messages for all blocks in a track
+def _track_messages(t, name, bend_range):
+  def starts_for_block(b):
+    bt = b.time
+    block_end = bt + b.duration
+    repeat = float(b.events.duration)
+    offset = 0.0
+    while (bt + offset < block_end):
+      for event in b.events:
+        et = bt + offset + event.time
+        if (et >= block_end): break
+        yield((et, next(_sequence), event, b.events, block_end))
+      if (repeat <= 0.0): break
+      offset += repeat
+  starts = heapq.merge(*[ starts_for_block(b) for b in t ])
+  events = set()
+  for b in t:
+    events.update(b.events.notes)
+  return(_messages_for_starts(starts, events, name, bend_range))
+
+# make messages for the events in an event list
+def _event_list_messages(events, name, bend_range):
+  starts = ((event.time, next(_sequence), event, events, events.duration) 
+              for event in events)
+  return(_messages_for_starts(starts, events.notes, name, bend_range))
+
+# convert a time-sorted sequence of tuples of (time, sequence, event, 
+#  event list, end time) into messages, holding only the messages for 
+#  notes that are still sounding
+def _messages_for_starts(starts, notes, name, bend_range):
+  if (name):
+    data = bytearray(name.encode('latin-1', 'replace'))
+    yield((0.0, _ORDER_SETUP, next(_sequence),
+           bytearray((0xFF, 0x03)) + _encode_vlq(len(data)) + data))
+  # send the pitch bend range on all channels notes will play on
+  channels = set()
+  for note in notes:
+    if ((note.channel is None) and (len(note.bend) > 0)):
+      channels.update(_BEND_CHANNELS)
+    else:
+      channels.add(_channel_of(note))
+  semitones = int(math.floor(bend_range))
+  cents = int(math.floor((bend_range - semitones) * 100.0))
+  for channel in sorted(channels):
+    cc = 0xB0 | channel
+    for (number, value) in ((0x65, 0x00), (0x64, 0x00),
+                            (0x06, semitones), (0x26, cents)):
+      yield((0.0, _ORDER_SETUP, next(_sequence),
+             bytearray((cc, number, value))))
+  channel_bends = dict()
+  # the time each channel used for bent notes will be free
+  channel_ends = dict([ (channel, 0.0) for channel in _BEND_CHANNELS ])
+  pending = list()
+  for (time, sequence, event, events, end) in starts:
+    # release messages that come before this event
+    while ((len(pending) > 0) and (pending[0][0] <= time)):
+      yield(heapq.heappop(pending))
+    try:
+      pitch = int(round(event.pitch))
+    except AttributeError:
+      try:
+        number = event.number
+        value = event.value
+      except AttributeError: continue
+      heapq.heappush(pending, (time, _ORDER_START, sequence,
+        bytearray((0xB0, number, _to_7bit(value)))))
+      for message in _ramp_messages(events, number, event.time, 
+                                    time - event.time, end):
+        heapq.heappush(pending, message)
+      continue
+    channel = _channel_of(event)
+    # give bent notes with no channel of their own the channel that's been
+    #  free the longest, so their bends don't affect other notes
+    if ((event.channel is None) and (len(event.bend) > 0)):
+      channel = min(_BEND_CHANNELS, key=lambda c: channel_ends[c])
+      channel_ends[channel] = max(channel_ends[channel],
+                                  time + event.duration)
+    # apply the note's initial bend if the channel isn't already there
+    bend = 0.0
+    if ((len(event.bend) > 0) and (event.bend[0][0] == 0.0)):
+      bend = event.bend[0][1]
+    if (bend != channel_bends.get(channel, 0.0)):
+      heapq.heappush(pending, (time, _ORDER_SETUP, next(_sequence),
+        _pitch_bend(channel, bend, bend_range)))
+    velocity = max(1, min(127, int(math.floor(event.velocity * 127.0))))
+    heapq.heappush(pending, (time, _ORDER_START, sequence,
+      bytearray((0x90 | channel, pitch, velocity))))
+    for (bt, bend) in event.bend:
+      heapq.heappush(pending, (time + bt, _ORDER_CURVE, next(_sequence),
+        _pitch_bend(channel, bend, bend_range)))
+    if (len(event.bend) > 0):
+      channel_bends[channel] = event.bend[-1][1]
+    for (at, velocity) in event.aftertouch:
+      heapq.heappush(pending, (time + at, _ORDER_CURVE, next(_sequence),
+        bytearray((0xA0 | channel, pitch, _to_7bit(velocity)))))
+    heapq.heappush(pending, (time + event.duration, _ORDER_END,
+      next(_sequence), bytearray((0x80 | channel, pitch, 0))))
+  while (len(pending) > 0):
+    yield(heapq.heappop(pending))
+
+# the channels to rotate through for notes with pitch bends
+_BEND_CHANNELS = tuple(range(1, 16))
+# get the channel a note should be written on
+def _channel_of(note):
+  channel = getattr(note, 'channel', None)
+  if (channel is None): return(0)
+  return(channel & 0x0F)
+# convert a value from 0.0 to 1.0 into a 7-bit MIDI value
+def _to_7bit(value):
+  return(max(0, min(127, int(round(value * 127.0)))))
+# make messages for the values along the ramp from a controller value at
+#  the given time in an event list, if there is one, where the base is the 
+#  absolute time the event list starts at and messages stop at the end
+def _ramp_messages(events, number, time, base, end):
+  curve = events.curve_for_controller(number)
+  index = curve.index_at(time)
+  ramp = curve.ramp(index)
+  if (ramp is None): return
+  last = _to_7bit(ramp[1])
+  for (t, value) in curve.render(ramp[0], ramp[3], RAMP_RESOLUTION):
+    value = _to_7bit(value)
+    if ((base + t >= end) or (t <= ramp[0]) or (value == last)): continue
+    last = value
+    yield((base + t, _ORDER_CURVE, next(_sequence),
+           bytearray((0xB0, number, value))))
+# make a pitch bend message for a bend in semitones, using the same
+#  scaling as track playback and recording
+def _pitch_bend(channel, bend, bend_range):
+  value = mpe.encode_bend(bend, bend_range)
+  return(bytearray((0xE0 | channel, value & 0x7F, (value >> 7) & 0x7F)))
+
+class TestSMF(unittest.TestCase):
+  def test_bend_scaling(self):
+    note = block.Note(time=0.0, pitch=60, velocity=1.0, duration=0.5,
+      bend=[ (0.0, 0.0), (0.1, 0.5), (0.2, 1.0), (0.3, -1.5) ])
+    events = block.EventList([ note ], duration=1.0)
+    t = track.Track(blocks=(block.Block(events, duration=1.0),),
+                    bend_range=2.0)
+    # a file should bend notes the same amount as playing the track does
+    played = [ tuple(message[1:])
+      for (time, source, port, message) in bounce.bounce_tracks([ t ])
+        if ((message[0] & 0xF0 == 0xE0) and (time < note.duration)) ]
+    written = [ tuple(message[1:])
+      for (time, order, sequence, message) in
+        _track_messages(t, t.name, t.bend_range)
+          if (message[0] & 0xF0 == 0xE0) ]
+    # compare changes to the bend, since channels start centered and
+    #  playback doesn't repeat a bend the channel already has
+    def changes(values):
+      last = (0, 64)
+      result = list()
+      for value in values:
+        if (value != last):
+          result.append(value)
+        last = value
+      return(result)
+    self.assertEqual(changes(played), [ (0, 80), (0, 96), (0, 16) ])
+    self.assertEqual(changes(written), changes(played))
+    # reading the file back should give the same bends
+    tracks = read_tracks(io.BytesIO(b''.join(write_tracks([ t ]))))
+    bend = tracks[0][0].events[0].bend
+    self.assertEqual([ b for (bt, b) in bend[:4] ], [ 0.0, 0.5, 1.0, -1.5 ])
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
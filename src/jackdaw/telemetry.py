@@ -0,0 +1,122 @@
+import bisect
+import unittest
+
+# the upper edges of buckets for histograms of times in seconds, where
+#  anything at or below zero goes in the first bucket and anything above
+#  the last edge goes in an overflow bucket
+TIME_EDGES = (0.0, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+              0.1, 0.2, 0.5, 1.0, 2.0)
+
+# count values into a fixed set of buckets
+class Histogram(object):
+  def __init__(self, edges=TIME_EDGES):
+    self.edges = tuple(edges)
+    self.reset()
+  def reset(self):
+    self.counts = [ 0 ] * (len(self.edges) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.min = None
+    self.max = None
+    self.last = None
+  def add(self, value):
+    self.counts[bisect.bisect_left(self.edges, value)] += 1
+    self.count += 1
+    self.total += value
+    if ((self.min is None) or (value < self.min)):
+      self.min = value
+    if ((self.max is None) or (value > self.max)):
+      self.max = value
+    self.last = value
+  @property
+  def mean(self):
+    if (self.count == 0): return(None)
+    return(self.total / self.count)
+  # get an upper bound on the value below which the given fraction
+  #  of values fall, which is only as precise as the buckets
+  def percentile(self, fraction):
+    if (self.count == 0): return(None)
+    target = fraction * self.count
+    seen = 0
+    for (i, count) in enumerate(self.counts):
+      seen += count
+      if ((count > 0) and (seen >= target)):
+        if (i < len(self.edges)):
+          return(min(self.edges[i], self.max))
+        break
+    return(self.max)
+  def as_dict(self):
+    return({ 'edges': list(self.edges), 'counts': list(self.counts),
+             'count': self.count, 'mean': self.mean,
+             'min': self.min, 'max': self.max, 'last': self.last,
+             'p50': self.percentile(0.5), 'p99': self.percentile(0.99) })
+
+# collect measurements of how well playback keeps up with the transport,
+#  which are cheap enough to always keep
+class PlaybackTelemetry(object):
+  def __init__(self):
+    # how much later than requested the transport's update timer fired
+    self.tick_lateness = Histogram()
+    # how far past the current time events had been queued when
+    #  a track's output handler was next asked to send
+    self.schedule_ahead = Histogram()
+    self.reset()
+  def reset(self):
+    self.tick_lateness.reset()
+    self.schedule_ahead.reset()
+    # the number of times the transport updated while rolling
+    self.ticks = 0
+    # the number of times output handlers were asked to send
+    self.sends = 0
+    # the number of sends where the current time had passed the end of
+    #  the queued events, meaning some were sent late or not at all
+    self.underruns = 0
+  # record that an update timer with the given interval fired
+  #  the given number of seconds after the previous one
+  def record_tick(self, interval, elapsed):
+    self.ticks += 1
+    self.tick_lateness.add(elapsed - interval)
+  # record the amount of time that was queued ahead when sending
+  def record_send(self, ahead):
+    self.sends += 1
+    self.schedule_ahead.add(ahead)
+    if (ahead < 0.0):
+      self.underruns += 1
+  def as_dict(self):
+    return({ 'ticks': self.ticks, 'sends': self.sends,
+             'underruns': self.underruns,
+             'tick_lateness': self.tick_lateness.as_dict(),
+             'schedule_ahead': self.schedule_ahead.as_dict() })
+Playback = PlaybackTelemetry()
+
+class TestTelemetry(unittest.TestCase):
+  def test_buckets(self):
+    h = Histogram(edges=(0.0, 1.0, 2.0))
+    for value in (-1.0, 0.0, 0.5, 1.0, 1.5, 3.0):
+      h.add(value)
+    self.assertEqual(h.counts, [ 2, 2, 1, 1 ])
+    self.assertEqual((h.min, h.max, h.count), (-1.0, 3.0, 6))
+  def test_percentile(self):
+    h = Histogram(edges=(0.0, 1.0, 2.0))
+    self.assertEqual(h.percentile(0.5), None)
+    for value in (0.5, 0.5, 0.5, 1.5):
+      h.add(value)
+    self.assertEqual(h.percentile(0.5), 1.0)
+    self.assertEqual(h.percentile(1.0), 1.5)
+    h.add(5.0)
+    self.assertEqual(h.percentile(1.0), 5.0)
+  def test_underruns(self):
+    t = PlaybackTelemetry()
+    t.record_send(0.5)
+    t.record_send(0.0)
+    t.record_send(-0.1)
+    self.assertEqual((t.sends, t.underruns), (3, 1))
+    t.record_tick(0.05, 0.07)
+    self.assertAlmostEqual(t.tick_lateness.last, 0.02)
+    t.reset()
+    self.assertEqual((t.ticks, t.sends, t.underruns), (0, 0, 0))
+    self.assertEqual(t.schedule_ahead.count, 0)
+
+# run tests if this script is invoked by itself
+if __name__ == '__main__':
+  unittest.main()
@@ -1,7 +1,13 @@
 # coding=utf-8
 
 import math
-import jackpatch
+import time
+import heapq
+import itertools
+import collections
+from backend import jackpatch
+
+from PySide.QtCore import QTimer
 
 import observable
 import serializable
@@ -9,6 +15,11 @@ from model import Model, ModelList
 import block
 import midi
 import unit
+import profiling
+import telemetry
+import channels
+import mpe
+import controller
 
 # represent a track, which can contain multiple blocks
 class Track(unit.Source, unit.Sink, ModelList):
@@ -23,7 +34,11 @@ class Track(unit.Source, unit.Sink, ModelList):
                      pitch_names=None, controller_names=None, 
                      controller_outputs=None,
                      bend_range=6.0,
+                     mpe_zone=None, mpe_members=15,
                      transport=None):
+    # whether the track is enabled for playback 
+    # (this will be controlled by the track list)
+    self._enabled = True
     ModelList.__init__(self, blocks)
     unit.Source.__init__(self)
     unit.Sink.__init__(self)
@@ -34,6 +49,8 @@ class Track(unit.Source, unit.Sink, ModelList):
     self._mute = mute
     self._arm = arm
     self._bend_range = bend_range
+    self._mpe_zone = mpe_zone
+    self._mpe_members = mpe_members
     if (pitch_names is None): 
       pitch_names = dict()
     self._pitch_names = pitch_names
@@ -43,15 +60,13 @@ class Track(unit.Source, unit.Sink, ModelList):
     # make a list of controller values that input has been received from,
     #  keyed by controller number
     self._controller_values = dict()
-    # make a client and ports to connect to JACK
-    self._client = jackpatch.Client('jackdaw-track')
-    self._client.activate()
-    self.source_port = jackpatch.Port(client=self._client, 
-      name='playback',
-      flags=jackpatch.JackPortIsOutput)
-    self.sink_port = jackpatch.Port(client=self._client, 
-      name='capture',
-      flags=jackpatch.JackPortIsInput)
+    # make ports to connect to JACK on the shared client
+    self._client = unit.JackClient.client
+    self._port_namespace = unit.JackClient.make_namespace('track')
+    self.source_port = unit.JackClient.make_port(self._port_namespace,
+      'playback', jackpatch.JackPortIsOutput)
+    self.sink_port = unit.JackClient.make_port(self._port_namespace,
+      'capture', jackpatch.JackPortIsInput)
     # add a handler for incoming notes
     self._transport = transport
     self._input_handler = TrackInputHandler(
@@ -59,14 +74,17 @@ class Track(unit.Source, unit.Sink, ModelList):
     # add a handler for playback
     self._output_handler = TrackOutputHandler(
       port=self.source_port, track=self, transport=self.transport)
-    # keep track of ports connected for previewing track input
+    # keep track of ports connected for previewing track input, updating
+    #  them only when previewing starts or stops or connections change
     self._connected_sources = dict()
     self._connected_sinks = dict()
-    self.add_observer(self.update_passthru)
+    self._passthru_pending = False
+    unit.JackClient.connections_changed.connect(self.on_routing_change)
     # make a list of controller output handlers, keyed by number
     self._controller_outputs = dict()
     if (controller_outputs is not None):
       for output in controller_outputs:
+        output.port_namespace = self._port_namespace
         output.client = self._client
         self._controller_outputs[output.number] = output
   # invalidate cached data
@@ -76,9 +94,6 @@ class Track(unit.Source, unit.Sink, ModelList):
     self._controllers = None
     self._times = None
     self._snap_times = None
-    # whether the track is enabled for playback 
-    # (this will be controlled by the track list)
-    self.enabled = True
   # get and set the name of the track
   @property
   def name(self):
@@ -98,17 +113,51 @@ class Track(unit.Source, unit.Sink, ModelList):
       self._bend_range = value
       self.on_change()
       self.send_bend_range()
-  # send the current pitch bend range to the midi output port
-  def send_bend_range(self):
-    port = self.source_port
-    semitones = int(math.floor(self._bend_range))
-    cents = int(math.floor((self._bend_range - semitones) * 100.0))
-    for channel in range(0, 16):
-      cc = 0xB0 | channel
-      port.send((cc, 0x65, 0x00))
-      port.send((cc, 0x64, 0x00))
-      port.send((cc, 0x06, semitones))
-      port.send((cc, 0x26, cents))
+  # get and set which MPE zone the track plays and records in ('lower' 
+  #  or 'upper'), or None to rotate notes through all channels instead
+  @property
+  def mpe_zone(self):
+    return(self._mpe_zone)
+  @mpe_zone.setter
+  def mpe_zone(self, value):
+    if (value != self._mpe_zone):
+      self._mpe_zone = value
+      self.on_change()
+      self.send_bend_range()
+  # get and set the number of member channels in the MPE zone
+  @property
+  def mpe_members(self):
+    return(self._mpe_members)
+  @mpe_members.setter
+  def mpe_members(self, value):
+    if (value != self._mpe_members):
+      self._mpe_members = value
+      self.on_change()
+      self.send_bend_range()
+  # get a description of the track's MPE zone, or None if it has none
+  @property
+  def zone(self):
+    if (self._mpe_zone is None): return(None)
+    return(mpe.Zone(self._mpe_zone, self._mpe_members))
+  # get the channels notes can be played on
+  @property
+  def voice_channels(self):
+    zone = self.zone
+    if (zone is None): return(range(16))
+    return(zone.member_channels)
+  # send the MPE zone configuration, if any, and the current pitch bend 
+  #  range for the channels notes can play on to the midi output port
+  def send_bend_range(self, port=None):
+    if (port is None):
+      port = self.source_port
+    messages = list()
+    zone = self.zone
+    if (zone is not None):
+      messages.extend(zone.configuration_messages())
+    messages.extend(
+      mpe.bend_range_messages(self._bend_range, self.voice_channels))
+    for message in messages:
+      port.send(message)
   # get and set user-defined names for pitches
   @property
   def pitch_names(self):
@@ -151,7 +200,8 @@ class Track(unit.Source, unit.Sink, ModelList):
     if (number not in self._controller_outputs):
       self._controller_outputs[number] = ControllerTrackOutput(
         client=self._client, number=number, 
-        value=self.value_of_controller(number))
+        value=self.value_of_controller(number),
+        port_namespace=self._port_namespace)
     return(self._controller_outputs[number])
   # get a list of output handlers for the current set of controllers
   @property
@@ -201,6 +251,17 @@ class Track(unit.Source, unit.Sink, ModelList):
       if (not self._arm):
         self._controller_values = dict()
       self.on_change()
+      self.update_passthru()
+  # get and set whether the track is enabled for playback
+  @property
+  def enabled(self):
+    return(self._enabled)
+  @enabled.setter
+  def enabled(self, value):
+    if (self._enabled != value):
+      self._enabled = value
+      if (self._arm):
+        self.update_passthru()
   # get whether the track's inputs are being previewed
   @property
   def previewing(self):
@@ -273,8 +334,14 @@ class Track(unit.Source, unit.Sink, ModelList):
       self._controllers = list(controllers)
       self._controllers.sort()
     return(self._controllers)
+  # update passthru connections once for a burst of routing changes
+  def on_routing_change(self):
+    if ((self._passthru_pending) or (not self.previewing)): return
+    self._passthru_pending = True
+    QTimer.singleShot(0, self.update_passthru)
   # make connections through the track
   def update_passthru(self):
+    self._passthru_pending = False
     # get previously connected ports
     old_sources = self._connected_sources
     old_sinks = self._connected_sinks
@@ -329,6 +396,8 @@ class Track(unit.Source, unit.Sink, ModelList):
       'arm': self.arm,
       'pitch_names': self.pitch_names,
       'bend_range': self.bend_range,
+      'mpe_zone': self.mpe_zone,
+      'mpe_members': self.mpe_members,
       'controller_names': self.controller_names,
       'controller_outputs': self.controller_outputs,
       'transport': self.transport
@@ -337,10 +406,19 @@ serializable.add(Track)
 
 # represent a controller's output on a track
 class ControllerTrackOutput(unit.Source, Model):
-  def __init__(self, number, value=0.0, client=None):
+  def __init__(self, number, value=0.0, client=None, port_namespace=None,
+                     fine=False, min_interval=0.0, resolution=0.01):
     self._client = None
     self._number = number
+    self._resolution = resolution
+    # a prefix for the port name, so outputs for the same controller on
+    #  different tracks can share a client
+    self.port_namespace = port_namespace
     self._value = 0.0
+    # convert values to messages, skipping ones that wouldn't change
+    #  the receiver's value
+    self._encoder = controller.ControllerEncoder(number, 
+      fine=fine, min_interval=min_interval)
     Model.__init__(self)
     unit.Source.__init__(self)
     self._source_type = 'midi'
@@ -353,8 +431,11 @@ class ControllerTrackOutput(unit.Source, Model):
   def client(self, client):
     if ((client is not None) and (self.source_port is None)):
       self._client = client
+      name = 'CC %d' % self._number
+      if (self.port_namespace):
+        name = self.port_namespace+'.'+name
       self.source_port = jackpatch.Port(client=self._client,
-        name=('CC %d' % self._number), flags=jackpatch.JackPortIsOutput)
+        name=name, flags=jackpatch.JackPortIsOutput)
   @property
   def number(self):
     return(self._number)
@@ -366,17 +447,77 @@ class ControllerTrackOutput(unit.Source, Model):
     if ((value is not None) and (value != self._value)):
       self._value = value
       self.on_change()
+      # this goes out ahead of any values queued for playback, so it
+      #  can't be counted on as the last value the receiver got
+      self._encoder.reset()
       self.send_value(self._value)
-  # send a midi message to propagate the current value
-  def send_value(self, value, time=0.0):
+      self._encoder.reset()
+  # get and set whether to send 14-bit values using the controller 32
+  #  numbers above this one for the fine part (for controllers below 32)
+  @property
+  def fine(self):
+    return(self._encoder.fine)
+  @fine.setter
+  def fine(self, value):
+    if (value != self._encoder.fine):
+      self._encoder.fine = value
+      self.on_change()
+  # get and set the minimum number of seconds between values sent during
+  #  playback, or zero to send every value that changes
+  @property
+  def min_interval(self):
+    return(self._encoder.min_interval)
+  @min_interval.setter
+  def min_interval(self, value):
+    if (value != self._encoder.min_interval):
+      self._encoder.min_interval = value
+      self.on_change()
+  # get and set the number of seconds between values sent along ramps
+  #  between controller values during playback
+  @property
+  def resolution(self):
+    return(self._resolution)
+  @resolution.setter
+  def resolution(self, value):
+    if (value != self._resolution):
+      self._resolution = value
+      self.on_change()
+  # whether a value is being held back by rate limiting
+  @property
+  def holding(self):
+    return(self._encoder.holding)
+  # forget which value was last sent, so the next one is always sent
+  def reset(self):
+    self._encoder.reset()
+  # send midi messages to propagate a value after the given delay, unless 
+  #  the value wouldn't change what was last sent or the last value was 
+  #  sent less than the minimum interval before the given absolute time, 
+  #  returning the list of messages sent
+  def send_value(self, value, time=0.0, at=None):
     self._value = value
-    if (self.source_port is not None):
-      self.source_port.send(
-        (0xB0, self._number, int(round(value * 127.0))), time)
+    if (self.source_port is None): return([ ])
+    messages = self._encoder.update(value, at)
+    for data in messages:
+      self.source_port.send(data, time)
+    return(messages)
+  # send a value held back by rate limiting if it can go out by the given
+  #  absolute time, returning a tuple with the absolute time it was sent
+  #  for and the list of messages, or None if nothing was sent
+  def send_held_value(self, now, until):
+    if (self.source_port is None): return(None)
+    held = self._encoder.flush(until)
+    if (held is None): return(None)
+    (at, messages) = held
+    for data in messages:
+      self.source_port.send(data, max(0.0, at - now))
+    return(held)
   def serialize(self):
     return({
       'number': self.number,
-      'value': self.value
+      'value': self.value,
+      'fine': self.fine,
+      'min_interval': self.min_interval,
+      'resolution': self.resolution
     })
 serializable.add(ControllerTrackOutput)
 
@@ -484,10 +625,11 @@ class TrackInputHandler(midi.InputHandler):
     midi.InputHandler.__init__(self, port=port, target=track)
     # make a placeholder for a block to place recorded notes into
     self._target_block = None
-    # hold a set of notes for all "voices" currently playing, keyed by pitch
+    # hold a set of notes for all "voices" currently playing, keyed by
+    #  channel and pitch
     self._playing_notes = dict()
-    # hold a set of bend values keyed by channel for global bend
-    self._channel_bends = dict()
+    # hold the last bend, pressure, and timbre values on each channel
+    self._channel_state = mpe.ChannelState()
     # hold a set of controller numbers we've received input for
     self._active_controllers = set()
     # listen to a transport so we know when we're recording
@@ -528,8 +670,13 @@ class TrackInputHandler(midi.InputHandler):
       duration = max(0, self.transport.time - self._target_block.time)
       self._target_block.duration = duration
       self._target_block.events.duration = duration
+      # keep only as many recorded control changes as it takes to 
+      #  reproduce them closely
+      for number in self._active_controllers:
+        self._target_block.events.thin_controller(number)
+      self._active_controllers = set()
       self._target_block = None
-      self._channel_bends = dict()
+      self._channel_state.reset()
     # extend the target block when the transport time changes
     current_time = self.transport.time
     base_time = 0.0
@@ -550,10 +697,16 @@ class TrackInputHandler(midi.InputHandler):
     self._active_controllers = set()
   # interpret messages
   def handle_message(self, data, time):
-    if (len(data) != 3): return
-    (status, data1, data2) = data
+    if (len(data) < 2): return
+    status = data[0]
     kind = (status & 0xF0) >> 4
     channel = (status & 0x0F)
+    # channel pressure is the only two-byte message we handle
+    if (kind == 0xD):
+      self.handle_pressure(channel, data[1] / 127.0, time)
+      return
+    if (len(data) != 3): return
+    (status, data1, data2) = data
     # get the start time of the target block, if any
     base_time = 0.0
     if (self._target_block is not None):
@@ -567,58 +720,74 @@ class TrackInputHandler(midi.InputHandler):
         note = block.Note(time=(time - base_time), 
                     pitch=pitch, velocity=velocity, duration=0)
         note.channel = channel
-        # add initial pitch bend if there is any on the note's channel
-        if (channel in self._channel_bends):
-          channel_bend = self._channel_bends[channel]
-          if (channel_bend != 0.0):
-            note.add_bend(0.0, channel_bend)
-        self._playing_notes[pitch] = note
+        # add the initial pitch bend and timbre of the note's channel, 
+        #  which MPE controllers send just before the note starts
+        bend = self.bend_for_channel(channel)
+        if (bend != 0.0):
+          note.add_bend(0.0, bend)
+        timbre = self._channel_state.get('timbre', channel)
+        if ((timbre is not None) and (self.is_member_channel(channel))):
+          note.add_timbre(0.0, timbre)
+        self._playing_notes[(channel, pitch)] = note
         if (self._target_block is not None):
           self._target_block.events.append(note)
       # note off
       elif ((kind == 0x8) or (velocity == 0.0)):
-        try:
-          note = self._playing_notes[pitch]
+        note = self._playing_notes.pop((channel, pitch), None)
+        # some devices end notes on a different channel than they start on
+        if (note is None):
+          for key in self._playing_notes.iterkeys():
+            if (key[1] == pitch):
+              note = self._playing_notes.pop(key)
+              break
         # this indicates a note-off with no prior note-on, not a big deal
-        except KeyError: return
+        if (note is None): return
         note.duration = max(0, time - (base_time + note.time))
         # cap the bend and velocity curves, if any
         if (len(note.bend) > 0):
           note.add_bend(note.duration, note.bend[-1][1])
         if (len(note.aftertouch) > 0):
           note.add_aftertouch(note.duration, note.aftertouch[-1][1])
-        # remove the note from the list of playing notes
-        del self._playing_notes[pitch]
+        if (len(note.timbre) > 0):
+          note.add_timbre(note.duration, note.timbre[-1][1])
     # polyphonic aftertouch
     elif (kind == 0xA):
-      pitch = data1
-      velocity = data2 / 127.0
-      if (pitch in self._playing_notes):
-        note = self._playing_notes[pitch]
-        # make sure the note's velocity curve has fixed endpoints
-        #  for optimized drawing routines
-        if (len(note.aftertouch) == 0):
-          note.add_aftertouch(0.0, note.velocity)
-        note.add_aftertouch(time - (base_time + note.time), velocity)
+      note = self._playing_notes.get((channel, data1), None)
+      if (note is not None):
+        self._add_aftertouch(note, data2 / 127.0, time - base_time)
     # pitch bend
     elif (kind == 0xE):
-      bend = (float(0x2000 - ((data2 << 7) | data1)) / float(0x2000))
-      bend *= (self.target.bend_range / 2.0)
-      self._channel_bends[channel] = bend
-      # if the playing notes have multiple channels, assume we're using a 
-      #  channel rotation scheme for polyphonic pitch bends
-      notes_by_channel = dict()
-      for note in self._playing_notes.itervalues():
-        if (note.channel == channel):
-          # make sure the note's bend curve has fixed endpoints
-          #  for optimized drawing routines
-          if (len(note.bend) == 0):
-            note.add_bend(0.0, 0.0)
-          note.add_bend(time - (base_time + note.time), bend)
+      bend = mpe.decode_bend((data2 << 7) | data1, self.target.bend_range)
+      self._channel_state.update('bend', channel, bend)
+      zone = self.target.zone
+      # a bend on an MPE zone's master channel applies to all its notes
+      if ((zone is not None) and (channel == zone.master_channel)):
+        notes = [ note for note in self._playing_notes.itervalues()
+                    if zone.is_member(note.channel) ]
+      # otherwise assume each channel is one voice, which covers MPE 
+      #  member channels and simpler channel rotation schemes
+      else:
+        notes = [ note for note in self._playing_notes.itervalues()
+                    if note.channel == channel ]
+      for note in notes:
+        # make sure the note's bend curve has fixed endpoints
+        #  for optimized drawing routines
+        if (len(note.bend) == 0):
+          note.add_bend(0.0, 0.0)
+        note.add_bend(time - (base_time + note.time), 
+                      self.bend_for_channel(note.channel))
     # get control channel messages
     elif (kind == 0xB):
       number = data1
       value = (data2 / 127.0)
+      # timbre on MPE member channels is part of the note
+      if ((number == mpe.TIMBRE_CONTROLLER) and 
+          (self.is_member_channel(channel))):
+        self._channel_state.update('timbre', channel, value)
+        for note in self._playing_notes.itervalues():
+          if (note.channel == channel):
+            note.add_timbre(time - (base_time + note.time), value)
+        return
       ccset = block.CCSet(time=(time - base_time), number=number, value=value)
       if (self._target_block is not None):
         self._target_block.events.append(ccset)
@@ -630,6 +799,33 @@ class TrackInputHandler(midi.InputHandler):
             time=0.0, number=number, value=value))
       if (self.target.arm):
         self.target.update_controller_value(number, value)
+  # handle channel pressure, which applies to all notes on the channel
+  def handle_pressure(self, channel, value, time):
+    base_time = 0.0
+    if (self._target_block is not None):
+      base_time = self._target_block.time
+    self._channel_state.update('pressure', channel, value)
+    for note in self._playing_notes.itervalues():
+      if (note.channel == channel):
+        self._add_aftertouch(note, value, time - base_time)
+  def _add_aftertouch(self, note, value, time):
+    # make sure the note's velocity curve has fixed endpoints
+    #  for optimized drawing routines
+    if (len(note.aftertouch) == 0):
+      note.add_aftertouch(0.0, note.velocity)
+    note.add_aftertouch(time - note.time, value)
+  # return whether the given channel is a member of the track's MPE zone
+  def is_member_channel(self, channel):
+    zone = self.target.zone
+    return((zone is not None) and (zone.is_member(channel)))
+  # get the total pitch bend for notes on a channel in semitones, which
+  #  includes the bend of the zone's master channel for MPE members
+  def bend_for_channel(self, channel):
+    bend = self._channel_state.get('bend', channel, 0.0)
+    zone = self.target.zone
+    if ((zone is not None) and (zone.is_member(channel))):
+      bend += self._channel_state.get('bend', zone.master_channel, 0.0)
+    return(bend)
 
 class TrackOutputHandler(observable.Object):
   def __init__(self, port, track, transport):
@@ -638,18 +834,61 @@ class TrackOutputHandler(observable.Object):
     self._playing = False
     # the time events have been scheduled up to (non-inclusive)
     self._scheduled_to = None
-    # the amount of time to schedule events into the future
-    self.min_schedule_ahead = 0.5
-    self.max_schedule_ahead = 1.0
-    # a dict mapping notes to the times at which 
-    #  each note should stop playing
-    self._note_ends = dict()
-    # dict mapping channel numbers to the current pitch bend on that channel
-    self._channel_bends = dict()
+    # whether events will be rescheduled after the track changes
+    self._reschedule_pending = False
+    # the transport time when events were last sent
+    self._last_time = None
+    # a dict mapping notes that have been started to their start times,
+    #  for notes whose note-off events haven't been sent yet
+    self._note_starts = dict()
+    # a heap of tuples of (end time, sequence, note) for the notes above,
+    #  which may be out of date if a note's duration has changed
+    self._note_off_heap = list()
+    # a heap of tuples of (time, sequence, note, curve, index) pointing at
+    #  the next point of each pitch bend, aftertouch, or timbre curve to 
+    #  send for the notes above
+    self._curve_heap = list()
+    # a dict mapping tuples of (block, controller number, start time) for
+    #  ramps between controller values that have started to tuples of
+    #  (base time, curve, index, ramp, end time), where the base time is 
+    #  when the repeat of the block's events the ramp is in begins
+    self._ramps = dict()
+    # a heap of tuples of (time, sequence, key) for the next point to send 
+    #  along each of the ramps above
+    self._ramp_heap = list()
+    # a sequence number to break ties between heap entries
+    self._sequence = itertools.count()
+    # assign channels to notes so they can be bent independently
+    self._channels = channels.ChannelAllocator()
+    # a dict mapping notes to tuples of (start time, end time) for
+    #  note-off events that have been sent to the port but may still
+    #  be waiting in its queue
+    self._queued_note_offs = dict()
+    # a heap of tuples of (time, sequence, port, message) for messages 
+    #  that have been sent to ports but may still be waiting in their queues
+    self._queued = list()
+    # a dict mapping tuples of (event, start time) to the state of events
+    #  whose messages are waiting in the queue, for detecting edits,
+    #  and its keys in the order they were scheduled
+    self._queued_events = dict()
+    self._queued_event_keys = collections.deque()
+    # the last pitch bend, pressure, and timbre values sent on each channel,
+    #  so values that wouldn't change anything can be skipped
+    self._channel_state = mpe.ChannelState()
+    # the numbers of controllers values have been sent for
+    self._controller_numbers = set()
     self.port = port
     self.track = track
     self._transport = None
     self.transport = transport
+  # get the amount of time that should be scheduled into the future
+  #  before more events are scheduled, and the amount to schedule
+  @property
+  def min_schedule_ahead(self):
+    return(self.transport.schedule_ahead.minimum)
+  @property
+  def max_schedule_ahead(self):
+    return(self.transport.schedule_ahead.maximum)
   # listen for when the transport state changes
   @property
   def transport(self):
@@ -662,10 +901,9 @@ class TrackOutputHandler(observable.Object):
       self._transport = value
       if (self._transport):
         self._transport.add_observer(self.on_transport_change)
-        self.min_schedule_ahead = self._transport.update_interval
-        self.max_schedule_ahead = 2.0 * self.min_schedule_ahead
       self.on_transport_change()
   def on_transport_change(self):
+    if (self.transport is None): return
     playing = (self.transport.playing or self.transport.recording)
     if (playing != self._playing):
       self._playing = playing
@@ -674,49 +912,227 @@ class TrackOutputHandler(observable.Object):
       else:
         self.stop()
     if (self._playing):
-    
-      # TODO: handle time jumps
-    
+      # if the time has moved backward or further forward than we could 
+      #  have scheduled (i.e. on a seek or cycle), start over from the
+      #  new time
+      now = self.transport.time
+      if ((now < self._last_time) or 
+          ((self._scheduled_to is not None) and
+           (now > self._scheduled_to + self.max_schedule_ahead))):
+        self.end_all_notes()
+        self._scheduled_to = now
+      self._last_time = now
       self.send()
   # start playback
   def start(self):
-    # send initial values for track control channels
-    self._send_initial_controller_values()
-    # send pitch bend sensitivity to all channels
-    self.track.send_bend_range()
     # initialize the scheduling time range
     self._scheduled_to = self.transport.time
+    self._last_time = self._scheduled_to
+    # send initial values for track control channels, even if they're
+    #  the same as what was sent before
+    self._reset_controller_outputs()
+    self._send_initial_controller_values()
+    # send the MPE zone and pitch bend sensitivity, since the receiver may
+    #  have been reset or reconnected since playback last started
+    self.track.send_bend_range(self.port)
+    self._channels = channels.ChannelAllocator(self.track.voice_channels)
+    self._channel_state.reset()
+    # reschedule when the track is edited during playback
+    self.track.add_observer(self.on_track_change)
+  # reschedule events that have been queued but not played yet when
+  #  the track changes, once for a burst of changes
+  def on_track_change(self):
+    if ((self._reschedule_pending) or (not self._playing)): return
+    self._reschedule_pending = True
+    QTimer.singleShot(0, self.reschedule)
+  def reschedule(self):
+    self._reschedule_pending = False
+    if ((not self._playing) or (not self.track.enabled)): return
+    now = self.transport.time
+    if ((self._scheduled_to is None) or (self._scheduled_to <= now)): return
+    span = self._find_changed_span(now)
+    if (span is not None):
+      self._cancel_from(span, now)
+      self._scheduled_to = span
+    # notes and ramps that are playing may have changed even if nothing 
+    #  queued has
+    self._rebuild_note_heaps()
+    self._rebuild_ramp_heap()
+    if (span is not None):
+      self._schedule(now)
+  # get the earliest time in the queued window that no longer matches 
+  #  the track, or None if everything queued is still correct
+  def _find_changed_span(self, now):
+    span = None
+    # compare events that start in the window to what was queued for them
+    current = dict()
+    for (event, t, block) in self._events_in_range(now, self._scheduled_to):
+      current[(event, t)] = self._event_signature(event)
+    for (key, signature) in self._queued_events.iteritems():
+      if ((key[1] >= now) and (current.pop(key, None) != signature)):
+        span = key[1] if span is None else min(span, key[1])
+    for (event, t) in current.iterkeys():
+      span = t if span is None else min(span, t)
+    # find notes that have started whose end has moved into the window
+    #  or whose queued end has moved
+    for (note, start) in self._note_starts.iteritems():
+      t = max(now, start + note.duration)
+      if (t < self._scheduled_to):
+        span = t if span is None else min(span, t)
+    for (note, (start, end)) in self._queued_note_offs.iteritems():
+      new_end = start + note.duration
+      if ((end > now) and (new_end != end)):
+        t = max(now, min(end, new_end))
+        span = t if span is None else min(span, t)
+    # find ramps that have started whose shape has changed
+    for (key, ramp) in self._ramps.iteritems():
+      (block, number, start) = key
+      base = ramp[0]
+      if (self._find_ramp(block, number, start - base, base)[2:] != 
+          ramp[3:]):
+        t = max(now, start)
+        span = t if span is None else min(span, t)
+    return(span)
+  # cancel messages queued at or after the given time, along with the
+  #  events they came from, so they can be scheduled again
+  def _cancel_from(self, span, now):
+    # ports can only drop everything they have queued, so clear those
+    #  with canceled messages and send back what should be kept
+    ports = set()
+    for (t, sequence, port, data) in self._queued:
+      if (t >= span):
+        ports.add(port)
+    for port in ports:
+      port.clear_send()
+    queued = list()
+    for message in sorted(self._queued):
+      (t, sequence, port, data) = message
+      if (t <= now): continue
+      if (port in ports):
+        if (t >= span): continue
+        port.send(data, t - now)
+      queued.append(message)
+    self._queued = queued
+    # what was last sent on each channel may have been canceled, so
+    #  send values again rather than guess
+    self._channel_state.reset()
+    self._reset_controller_outputs()
+    # forget events that start in the span
+    self._queued_events = dict([ (key, signature) for (key, signature)
+      in self._queued_events.iteritems() if key[1] < span ])
+    # notes that start in the span will be scheduled again, and notes
+    #  that started before it need their ends scheduled again if
+    #  they were canceled
+    note_starts = dict()
+    for (note, start) in self._note_starts.iteritems():
+      if (start < span):
+        note_starts[note] = start
+      else:
+        self._channels.release(note)
+    queued_note_offs = dict()
+    for (note, (start, end)) in self._queued_note_offs.iteritems():
+      if (end < span):
+        queued_note_offs[note] = (start, end)
+      elif (start < span):
+        note_starts[note] = start
+        self._channels.assign(note, note.channel)
+    self._note_starts = note_starts
+    self._queued_note_offs = queued_note_offs
+    # ramps that start in the span will start again with their events
+    for key in self._ramps.keys():
+      if (key[2] >= span):
+        del self._ramps[key]
+  # make the heaps of note-offs and curve points to send for the 
+  #  notes that are playing
+  def _rebuild_note_heaps(self):
+    self._note_off_heap = list()
+    self._curve_heap = list()
+    for (note, start) in self._note_starts.iteritems():
+      self._note_off_heap.append(
+        (start + note.duration, next(self._sequence), note))
+      for curve in (note.bend, note.aftertouch, note.timbre):
+        for (index, point) in enumerate(curve):
+          t = start + point[0]
+          if (t >= self._scheduled_to):
+            self._curve_heap.append(
+              (t, next(self._sequence), note, curve, index))
+            break
+    heapq.heapify(self._note_off_heap)
+    heapq.heapify(self._curve_heap)
+  # make the heap of points to send along ramps that have started, 
+  #  updating them to match their curves
+  def _rebuild_ramp_heap(self):
+    self._ramp_heap = list()
+    for (key, ramp) in self._ramps.items():
+      (block, number, start) = key
+      base = ramp[0]
+      found = self._find_ramp(block, number, start - base, base)
+      if ((found[2] is None) or (base + found[2][0] != start)):
+        del self._ramps[key]
+        continue
+      self._ramps[key] = (base,) + found
+      self._push_ramp_point(key, self._scheduled_to)
+  # get a value that changes when an event would be played differently
+  def _event_signature(self, event):
+    try:
+      return((event.pitch, event.velocity, event.duration, 
+              tuple(event.bend), tuple(event.aftertouch), 
+              tuple(event.timbre)))
+    except AttributeError: pass
+    try:
+      return((event.number, event.value, event.interpolation))
+    except AttributeError: pass
+    return(None)
+  # send the value each controller has at the current time, and continue
+  #  any ramps that are under way
   def _send_initial_controller_values(self):
     controller_values = dict()
+    ramps = list()
     now = self.transport.time
     for block in self.track:
       if (block.time > now): continue
-      for event in block.events:
-        try:
-          number = event.number
-          value = event.value
-          time = event.time
-        except AttributeError: continue
-        if (time > now): break
+      # get the time in the block's events that's playing now, or that
+      #  played last if the block has ended
+      block_end = block.time + block.duration
+      time = min(now, block_end) - block.time
+      base = block.time
+      repeat = block.events.duration
+      if ((repeat > 0) and (time > repeat)):
+        base += (math.ceil(time / repeat) - 1) * repeat
+        time -= base - block.time
+      for number in block.events.controllers:
+        value = block.events.curve_for_controller(number).value_at(time)
+        if (value is None): continue
         controller_values[number] = value
+        if (now < block_end):
+          ramps.append((block, number, time, base))
     for (number, value) in controller_values.iteritems():
-      self.track.output_for_controller(number).send_value(value, 0.0)
+      self._send_controller_value(number, value, 0.0)
+    for (block, number, time, base) in ramps:
+      self._start_ramp(block, number, time, base, now)
   # schedule some events for playback
   def send(self):
     # if the track is muted, stop current notes and don't send any more
     if (not self.track.enabled):
       self.end_all_notes()
+      # nothing is scheduled while muted, so start scheduling from 
+      #  whenever the track is unmuted instead of counting the time 
+      #  muted as the queue running dry
+      self._scheduled_to = None
       return
     # if we're already scheduled ahead enough, we're done
     now = self.transport.time
     if (self._scheduled_to is None):
       self._scheduled_to = now
-    ahead = now - self._scheduled_to
+    ahead = self._scheduled_to - now
+    telemetry.Playback.record_send(ahead)
+    if (ahead < 0.0):
+      self.transport.schedule_ahead.on_underrun(- ahead)
     if (ahead > self.min_schedule_ahead): return
-    # get the interval to schedule
-    begin = self._scheduled_to
-    end = now + self.max_schedule_ahead
-    # schedule events into the future
+    self._schedule(now)
+  # get a list of tuples of (event, start time, block) for events in the 
+  #  track that start in the given time range
+  def _events_in_range(self, begin, end):
     events = [ ]
     for block in self.track:
       bt = block.time
@@ -734,100 +1150,311 @@ class TrackOutputHandler(observable.Object):
       for event in block.events:
         et = bt + (begin_repeat * repeat) + event.time
         if ((et >= begin) and (et < block_end)):
-          events.append((event, et))
+          events.append((event, et, block))
         # try the note in two places if the time range straddles 
         #  a repeat boundary
         if (end_repeat != begin_repeat):
           et = bt + (end_repeat * repeat) + event.time
           if ((et >= begin) and (et < block_end)):
-            events.append((event, et))
-    # schedule beginnings of events
-    for (event, t1) in events:
-      t2 = t1
-      try:
-        t2 += event.duration
-      except AttributeError: pass
-      pitch = None
+            events.append((event, et, block))
+    return(events)
+  # schedule events from the time scheduled up to so far until the
+  #  maximum schedule-ahead time past the given time, doing work in
+  #  proportion to the number of messages sent
+  def _schedule(self, now):
+    if (profiling.enabled):
+      start_time = time.time()
+    self._last_time = now
+    # forget about messages and events that have already played
+    queued = self._queued
+    while ((len(queued) > 0) and (queued[0][0] <= now)):
+      heapq.heappop(queued)
+    keys = self._queued_event_keys
+    while ((len(keys) > 0) and (keys[0][1] < now)):
+      self._queued_events.pop(keys.popleft(), None)
+    for (note, (start, t)) in self._queued_note_offs.items():
+      if (t <= now):
+        del self._queued_note_offs[note]
+    # get the interval to schedule
+    begin = self._scheduled_to
+    end = now + self.max_schedule_ahead
+    # get events that start in the interval in time order
+    events = self._events_in_range(begin, end)
+    events.sort(key=lambda item: item[1])
+    # send the starts of events, the points of note curves and controller
+    #  ramps, and the ends of notes in the interval in time order, ending 
+    #  notes before starting others at the same time so their channels 
+    #  are free
+    note_offs = self._note_off_heap
+    curves = self._curve_heap
+    ramps = self._ramp_heap
+    i = 0
+    while (True):
+      t = end
+      if ((len(note_offs) > 0) and (note_offs[0][0] < t)):
+        t = note_offs[0][0]
+        source = note_offs
+      if ((len(curves) > 0) and (curves[0][0] < t)):
+        t = curves[0][0]
+        source = curves
+      if ((len(ramps) > 0) and (ramps[0][0] < t)):
+        t = ramps[0][0]
+        source = ramps
+      if ((i < len(events)) and (events[i][1] < t)):
+        t = events[i][1]
+        source = events
+      if (t >= end): break
+      if (source is note_offs):
+        (t, sequence, note) = heapq.heappop(note_offs)
+        self._end_note(note, t, now)
+      elif (source is curves):
+        (t, sequence, note, curve, index) = heapq.heappop(curves)
+        self._send_curve_point(note, curve, index, now)
+      elif (source is ramps):
+        (t, sequence, key) = heapq.heappop(ramps)
+        self._send_ramp_point(key, t, now)
+      else:
+        (event, t, block) = events[i]
+        i += 1
+        self._start_event(event, t, now, block)
+    self._send_held_controller_values(now, end)
+    self._scheduled_to = end
+    if (profiling.enabled):
+      profiling.record('playback.send', time.time() - start_time)
+      profiling.record('playback.events_per_tick', len(events))
+  # send the beginning of an event from a block at the given time
+  def _start_event(self, event, t, now, block):
+    key = (event, t)
+    self._queued_events[key] = self._event_signature(event)
+    self._queued_event_keys.append(key)
+    pitch = None
+    try:
+      pitch = event.pitch
+    except AttributeError: pass
+    # send control changes
+    if (pitch is None):
+      number = None
+      value = None
       try:
-        pitch = event.pitch
+        number = event.number
+        value = event.value
       except AttributeError: pass
-      # start notes
-      if (pitch is not None):
-        velocity = 127
-        try:
-          velocity = int(math.floor(event.velocity * 127.0))
-        except AttributeError: pass
-        event.channel = len(self._note_ends) & 0xF
-        # apply any initial pitch bend to the note
-        if (len(event.bend) > 0):
-          (bt, bend) = event.bend[0]
-          if (bt != 0.0):
-            bend = 0.0
-          current_bend = 0.0
-          if (event.channel in self._channel_bends):
-            current_bend = self._channel_bends[event.channel]
-          if (bend != current_bend):
-            self._send_pitch_bend(event.channel, bend, t1 - now)
-        # begin the note
-        note_on = 0x90 | (event.channel & 0xF)
-        self.port.send((note_on, pitch, velocity), t1 - now)
-        self._note_ends[event] = t2
-      # send control changes
-      else:
-        number = None
-        value = None
-        try:
-          number = event.number
-          value = event.value
-        except AttributeError: pass
-        else:
-          self.track.output_for_controller(number).send_value(value, t1 - now)
-    # schedule pitch bends and aftertouch in the current interval
-    for (note, t) in self._note_ends.iteritems():
-      st = t - note.duration
-      for (bt, bend) in note.bend:
-        bt += st
-        if (bt >= begin) and (bt < end):
-          self._send_pitch_bend(note.channel, bend, bt - now)
-      for (at, velocity) in note.aftertouch:
-        at += st
-        if (at >= begin) and (at < end):
-          aftertouch = 0xA0 | (note.channel & 0xF)
-          self.port.send(
-            (aftertouch, note.pitch, int(velocity * 127.0)), at - now)
-    # schedule ending events if they are in the current interval
-    note_ends = dict()
-    for (note, t) in self._note_ends.iteritems():
-      if ((t >= begin) and (t < end)):
-        self._send_note_off(note, t - now)
       else:
-        note_ends[note] = t
-    self._note_ends = note_ends
-    self._scheduled_to = end
+        self._send_controller_value(number, value, t - now)
+        self._start_ramp(block, number, event.time, t - event.time, t)
+      return
+    # start notes
+    velocity = 127
+    try:
+      velocity = int(math.floor(event.velocity * 127.0))
+    except AttributeError: pass
+    # only notes with their own expression need a channel to themselves,
+    #  so others stay on the channels already in use
+    rotate = ((self.track.zone is not None) or (len(event.bend) > 0) or
+              (len(event.aftertouch) > 0) or (len(event.timbre) > 0))
+    (event.channel, stolen) = self._channels.allocate(event, rotate)
+    # set the channel's pitch bend to where the note's bend starts if
+    #  it's somewhere else, assuming a channel that's never been bent 
+    #  is centered
+    bend = 0.0
+    bend_index = 0
+    if ((len(event.bend) > 0) and (event.bend[0][0] == 0.0)):
+      bend = event.bend[0][1]
+      bend_index = 1
+    if ((bend != 0.0) or 
+        (self._channel_state.get('bend', event.channel) is not None)):
+      self._send_pitch_bend(event.channel, bend, t - now)
+    # begin the note
+    note_on = 0x90 | (event.channel & 0xF)
+    self._send(self.port, (note_on, pitch, velocity), t - now)
+    self._note_starts[event] = t
+    heapq.heappush(self._note_off_heap, 
+      (t + event.duration, next(self._sequence), event))
+    # queue up the first points of its curves
+    if (bend_index < len(event.bend)):
+      heapq.heappush(self._curve_heap, (t + event.bend[bend_index][0], 
+        next(self._sequence), event, event.bend, bend_index))
+    for curve in (event.aftertouch, event.timbre):
+      if (len(curve) > 0):
+        heapq.heappush(self._curve_heap, (t + curve[0][0], 
+          next(self._sequence), event, curve, 0))
+  # send a point on one of a note's curves and queue up the next one
+  def _send_curve_point(self, note, curve, index, now):
+    if ((note not in self._note_starts) or (index >= len(curve))): return
+    start = self._note_starts[note]
+    (t, value) = curve[index]
+    t += start
+    if (curve is note.bend):
+      self._send_pitch_bend(note.channel, value, t - now)
+    elif (curve is note.aftertouch):
+      self._send_pressure(note, value, t - now)
+    else:
+      self._send_timbre(note.channel, value, t - now)
+    index += 1
+    if (index < len(curve)):
+      heapq.heappush(self._curve_heap, (start + curve[index][0],
+        next(self._sequence), note, curve, index))
+  # get the ramp from the controller value in effect at the given time in 
+  #  a block's events, given the absolute time the block's events start
+  #  repeating from, as a tuple of (curve, index, ramp, end time) where 
+  #  the ramp is None if the value holds steady
+  def _find_ramp(self, block, number, time, base):
+    curve = block.events.curve_for_controller(number)
+    index = curve.index_at(time)
+    ramp = curve.ramp(index)
+    end = None
+    if (ramp is not None):
+      end = min(base + ramp[3], block.time + block.duration)
+    return((curve, index, ramp, end))
+  # start sending values along the ramp from the controller value at the
+  #  given time in a block's events, if there is one, beginning after the 
+  #  given absolute time
+  def _start_ramp(self, block, number, time, base, after):
+    found = self._find_ramp(block, number, time, base)
+    if (found[2] is None): return
+    key = (block, number, base + found[2][0])
+    self._ramps[key] = (base,) + found
+    self._push_ramp_point(key, after)
+  # queue the first point of a ramp at or after the given absolute time,
+  #  on a grid of the controller's resolution from the start of the ramp
+  def _push_ramp_point(self, key, after):
+    (base, curve, index, ramp, end) = self._ramps[key]
+    start = key[2]
+    resolution = self._output_for_controller(key[1]).resolution
+    k = max(1, int(math.ceil((after - start) / resolution)))
+    t = start + (k * resolution)
+    if (t >= end):
+      del self._ramps[key]
+      return
+    heapq.heappush(self._ramp_heap, (t, next(self._sequence), key))
+  # send a point along a ramp and queue up the next one
+  def _send_ramp_point(self, key, t, now):
+    if (key not in self._ramps): return
+    (base, curve, index, ramp, end) = self._ramps[key]
+    number = key[1]
+    self._send_controller_value(number, curve.interpolate(index, t - base), 
+                                t - now)
+    # compute the next time from the start so errors don't accumulate
+    start = key[2]
+    resolution = self._output_for_controller(number).resolution
+    t = start + ((int(round((t - start) / resolution)) + 1) * resolution)
+    if (t >= end):
+      del self._ramps[key]
+      return
+    heapq.heappush(self._ramp_heap, (t, next(self._sequence), key))
+  # send the end of a note, given the end time from the heap
+  def _end_note(self, note, t, now):
+    if (note not in self._note_starts): return
+    start = self._note_starts[note]
+    # if the duration has changed, put it back at its new time
+    end = start + note.duration
+    if (end != t):
+      heapq.heappush(self._note_off_heap, (end, next(self._sequence), note))
+      return
+    self._send_note_off(note, max(0.0, t - now))
+    del self._note_starts[note]
+    self._queued_note_offs[note] = (start, t)
+    self._channels.release(note)
+  # send a message to a port after the given delay, remembering it until
+  #  it plays in case it needs to be canceled
+  def _send(self, port, data, time):
+    port.send(data, time)
+    self._remember(port, data, time)
+  def _remember(self, port, data, time):
+    if (time > 0.0):
+      heapq.heappush(self._queued, 
+        (self._last_time + time, next(self._sequence), port, data))
+  # get the output to send a controller's values through
+  def _output_for_controller(self, number):
+    return(self.track.output_for_controller(number))
+  # send a control change through the track's output for the controller,
+  #  which drops values that wouldn't change anything
+  def _send_controller_value(self, number, value, time):
+    output = self._output_for_controller(number)
+    self._controller_numbers.add(number)
+    for data in output.send_value(value, time, self._last_time + time):
+      self._remember(output.source_port, data, time)
+  # send controller values held back by rate limiting that can go out
+  #  before the given time
+  def _send_held_controller_values(self, now, until):
+    for number in self._controller_numbers:
+      output = self._output_for_controller(number)
+      if (not output.holding): continue
+      held = output.send_held_value(now, until)
+      if (held is None): continue
+      (at, messages) = held
+      for data in messages:
+        self._remember(output.source_port, data, at - now)
+  # make controller outputs send their next values even if they're the
+  #  same as the last ones sent
+  def _reset_controller_outputs(self):
+    for number in self._controller_numbers:
+      self._output_for_controller(number).reset()
   # send a note-off event
   def _send_note_off(self, note, time=0.0):
     note_off = 0x80 | (note.channel & 0xF)
-    self.port.send((note_off, note.pitch, 0), time)
-  # send a pitch bend
+    self._send(self.port, (note_off, note.pitch, 0), time)
+  # send a pitch bend in semitones if it would change the channel's bend
   def _send_pitch_bend(self, channel, bend, time):
-    bend = bend * (float(0x4000) / self.track.bend_range)
-    bend = min(max(0x0000, int(float(0x2000) + bend)), 0x4000)
-    msb = (bend >> 7) & 0x7F
-    lsb = bend & 0x7F
+    value = mpe.encode_bend(bend, self.track.bend_range)
+    if (not self._channel_state.update('bend', channel, value)): return
     pitch_bend = 0xE0 | (channel & 0xF)
-    self.port.send((pitch_bend, lsb, msb), time)
-    self._channel_bends[channel] = bend
+    self._send(self.port, (pitch_bend, value & 0x7F, (value >> 7) & 0x7F), 
+               time)
+  # send aftertouch for a note, which is channel pressure in an MPE zone
+  #  and polyphonic aftertouch otherwise, if it would change anything
+  def _send_pressure(self, note, value, time):
+    value = int(value * 127.0)
+    if (self.track.zone is not None):
+      if (not self._channel_state.update('pressure', note.channel, value)):
+        return
+      self._send(self.port, (0xD0 | (note.channel & 0xF), value), time)
+    else:
+      if (not self._channel_state.update(
+          ('aftertouch', note.pitch), note.channel, value)): return
+      self._send(self.port, 
+        (0xA0 | (note.channel & 0xF), note.pitch, value), time)
+  # send a note's timbre as controller 74 on its channel
+  def _send_timbre(self, channel, value, time):
+    value = int(round(value * 127.0))
+    if (not self._channel_state.update('timbre', channel, value)): return
+    self._send(self.port, 
+      (0xB0 | (channel & 0xF), mpe.TIMBRE_CONTROLLER, value), time)
   # schedule endings for all currently playing notes
   def end_all_notes(self):
-    # clear any pending events in the send queue
-    self.port.clear_send()
-    for (note, t) in self._note_ends.iteritems():
+    # clear any pending events in the send queues, which may include
+    #  note-offs for notes that are still sounding
+    ports = set([ message[2] for message in self._queued ])
+    ports.add(self.port)
+    for port in ports:
+      port.clear_send()
+    # get channels whose bend may not be centered, including ones with
+    #  bends that were just canceled
+    bent_channels = set([ message[3][0] & 0xF for message in self._queued 
+                          if (message[3][0] & 0xF0) == 0xE0 ])
+    for channel in self._channel_state.channels('bend'):
+      if (self._channel_state.get('bend', channel) != mpe.BEND_CENTER):
+        bent_channels.add(channel)
+    self._queued = list()
+    self._queued_events = dict()
+    self._queued_event_keys.clear()
+    for note in self._note_starts.iterkeys():
+      self._send_note_off(note, 0.0)
+    for note in self._queued_note_offs.iterkeys():
       self._send_note_off(note, 0.0)
-    # zero pitch bends on all channels
-    for (channel, bend) in self._channel_bends.iteritems():
-      if (bend != 0.0):
-        self._send_pitch_bend(channel, 0.0, 0.0)
-    self._note_ends = dict()
+    # center pitch bends
+    self._channel_state.reset()
+    self._reset_controller_outputs()
+    for channel in bent_channels:
+      self._send_pitch_bend(channel, 0.0, 0.0)
+    self._note_starts = dict()
+    self._note_off_heap = list()
+    self._curve_heap = list()
+    self._ramps = dict()
+    self._ramp_heap = list()
+    self._queued_note_offs = dict()
+    self._channels.reset()
   # stop playback
   def stop(self):
+    self.track.remove_observer(self.on_track_change)
     self.end_all_notes()
\ No newline at end of file
@@ -509,9 +509,9 @@ class TrackListOutputLayout(view.ListLayout):
     self.view_scale = view_scale
     view.ListLayout.__init__(self, parent, tracks, 
                              lambda t: TrackOutputLayout(self, t, view_scale))
-    self.view_scale.add_observer(self.layout)
+    self.view_scale.add_observer(self._layout)
   def destroy(self):
-    self.view_scale.remove_observer(self.layout)
+    self.view_scale.remove_observer(self._layout)
     view.ListLayout.destroy(self)
   def layout(self):
     r = self._rect
@@ -531,12 +531,12 @@ class TrackOutputLayout(view.ListLayout):
                              lambda t: unit_view.UnitOutputView(t))
     self.note_output_view.setParentItem(self)
     self.track.add_observer(self.on_track_change)
-    self.view_scale.add_observer(self.layout)
+    self.view_scale.add_observer(self._layout)
     self.on_track_change()
   def destroy(self):
     self.note_output_view.destroy()
     self.track.remove_observer(self.on_track_change)
-    self.view_scale.remove_observer(self.layout)
+    self.view_scale.remove_observer(self._layout)
     view.ListLayout.destroy(self)
   def on_track_change(self):
     self.items = tuple(self.track.controller_outputs)
@@ -1,4 +1,5 @@
-import jackpatch
+from backend import jackpatch
+import time
 import collections
 
 from PySide.QtCore import Signal, QTimer
@@ -7,6 +8,8 @@ import observable
 import serializable
 import unit
 import midi
+import telemetry
+import schedule
 from undo import UndoManager
 
 # a transport to keep track of timepoints, playback, and recording
@@ -24,13 +27,19 @@ class Transport(observable.Object, unit.Sink):
     # set the interval to update at
     self.update_interval = 0.5
     # get a bridge to the JACK transport
-    self._client = jackpatch.Client('jackdaw-transport')
-    self._client.activate()
+    self._client = unit.JackClient.client
     self._transport = jackpatch.Transport(client=self._client)
     # make a timer to update the transport model when the time changes
     self._update_timer = QTimer(self)
     self._update_timer.setInterval(self.update_interval * 1000)
     self._update_timer.timeout.connect(self.update_timeout)
+    # the wall-clock time of the last update while rolling and the interval
+    #  it asked for, used to measure how late the timer fires
+    self._last_tick_time = None
+    self._last_tick_interval = None
+    # decide how far ahead of the transport to queue events for playback
+    #  based on how late updates are in practice
+    self.schedule_ahead = schedule.ScheduleAhead()
     # set up internal state
     self._recording = False
     self._cycling = cycling
@@ -58,11 +67,11 @@ class Transport(observable.Object, unit.Sink):
     self.skip_delta = 1.0 # seconds
     # make a port and client for transport control
     self._sink_type = 'midi'
-    self._sink_port = jackpatch.Port(name='midi.RX', client=self._client,
-                                     flags=jackpatch.JackPortIsInput)
-    self._source_port = jackpatch.Port(client=self._client,
-                                       name="midi.TX", 
-                                       flags=jackpatch.JackPortIsOutput)
+    self._port_namespace = unit.JackClient.make_namespace('transport')
+    self._sink_port = unit.JackClient.make_port(self._port_namespace,
+      'midi.RX', jackpatch.JackPortIsInput)
+    self._source_port = unit.JackClient.make_port(self._port_namespace,
+      'midi.TX', jackpatch.JackPortIsOutput)
     self._input_handler = None
     self._protocol = None
     self.protocol = protocol
@@ -200,7 +209,19 @@ class Transport(observable.Object, unit.Sink):
     #  the real transport
     self._local_is_rolling = None
     self._local_time = None
+    # measure the time since the last update while rolling
+    now = time.time()
+    if ((is_rolling) and (self._last_tick_time is not None)):
+      elapsed = now - self._last_tick_time
+      telemetry.Playback.record_tick(self._last_tick_interval, elapsed)
+      self.schedule_ahead.on_tick(self._last_tick_interval, 
+        elapsed - self._last_tick_interval)
     self.update(is_rolling=is_rolling, current_time=current_time)
+    if (is_rolling):
+      self._last_tick_time = now
+      self._last_tick_interval = self._update_timer.interval() / 1000.0
+    else:
+      self._last_tick_time = None
   def update(self, is_rolling=None, current_time=None):
     if (is_rolling is None):
       is_rolling = self.is_rolling
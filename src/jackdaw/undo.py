@@ -3,6 +3,7 @@ from PySide.QtCore import *
 import types
 import collections
 import observable
+import profiling
 from model import Selection
 
 # manage a stack of states to implement undo/redo functionality
@@ -15,6 +16,8 @@ class UndoStack(object):
   # store the state of the given objects before changes are made
   def begin_action(self, things):
     self._begin_state = self.save_state(things)
+    if (profiling.enabled):
+      profiling.record('undo.snapshot_size', len(self._begin_state))
   # add items to the beginning state
   def add_to_action(self, things):
     new_state = self.save_state(things)
@@ -28,6 +31,8 @@ class UndoStack(object):
     # see what changed in the course of the action
     begin_state = self._begin_state
     end_state = self.save_state(things)
+    if (profiling.enabled):
+      profiling.record('undo.snapshot_size', len(end_state))
     keys = end_state.keys()
     for key in keys:
       if ((key in begin_state) and 
@@ -1,4 +1,5 @@
-import jackpatch
+import collections
+from backend import jackpatch
 
 import serializable
 from model import Model, ModelList
@@ -214,10 +215,75 @@ class Sink(object):
         self.on_change()
       except AttributeError: pass
 
+# host the ports of all units on one JACK client, since every active client
+#  costs the server a process thread and work to reorder the graph
+class JackClientSingleton(QObject):
+  # emitted when ports are registered or unregistered
+  ports_changed = Signal()
+  # emitted when ports are connected or disconnected
+  connections_changed = Signal()
+  def __init__(self, name='jackdaw'):
+    QObject.__init__(self)
+    self.name = name
+    self._client = None
+    # the number of namespaces handed out for each prefix
+    self._namespace_counts = collections.defaultdict(int)
+    self._notifies_port_registration = False
+    self._notifies_port_connect = False
+  # lazily make and activate the client
+  @property
+  def client(self):
+    if (self._client is None):
+      self._client = jackpatch.Client(self.name)
+      # JACK only accepts callbacks before a client is activated, and
+      #  calls them on its own thread, so we pass them to the main 
+      #  thread with signals
+      try:
+        self._client.set_port_registration_callback(
+          self._on_port_registration)
+        self._notifies_port_registration = True
+      except AttributeError: pass
+      try:
+        self._client.set_port_connect_callback(self._on_port_connect)
+        self._notifies_port_connect = True
+      except AttributeError: pass
+      self._client.activate()
+    return(self._client)
+  # get whether the ports_changed and connections_changed signals will 
+  #  be emitted, which depends on the version of jackpatch
+  @property
+  def notifies_port_registration(self):
+    return((self.client is not None) and (self._notifies_port_registration))
+  @property
+  def notifies_port_connect(self):
+    return((self.client is not None) and (self._notifies_port_connect))
+  def _on_port_registration(self, *args):
+    self.ports_changed.emit()
+  def _on_port_connect(self, *args):
+    self.connections_changed.emit()
+  # get a unique prefix for port names so that units of the same kind
+  #  don't collide on the shared client, e.g. 'track-3'
+  def make_namespace(self, prefix):
+    self._namespace_counts[prefix] += 1
+    return('%s-%d' % (prefix, self._namespace_counts[prefix]))
+  # make a port on the shared client with a name in the given namespace
+  def make_port(self, namespace, name, flags):
+    if (namespace):
+      name = namespace+'.'+name
+    return(jackpatch.Port(client=self.client, name=name, flags=flags))
+JackClient = JackClientSingleton()
+
 # represent a connection between a source and sink
 class Connection(Model):
-  # keep a central JACK client for managing connections between ports
-  jack_client = None
+  # this is emitted with the connection when its source or sink changes
+  endpoints_changed = Signal(object)
+  # the nesting level of routing transactions
+  _routing_level = 0
+  # requested changes to JACK connections in the current transaction as
+  #  tuples of (source port, sink port, connected) keyed by port names
+  _routing_changes = collections.OrderedDict()
+  # endpoints to notify once routing changes have propagated, keyed by id
+  _changed_endpoints = collections.OrderedDict()
   def __init__(self, source=None, sink=None, hue=None):
     Model.__init__(self)
     self._source = None
@@ -254,12 +320,11 @@ class Connection(Model):
         try:
           self._source.add_observer(self.on_change)
         except AttributeError: pass
+      self.endpoints_changed.emit(self)
       self.on_change()
       # update the old source after a delay, to allow 
       #  disconnection requests to propagate through JACK
-      try:
-        QTimer.singleShot(10, old_source.on_change)
-      except AttributeError: pass
+      Connection._notify_endpoint(old_source)
   @property
   def sink(self):
     return(self._sink)
@@ -279,12 +344,11 @@ class Connection(Model):
         try:
           self._sink.add_observer(self.on_change)
         except AttributeError: pass
+      self.endpoints_changed.emit(self)
       self.on_change()
-      # update the old source after a delay, to allow 
+      # update the old sink after a delay, to allow 
       #  disconnection requests to propagate through JACK
-      try:
-        QTimer.singleShot(10, old_sink.on_change)
-      except AttributeError: pass
+      Connection._notify_endpoint(old_sink)
   # the hue to draw the connection in (0.0 - 1.0 or None for no color)
   @property
   def hue(self):
@@ -294,11 +358,69 @@ class Connection(Model):
     if (self._hue != value):
       self._hue = value
       self.on_change()
-  # lazy-load a jack client to make patchbay connections
-  def get_jack_client(self):
-    if (Connection.jack_client is None):
-      Connection.jack_client = jackpatch.Client('jackdaw-patchbay')
-    return(Connection.jack_client)
+  # get the jack client to make patchbay connections with
+  @classmethod
+  def get_jack_client(cls):
+    return(JackClient.client)
+  # group routing changes so they're applied to JACK all at once when the
+  #  outermost transaction ends, skipping any that cancel out or are
+  #  already in effect
+  @classmethod
+  def begin_routing(cls):
+    cls._routing_level += 1
+  @classmethod
+  def end_routing(cls):
+    cls._routing_level = max(0, cls._routing_level - 1)
+    if (cls._routing_level == 0):
+      cls._apply_routing()
+  @classmethod
+  def _apply_routing(cls):
+    changes = cls._routing_changes
+    if (len(changes) == 0): return
+    cls._routing_changes = collections.OrderedDict()
+    client = cls.get_jack_client()
+    # get the existing connections of each source port once
+    existing = dict()
+    for ((source_name, sink_name), (source_port, sink_port, connected)) in \
+        changes.iteritems():
+      if (source_name not in existing):
+        existing[source_name] = cls._get_port_connections(source_port)
+      current = existing[source_name]
+      if ((current is not None) and ((sink_name in current) == connected)):
+        continue
+      if (connected):
+        client.connect(source_port, sink_port)
+      else:
+        client.disconnect(source_port, sink_port)
+  # get the names of the ports the given port is connected to, or None
+  #  if the JACK binding can't tell us
+  @classmethod
+  def _get_port_connections(cls, port):
+    try:
+      connections = port.get_connections()
+    except AttributeError:
+      return(None)
+    return(set([ (p if isinstance(p, basestring) else p.name) 
+                 for p in connections ]))
+  # notify an endpoint of routing changes after a delay to allow 
+  #  connection requests to propagate through JACK, notifying each 
+  #  endpoint only once for a group of changes
+  @classmethod
+  def _notify_endpoint(cls, endpoint):
+    if ((endpoint is None) or (not hasattr(endpoint, 'on_change'))): return
+    if (len(cls._changed_endpoints) == 0):
+      QTimer.singleShot(10, cls._notify_endpoints)
+    cls._changed_endpoints[id(endpoint)] = endpoint
+  @classmethod
+  def _notify_endpoints(cls):
+    endpoints = cls._changed_endpoints
+    cls._changed_endpoints = collections.OrderedDict()
+    for endpoint in endpoints.itervalues():
+      # let endpoints that care about routing react without having to
+      #  check for it on every change
+      if (hasattr(endpoint, 'on_routing_change')):
+        endpoint.on_routing_change()
+      endpoint.on_change()
   # propagate port and connection changes to JACK
   def on_change(self):
     source_port = self._source.source_port if (self._source is not None) else None
@@ -325,7 +447,6 @@ class Connection(Model):
     Model.on_change(self)
   # connect or disconnect a source and sink (either ports or port tuples)
   def route(self, source, sink, connected=True):
-    client = self.get_jack_client()
     # cast both ends to be tuples
     if (isinstance(source, jackpatch.Port)):
       source = (source,)
@@ -333,13 +454,18 @@ class Connection(Model):
       sink = (sink,)
     source_ports = len(source)
     sink_ports = len(sink)
-    for i in range(0, max(source_ports, sink_ports)):
-      source_port = source[min(i, source_ports - 1)]
-      sink_port = sink[min(i, sink_ports - 1)]
-      if (connected):
-        client.connect(source_port, sink_port)
-      else:
-        client.disconnect(source_port, sink_port)
+    Connection.begin_routing()
+    try:
+      for i in range(0, max(source_ports, sink_ports)):
+        source_port = source[min(i, source_ports - 1)]
+        sink_port = sink[min(i, sink_ports - 1)]
+        # a later request for the same ports replaces an earlier one
+        key = (source_port.name, sink_port.name)
+        Connection._routing_changes.pop(key, None)
+        Connection._routing_changes[key] = (source_port, sink_port,
+                                            connected)
+    finally:
+      Connection.end_routing()
   # disconnect when deleted
   def __del__(self):
     if (self._source is not None):
@@ -355,13 +481,9 @@ class Connection(Model):
   # notify the endpoints when something changes, after a delay to allow 
   #  disconnection requests to propagate through JACK
   def _on_source_changed(self):
-    try:
-      QTimer.singleShot(10, self._source.on_change)
-    except AttributeError: pass
+    Connection._notify_endpoint(self._source)
   def _on_sink_changed(self):
-    try:
-      QTimer.singleShot(10, self._sink.on_change)
-    except AttributeError: pass
+    Connection._notify_endpoint(self._sink)
   def _on_route_changed(self):
     self._on_source_changed()
     self._on_sink_changed()
@@ -379,50 +501,100 @@ serializable.add(Connection)
 # represent a patch bay that maintains connections between units
 class PatchBay(ModelList):
   def __init__(self, connections=()):
+    # index sources by sink and sinks by source
+    self._source_map = dict()
+    self._sink_map = dict()
+    # index connections by the units at either end
+    self._connections_by_unit = dict()
+    # the (source, sink) each connection was indexed with, keyed by id
+    self._indexed_endpoints = dict()
     ModelList.__init__(self, connections)
-  def invalidate(self):
-    self._source_map = None
-    self._sink_map = None
-  # make a mapping that indexes sources by sink
-  def _make_source_map(self):
-    if (self._source_map is None):
-      self._source_map = dict()
-      for c in self:
-        if (c.sink not in self._source_map):
-          self._source_map[c.sink] = list()
-        self._source_map[c.sink].append(c.source)
-    return(self._source_map)
-  # make a mapping that indexes sinks by source
-  def _make_sink_map(self):
-    if (self._sink_map is None):
-      self._sink_map = dict()
-      for c in self:
-        if (c.source not in self._sink_map):
-          self._sink_map[c.source] = list()
-        self._sink_map[c.source].append(c.sink)
-    return(self._sink_map)
+  # keep the indices up to date as connections are added and removed
+  def _add_item(self, item):
+    ModelList._add_item(self, item)
+    self._index_connection(item)
+    item.endpoints_changed.connect(self._on_endpoints_changed)
+  def _remove_item(self, item):
+    try:
+      item.endpoints_changed.disconnect(self._on_endpoints_changed)
+    except RuntimeError: pass
+    self._unindex_connection(item)
+    ModelList._remove_item(self, item)
+  def _on_endpoints_changed(self, connection):
+    entry = self._indexed_endpoints.get(id(connection))
+    if (entry is None): return
+    (source, sink, count) = entry
+    if ((source is connection.source) and (sink is connection.sink)): return
+    for i in range(0, count):
+      self._unindex_connection(connection)
+    for i in range(0, count):
+      self._index_connection(connection)
+  # index each time a connection is in the list, since it can be
+  #  in the list more than once
+  def _index_connection(self, c):
+    key = id(c)
+    if (key in self._indexed_endpoints):
+      entry = self._indexed_endpoints[key]
+      entry[2] += 1
+      (source, sink) = (entry[0], entry[1])
+    else:
+      (source, sink) = (c.source, c.sink)
+      self._indexed_endpoints[key] = [ source, sink, 1 ]
+      for unit in (source, sink):
+        if (unit is not None):
+          self._connections_by_unit.setdefault(unit, set()).add(c)
+    self._source_map.setdefault(sink, list()).append(source)
+    self._sink_map.setdefault(source, list()).append(sink)
+  def _unindex_connection(self, c):
+    key = id(c)
+    entry = self._indexed_endpoints.get(key)
+    if (entry is None): return
+    (source, sink) = (entry[0], entry[1])
+    self._remove_from_map(self._source_map, sink, source)
+    self._remove_from_map(self._sink_map, source, sink)
+    entry[2] -= 1
+    if (entry[2] > 0): return
+    del self._indexed_endpoints[key]
+    for unit in (source, sink):
+      connections = self._connections_by_unit.get(unit)
+      if (connections is None): continue
+      connections.discard(c)
+      if (len(connections) == 0):
+        del self._connections_by_unit[unit]
+  def _remove_from_map(self, m, key, value):
+    values = m.get(key)
+    if (values is None): return
+    for i in range(0, len(values)):
+      if (values[i] is value):
+        del values[i]
+        break
+    if (len(values) == 0):
+      del m[key]
   # get a list of all sinks connected to the given source
   def sources_for_sink(self, sink):
-    m = self._make_source_map()
-    if (sink in m):
-      return(m[sink])
+    if (sink in self._source_map):
+      return(self._source_map[sink])
     return(())
   # get a list of all sources connected to the given sink
   def sinks_for_source(self, source):
-    m = self._make_sink_map()
-    if (source in m):
-      return(m[source])
+    if (source in self._sink_map):
+      return(self._sink_map[source])
     return(())
+  # get all connections to or from the given unit
+  def connections_for_unit(self, unit):
+    return(tuple(self._connections_by_unit.get(unit, ())))
   # remove connections for the given source/sink
   def remove_connections_for_unit(self, unit):
-    remove_connections = set()
-    for c in self:
-      if ((c.source is unit) or (c.sink is unit)):
-        remove_connections.add(c)
-    for c in remove_connections:
-      c.source = None
-      c.sink = None
-      self.remove(c)
+    remove_connections = self.connections_for_unit(unit)
+    if (len(remove_connections) == 0): return
+    Connection.begin_routing()
+    try:
+      for c in remove_connections:
+        c.source = None
+        c.sink = None
+        self.remove(c)
+    finally:
+      Connection.end_routing()
   def serialize(self):
     return({
       'connections': list(self)
@@ -1,13 +1,24 @@
 import math
+import time
 
 from PySide.QtCore import *
 from PySide.QtGui import *
 
 import observable
+import profiling
 from model import Selection
 from undo import UndoManager
 import menu
 
+# do layout for a view, recording how long it takes if profiling is enabled
+def _do_timed_layout(view):
+  if (not profiling.enabled):
+    view.layout()
+    return
+  start_time = time.time()
+  view.layout()
+  profiling.record('layout.'+type(view).__name__, time.time() - start_time)
+
 # make a mixin that adds parent searching
 class ParentSeekable(object):
   # get the nearest item in the parent chain that has the given class
@@ -103,13 +114,13 @@ class View(ParentSeekable, QGraphicsObject):
                     (cr.intersects(self.boundingRect())))
     # redo layout if the view can be seen
     if (self.isVisible()):
-      self.layout()
+      self._layout()
   # redo layout when the item is made visible
   def setVisible(self, visible):
     was_visible = self.isVisible()
     QGraphicsObject.setVisible(self, visible)
     if ((not was_visible) and (visible)):
-      self.layout()
+      self._layout()
   # make a default implementation of the bounding box
   def boundingRect(self):
     r = self.rect()
@@ -132,12 +143,14 @@ class View(ParentSeekable, QGraphicsObject):
     return(QGraphicsItem.itemChange(self, change, value))
   # respond to being added to or removed from a scene
   def on_added_to_scene(self):
-    self.layout()
+    self._layout()
   def on_removed_from_scene(self):
     pass
   # do layout of subviews
   def layout(self):
     pass
+  def _layout(self):
+    _do_timed_layout(self)
   # redraw the view
   def paint(self, qp, options, widget):
     # clip if needed
@@ -164,10 +177,10 @@ class ModelView(View):
     View.__init__(self, parent)
     self._model = model
     self._model.add_observer(self.update)
-    self._model.add_observer(self.layout)
+    self._model.add_observer(self._layout)
   def destroy(self):
     self._model.remove_observer(self.update)
-    self._model.remove_observer(self.layout)
+    self._model.remove_observer(self._layout)
     View.destroy(self)
   @property
   def model(self):
@@ -662,7 +675,7 @@ class ListLayout(ParentSeekable, QGraphicsObject):
           view.setParentItem(self)
           self._view_map[item] = view
           try:
-            item.add_observer(self.layout)
+            item.add_observer(self._layout)
           except AttributeError: pass
         views.append(view)
     self._views = views
@@ -670,7 +683,7 @@ class ListLayout(ParentSeekable, QGraphicsObject):
       view = self._view_map[item]
       del self._view_map[item]
       try:
-        item.remove_observer(self.layout)
+        item.remove_observer(self._layout)
       except AttributeError: pass
       try:
         view.destroy()
@@ -683,10 +696,12 @@ class ListLayout(ParentSeekable, QGraphicsObject):
   def _do_layout(self):
     if (self._in_layout): return
     self._in_layout = True
-    self.layout()
+    self._layout()
     self._in_layout = False
   def layout(self):
     pass
+  def _layout(self):
+    _do_timed_layout(self)
 
 class VBoxLayout(ListLayout):
   def __init__(self, *args, **kwargs):
@@ -1,6 +1,7 @@
 import os
 import sys
 import re
+import math
 import yaml
 import icon
 
@@ -8,6 +9,7 @@ from PySide.QtCore import *
 from PySide.QtGui import *
 
 import doc
+import sampler
 from doc_view import DocumentView
 from undo import UndoManager
 
@@ -20,6 +22,11 @@ class DocumentWindow(QMainWindow):
     # start with no document
     self._document = None
     self.document_view = None
+    # the background save in progress, if any
+    self._saver = None
+    # show the progress of loading instruments
+    self._showing_load_progress = False
+    sampler.LinuxSampler.loader.add_observer(self.on_instrument_progress)
     # make a stack to hold the document
     self.stack = QStackedWidget(self)
     self.setCentralWidget(self.stack)
@@ -238,14 +245,54 @@ class DocumentWindow(QMainWindow):
     if (not self.document.path):
       self.file_save_as()
     else:
-      self.document.save()
+      self._save_in_background()
   # save the document with a different file name
   def file_save_as(self):
     (path, group) = QFileDialog.getSaveFileName(self,
         "Save Project", "~", "Project Files (*.jdp *.yml);;All Files (*.*)")
     if (len(path) == 0): return
     self.document.path = path
-    self.document.save()
+    self._save_in_background()
+  # write the document on a worker thread so playback and the UI 
+  #  don't stall while it's being encoded
+  def _save_in_background(self):
+    if (self._saver is not None):
+      self._saver.remove_observer(self.on_save_progress)
+    self._saver = self.document.save_in_background()
+    self._saver.add_observer(self.on_save_progress)
+    self.on_save_progress()
+  # show the progress of a background save in the status bar
+  def on_save_progress(self):
+    saver = self._saver
+    if (saver is None): return
+    if (saver.saving):
+      self.statusBar().showMessage(
+        'Saving %s... %d%%' % (os.path.basename(saver.path), 
+                               int(saver.progress * 100.0)))
+      return
+    saver.remove_observer(self.on_save_progress)
+    self._saver = None
+    if (saver.error is not None):
+      self.statusBar().showMessage(
+        'Failed to save %s: %s' % (saver.path, saver.error))
+    else:
+      self.statusBar().showMessage(
+        'Saved %s' % os.path.basename(saver.path), 2000)
+  # show the progress of loading instruments in the status bar
+  def on_instrument_progress(self):
+    loader = sampler.LinuxSampler.loader
+    if (not loader.loading):
+      if (self._showing_load_progress):
+        self._showing_load_progress = False
+        self.statusBar().showMessage('Loaded instruments', 2000)
+      return
+    self._showing_load_progress = True
+    message = 'Loading instruments (%d of %d done)... %d%%' % (
+      loader.finished_count, loader.count, int(loader.progress * 100.0))
+    eta = loader.eta
+    if (eta is not None):
+      message += ', about %d seconds left' % int(math.ceil(eta))
+    self.statusBar().showMessage(message)
   
   # undo
   def edit_undo(self):
@@ -19,6 +19,7 @@ import audio
 import audio_view
 import transport
 import transport_view
+import debug_view
 from model import Selection
 
 # show a workspace with a list of units